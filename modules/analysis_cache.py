@@ -0,0 +1,182 @@
+import os
+import json
+import pickle
+import shutil
+import hashlib
+import tempfile
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+import modules.globals
+from modules.face_store import FrameFaceStore
+
+CACHE_VERSION = 1
+HASH_BLOCK_SIZE = 1024 * 1024
+# column files of a cached FrameFaceStore, in constructor order
+STORE_COLUMNS = ('frame_numbers', 'bbox', 'kps', 'landmark_2d_106', 'has_landmark', 'det_score', 'embedding', 'centroid')
+FILE_HASHES: Dict[Tuple[str, int, float], str] = {}  # (path, size, mtime) -> sha256, so a target is hashed once per session
+FILE_HASHES_LOCK = threading.Lock()
+
+
+def get_cache_directory() -> str:
+    return modules.globals.analysis_cache_dir or os.path.join(os.path.expanduser('~'), '.cache', 'deep-live-cam', 'analysis')
+
+
+def get_file_hash(file_path: str) -> str:
+    file_path = os.path.abspath(file_path)
+    stat = os.stat(file_path)
+    file_key = (file_path, stat.st_size, stat.st_mtime)
+    with FILE_HASHES_LOCK:
+        if file_key in FILE_HASHES:
+            return FILE_HASHES[file_key]
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b''):
+            sha256.update(block)
+    with FILE_HASHES_LOCK:
+        FILE_HASHES[file_key] = sha256.hexdigest()
+    return FILE_HASHES[file_key]
+
+
+def get_cache_key(target_path: str, kind: str, config: Dict[str, Any]) -> str:
+    """Content hash of the target plus everything that changes the detections (see face_analyser.get_analysis_config)."""
+    payload = json.dumps({'version': CACHE_VERSION, 'kind': kind, 'target': get_file_hash(target_path), 'config': config}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def get_entry_size(entry_path: str) -> int:
+    if os.path.isfile(entry_path):
+        return os.path.getsize(entry_path)
+    return sum(os.path.getsize(os.path.join(entry_path, name)) for name in os.listdir(entry_path))
+
+
+def touch_entry(entry_path: str) -> None:
+    # the mtime is the last use, so the LRU order survives restarts
+    try:
+        os.utime(entry_path)
+    except OSError:
+        pass
+
+
+def evict_analyses(keep_path: Optional[str] = None) -> None:
+    """Removes the least recently used analyses and source faces until the cache fits analysis_cache_max_gb."""
+    max_bytes = int(modules.globals.analysis_cache_max_gb * 1024 ** 3)
+    cache_directory = get_cache_directory()
+    sources_directory = os.path.join(cache_directory, 'sources')
+    entries = []
+    try:
+        candidates = [os.path.join(cache_directory, name) for name in os.listdir(cache_directory) if name != 'sources']
+        if os.path.isdir(sources_directory):
+            candidates += [os.path.join(sources_directory, name) for name in os.listdir(sources_directory) if name.endswith('.pkl')]
+        for entry_path in candidates:
+            # directories without meta.json are saves in progress
+            if os.path.isdir(entry_path) and not os.path.isfile(os.path.join(entry_path, 'meta.json')):
+                continue
+            entries.append((os.path.getmtime(entry_path), entry_path, get_entry_size(entry_path)))
+    except OSError as e:
+        print(f'[DLC.ANALYSIS-CACHE] Could not scan {cache_directory}: {e}')
+        return
+    total = sum(size for _, _, size in entries)
+    for _, entry_path, size in sorted(entries):
+        if total <= max_bytes:
+            break
+        if entry_path == keep_path:
+            continue
+        if os.path.isdir(entry_path):
+            shutil.rmtree(entry_path, ignore_errors=True)
+        else:
+            try:
+                os.remove(entry_path)
+            except OSError:
+                continue
+        total -= size
+
+
+def is_cache_enabled(target_path: Optional[str]) -> bool:
+    return modules.globals.analysis_cache and bool(target_path) and os.path.isfile(target_path)
+
+
+def load_analysis(target_path: str, kind: str, config: Dict[str, Any]) -> Optional[Tuple[FrameFaceStore, Optional[np.ndarray]]]:
+    """Returns the cached (face store, centroids) of the target, memory-mapped, or None on a miss."""
+    if not is_cache_enabled(target_path):
+        return None
+    cache_path = os.path.join(get_cache_directory(), get_cache_key(target_path, kind, config))
+    if not os.path.isfile(os.path.join(cache_path, 'meta.json')):
+        return None
+    try:
+        columns = [np.load(os.path.join(cache_path, f'{column}.npy'), mmap_mode='r') for column in STORE_COLUMNS]
+        centroids_path = os.path.join(cache_path, 'centroids.npy')
+        centroids = np.load(centroids_path) if os.path.isfile(centroids_path) else None
+    except (OSError, ValueError) as e:
+        print(f'[DLC.ANALYSIS-CACHE] Ignoring unreadable cache {cache_path}: {e}')
+        return None
+    touch_entry(cache_path)
+    return FrameFaceStore(*columns), centroids
+
+
+def save_analysis(target_path: str, kind: str, config: Dict[str, Any], face_store: FrameFaceStore, centroids: Optional[np.ndarray] = None) -> None:
+    """Writes the analysis next to the others; the directory is renamed into place once complete."""
+    if not is_cache_enabled(target_path):
+        return
+    cache_directory = get_cache_directory()
+    cache_path = os.path.join(cache_directory, get_cache_key(target_path, kind, config))
+    temp_path = None
+    try:
+        os.makedirs(cache_directory, exist_ok=True)
+        temp_path = tempfile.mkdtemp(dir=cache_directory)
+        for column in STORE_COLUMNS:
+            np.save(os.path.join(temp_path, f'{column}.npy'), getattr(face_store, column))
+        if centroids is not None:
+            np.save(os.path.join(temp_path, 'centroids.npy'), np.asarray(centroids))
+        with open(os.path.join(temp_path, 'meta.json'), 'w') as file:
+            json.dump({'version': CACHE_VERSION, 'kind': kind, 'target': os.path.abspath(target_path), 'faces': len(face_store), 'config': config}, file)
+        if os.path.isdir(cache_path):
+            shutil.rmtree(temp_path, ignore_errors=True)
+        else:
+            os.replace(temp_path, cache_path)
+        touch_entry(cache_path)
+        evict_analyses(cache_path)
+    except OSError as e:
+        if temp_path:
+            shutil.rmtree(temp_path, ignore_errors=True)
+        print(f'[DLC.ANALYSIS-CACHE] Could not save analysis of {target_path}: {e}')
+
+
+def get_source_face_path(source_key: Tuple[str, float, int], config: Dict[str, Any]) -> str:
+    payload = json.dumps({'version': CACHE_VERSION, 'source': list(source_key), 'config': config}, sort_keys=True)
+    return os.path.join(get_cache_directory(), 'sources', hashlib.sha256(payload.encode()).hexdigest() + '.pkl')
+
+
+def load_source_face(source_key: Tuple[str, float, int], config: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Returns the stored face attributes of a source image (path, mtime, size), or None on a miss."""
+    if not modules.globals.analysis_cache:
+        return None
+    source_face_path = get_source_face_path(source_key, config)
+    if not os.path.isfile(source_face_path):
+        return None
+    try:
+        with open(source_face_path, 'rb') as file:
+            face_attributes = pickle.load(file)
+    except (OSError, pickle.UnpicklingError, EOFError) as e:
+        print(f'[DLC.ANALYSIS-CACHE] Ignoring unreadable source face {source_face_path}: {e}')
+        return None
+    touch_entry(source_face_path)
+    return face_attributes
+
+
+def save_source_face(source_key: Tuple[str, float, int], config: Dict[str, Any], face_attributes: Dict[str, Any]) -> None:
+    # a plain dict of numpy arrays, not the Face itself, so loading doesn't depend on insightface internals
+    if not modules.globals.analysis_cache:
+        return
+    source_face_path = get_source_face_path(source_key, config)
+    try:
+        os.makedirs(os.path.dirname(source_face_path), exist_ok=True)
+        temp_path = source_face_path + '.tmp'
+        with open(temp_path, 'wb') as file:
+            pickle.dump(face_attributes, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, source_face_path)
+        evict_analyses(source_face_path)
+    except OSError as e:
+        print(f'[DLC.ANALYSIS-CACHE] Could not save source face of {source_key[0]}: {e}')
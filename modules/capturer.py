@@ -1,32 +1,153 @@
-from typing import Any
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable, Optional, Tuple
 import cv2
 import modules.globals  # Import the globals to check the color correction toggle
 
+CAPTURE_POOL_SIZE = 4                        # video files kept open for preview scrubbing
+SEQUENTIAL_READ_LIMIT = 48                   # forward jumps up to this many frames grab() instead of seeking
+DECODED_FRAME_CACHE_BYTES = 256 * 1024 ** 2  # memory budget of decoded frames
+
+
+class FrameCache:
+    """LRU of frames (numpy arrays) bounded by their total size in bytes. Thread safe."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.frames: 'OrderedDict[Hashable, Any]' = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Any:
+        with self.lock:
+            frame = self.frames.get(key)
+            if frame is not None:
+                self.frames.move_to_end(key)
+            return frame
+
+    def put(self, key: Hashable, frame: Any) -> None:
+        if frame is None or frame.nbytes > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.frames:
+                self.size -= self.frames.pop(key).nbytes
+            self.frames[key] = frame
+            self.size += frame.nbytes
+            while self.size > self.max_bytes:
+                _, evicted_frame = self.frames.popitem(last=False)
+                self.size -= evicted_frame.nbytes
+
+    def clear(self) -> None:
+        with self.lock:
+            self.frames.clear()
+            self.size = 0
+
+
+class PooledCapture:
+    """
+    A VideoCapture kept open between reads. It remembers the next frame it will decode,
+    so reads at or just after that position decode forward instead of seeking, which
+    would restart decoding from the previous keyframe.
+    """
+
+    def __init__(self, video_path: str):
+        self.capture = cv2.VideoCapture(video_path)
+        # Set MJPEG format to ensure correct color space handling
+        self.capture.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
+        self.frame_total = int(self.capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.position: Optional[int] = 0
+        self.lock = threading.Lock()
+
+    def read(self, frame_index: int) -> Optional[Any]:
+        with self.lock:
+            distance = frame_index - self.position if self.position is not None else -1
+            if not 0 <= distance <= SEQUENTIAL_READ_LIMIT:
+                self.capture.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
+                distance = 0
+            for _ in range(distance):
+                if not self.capture.grab():
+                    break
+            has_frame, frame = self.capture.read()
+            # after a failed read the position is unknown, so the next read seeks
+            self.position = frame_index + 1 if has_frame else None
+            return frame if has_frame else None
+
+    def release(self) -> None:
+        with self.lock:
+            self.capture.release()
+
+
+CAPTURE_POOL: 'OrderedDict[Tuple[str, int, int], PooledCapture]' = OrderedDict()  # (path, mtime, size) -> open capture, LRU order
+CAPTURE_POOL_LOCK = threading.Lock()
+DECODED_FRAMES = FrameCache(DECODED_FRAME_CACHE_BYTES)
+
+
+def get_video_key(video_path: str) -> Tuple[str, int, int]:
+    # a path reused for another file (e.g. per-job temp files) gets a new key
+    stat = os.stat(video_path)
+    return os.path.abspath(video_path), stat.st_mtime_ns, stat.st_size
+
+
+def get_pooled_capture(video_path: str) -> PooledCapture:
+    video_key = get_video_key(video_path)
+    with CAPTURE_POOL_LOCK:
+        pooled_capture = CAPTURE_POOL.get(video_key)
+        if pooled_capture is None:
+            # the file at this path changed, so older captures of it would serve stale frames
+            for stale_key in [key for key in CAPTURE_POOL if key[0] == video_key[0]]:
+                CAPTURE_POOL.pop(stale_key).release()
+            pooled_capture = CAPTURE_POOL[video_key] = PooledCapture(video_path)
+            while len(CAPTURE_POOL) > CAPTURE_POOL_SIZE:
+                _, evicted_capture = CAPTURE_POOL.popitem(last=False)
+                evicted_capture.release()
+        CAPTURE_POOL.move_to_end(video_key)
+        return pooled_capture
+
+
+def release_capture(video_path: str) -> None:
+    """Closes the pooled captures of a path, e.g. when it stops being the target."""
+    video_path = os.path.abspath(video_path)
+    with CAPTURE_POOL_LOCK:
+        for video_key in [key for key in CAPTURE_POOL if key[0] == video_path]:
+            CAPTURE_POOL.pop(video_key).release()
+
+
+def release_captures() -> None:
+    with CAPTURE_POOL_LOCK:
+        for pooled_capture in CAPTURE_POOL.values():
+            pooled_capture.release()
+        CAPTURE_POOL.clear()
+    DECODED_FRAMES.clear()
+
+
+def read_video_frame(video_path: str, frame_index: int) -> Any:
+    """Decoded BGR frame at a 0-based index, from the LRU or the pooled capture. Returns a copy the caller may modify."""
+    if not os.path.isfile(video_path):
+        return None
+    pooled_capture = get_pooled_capture(video_path)
+    if pooled_capture.frame_total > 0:
+        frame_index = min(pooled_capture.frame_total - 1, frame_index)
+    frame_index = max(0, frame_index)
+    frame_key = get_video_key(video_path) + (frame_index,)
+    frame = DECODED_FRAMES.get(frame_key)
+    if frame is None:
+        frame = pooled_capture.read(frame_index)
+        DECODED_FRAMES.put(frame_key, frame)
+    return frame.copy() if frame is not None else None
+
 
 def get_video_frame(video_path: str, frame_number: int = 0) -> Any:
-    capture = cv2.VideoCapture(video_path)
-
-    # Set MJPEG format to ensure correct color space handling
-    capture.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
-    
-    # Only force RGB conversion if color correction is enabled
-    if modules.globals.color_correction:
-        capture.set(cv2.CAP_PROP_CONVERT_RGB, 1)
-    
-    frame_total = capture.get(cv2.CAP_PROP_FRAME_COUNT)
-    capture.set(cv2.CAP_PROP_POS_FRAMES, min(frame_total, frame_number - 1))
-    has_frame, frame = capture.read()
-
-    if has_frame and modules.globals.color_correction:
+    frame = read_video_frame(video_path, frame_number - 1)
+
+    if frame is not None and modules.globals.color_correction:
         # Convert the frame color if necessary
         frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
 
-    capture.release()
-    return frame if has_frame else None
+    return frame
 
 
 def get_video_frame_total(video_path: str) -> int:
-    capture = cv2.VideoCapture(video_path)
-    video_frame_total = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
-    capture.release()
-    return video_frame_total
+    if not os.path.isfile(video_path):
+        return 0
+    return get_pooled_capture(video_path).frame_total
@@ -1,24 +1,84 @@
+import threading
 import numpy as np
-from sklearn.cluster import KMeans
-from sklearn.metrics import silhouette_score
-from typing import Any
+from sklearn.cluster import MiniBatchKMeans
+from typing import Any, Optional, Tuple
 
+RESERVOIR_SIZE = 20000   # embeddings kept for fitting; longer videos are uniformly sampled down to this
+MINIBATCH_SIZE = 1024
 
-def find_cluster_centroids(embeddings, max_k=10) -> Any:
-    inertia = []
-    cluster_centroids = []
-    K = range(1, max_k+1)
 
-    for k in K:
-        kmeans = KMeans(n_clusters=k, random_state=0)
-        kmeans.fit(embeddings)
-        inertia.append(kmeans.inertia_)
-        cluster_centroids.append({"k": k, "centroids": kmeans.cluster_centers_})
+class StreamingClusterer:
+    """
+    Consumes face embeddings while frames are analysed and keeps a bounded, uniform
+    reservoir sample of them (Algorithm R), so memory doesn't grow with the video.
+    fit() runs MiniBatchKMeans on the reservoir for k = 1..max_k and picks k with the
+    same elbow rule as before (largest inertia drop); assign() labels any embeddings.
+    """
+
+    def __init__(self, max_k: int = 10, reservoir_size: int = RESERVOIR_SIZE, seed: int = 0):
+        self.max_k = max_k
+        self.reservoir_size = reservoir_size
+        self.reservoir: Optional[np.ndarray] = None
+        self.count = 0  # embeddings kept in the reservoir
+        self.seen = 0   # embeddings offered so far
+        self.rng = np.random.default_rng(seed)
+        self.lock = threading.Lock()
+        self.centroids: Optional[np.ndarray] = None
+
+    def add(self, embeddings: Any) -> None:
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if embeddings.size == 0:
+            return
+        embeddings = embeddings.reshape(-1, embeddings.shape[-1])
+        with self.lock:
+            if self.reservoir is None:
+                self.reservoir = np.empty((self.reservoir_size, embeddings.shape[1]), dtype=np.float32)
+            # fill the free slots first
+            free = min(self.reservoir_size - self.count, len(embeddings))
+            if free > 0:
+                self.reservoir[self.count:self.count + free] = embeddings[:free]
+                self.count += free
+            rest = embeddings[free:]
+            if len(rest):
+                # item number n (0-based) replaces a random slot with probability size / (n + 1)
+                slots = self.rng.integers(0, self.seen + free + np.arange(1, len(rest) + 1))
+                keep = slots < self.reservoir_size
+                self.reservoir[slots[keep]] = rest[keep]
+            self.seen += len(embeddings)
+            self.centroids = None
+
+    def fit(self) -> np.ndarray:
+        if not self.count:
+            raise ValueError("No embeddings to cluster")
+        samples = self.reservoir[:self.count]
+        max_k = min(self.max_k, len(np.unique(samples, axis=0)))
+
+        inertia = []
+        cluster_centroids = []
+        for k in range(1, max_k + 1):
+            kmeans = MiniBatchKMeans(n_clusters=k, random_state=0, batch_size=MINIBATCH_SIZE, n_init=3)
+            kmeans.fit(samples)
+            inertia.append(kmeans.inertia_)
+            cluster_centroids.append(kmeans.cluster_centers_)
 
-    diffs = [inertia[i] - inertia[i+1] for i in range(len(inertia)-1)]
-    optimal_centroids = cluster_centroids[diffs.index(max(diffs)) + 1]['centroids']
+        if len(inertia) == 1:
+            self.centroids = cluster_centroids[0]
+        else:
+            diffs = [inertia[i] - inertia[i+1] for i in range(len(inertia)-1)]
+            self.centroids = cluster_centroids[diffs.index(max(diffs)) + 1]
+        return self.centroids
 
-    return optimal_centroids
+    def assign(self, embeddings: Any) -> np.ndarray:
+        if self.centroids is None:
+            self.fit()
+        closest_centroid_indices, _ = find_closest_centroids(self.centroids, embeddings)
+        return closest_centroid_indices
+
+
+def find_cluster_centroids(embeddings, max_k=10) -> Any:
+    clusterer = StreamingClusterer(max_k=max_k)
+    clusterer.add(embeddings)
+    return clusterer.fit()
 
 def find_closest_centroid(centroids: list, normed_face_embedding) -> list:
     try:
@@ -26,7 +86,15 @@ def find_closest_centroid(centroids: list, normed_face_embedding) -> list:
         normed_face_embedding = np.array(normed_face_embedding)
         similarities = np.dot(centroids, normed_face_embedding)
         closest_centroid_index = np.argmax(similarities)
-        
+
         return closest_centroid_index, centroids[closest_centroid_index]
     except ValueError:
-        return None
\ No newline at end of file
+        return None
+
+def find_closest_centroids(centroids: Any, normed_face_embeddings: Any) -> Tuple[np.ndarray, np.ndarray]:
+    """Batched find_closest_centroid: assigns every row of an (n, d) matrix with one matmul."""
+    centroids = np.asarray(centroids, dtype=np.float32)
+    normed_face_embeddings = np.asarray(normed_face_embeddings, dtype=np.float32).reshape(-1, centroids.shape[1])
+    similarities = normed_face_embeddings @ centroids.T
+    closest_centroid_indices = np.argmax(similarities, axis=1)
+    return closest_centroid_indices, similarities[np.arange(len(closest_centroid_indices)), closest_centroid_indices]
@@ -6,7 +6,7 @@ if any(arg.startswith('--execution-provider') for arg in sys.argv):
 # reduce tensorflow log level
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
 import warnings
-from typing import List
+from typing import List, Optional
 import platform
 import signal
 import shutil
@@ -18,7 +18,7 @@ import tensorflow
 import modules.globals
 import modules.metadata
 import modules.ui as ui
-from modules.processors.frame.core import get_frame_processors_modules
+from modules.processors.frame.core import get_frame_processors_modules, process_video_fused, process_video_stream
 from modules.utilities import has_image_extension, is_image, is_video, detect_fps, create_video, extract_frames, get_temp_frame_paths, restore_audio, create_temp, move_temp, clean_temp, normalize_output_path
 
 if 'ROCMExecutionProvider' in modules.globals.execution_providers:
@@ -41,12 +41,22 @@ def parse_args() -> None:
     program.add_argument('--many-faces', help='process every face', dest='many_faces', action='store_true', default=False)
     program.add_argument('--nsfw-filter', help='filter the NSFW image or video', dest='nsfw_filter', action='store_true', default=False)
     program.add_argument('--map-faces', help='map source target faces', dest='map_faces', action='store_true', default=False)
+    program.add_argument('--adaptive-det-size', help='pick the face detection size from the frame resolution', dest='adaptive_det_size', action='store_true', default=False)
+    program.add_argument('--face-tracking', help='track faces between full detections', dest='face_tracking', action='store_true', default=False)
+    program.add_argument('--face-tracking-interval', help='frames between full face detections when tracking', dest='face_tracking_interval', type=int, default=5)
+    program.add_argument('--no-analysis-cache', help='do not reuse or store face analyses of the target', dest='analysis_cache', action='store_false', default=True)
+    program.add_argument('--analysis-cache-dir', help='directory of the face analysis cache', dest='analysis_cache_dir', default=None)
+    program.add_argument('--analysis-cache-max-gb', help='disk budget of the face analysis cache in GB', dest='analysis_cache_max_gb', type=float, default=5.0)
     program.add_argument('--mouth-mask', help='mask the mouth region', dest='mouth_mask', action='store_true', default=False)
     program.add_argument('--video-encoder', help='adjust output video encoder', dest='video_encoder', default='libx264', choices=['libx264', 'libx265', 'libvpx-vp9'])
     program.add_argument('--video-quality', help='adjust output video quality', dest='video_quality', type=int, default=18, choices=range(52), metavar='[0-51]')
+    program.add_argument('--swap-batch-size', help='face crops per face swapper inference call (needs an inswapper model exported with a dynamic batch axis, the stock one runs 1 crop per call)', dest='swap_batch_size', type=int, default=4)
+    program.add_argument('--stream-frames', help='pipe frames through ffmpeg instead of temporary png files', dest='stream_frames', action='store_true', default=False)
     program.add_argument('-l', '--lang', help='Ui language', default="pt-br")
     program.add_argument('--live-mirror', help='The live camera display as you see it in the front-facing camera frame', dest='live_mirror', action='store_true', default=False)
     program.add_argument('--live-resizable', help='The live camera frame is resizable', dest='live_resizable', action='store_true', default=False)
+    program.add_argument('--live-pipeline-depth', help='live frames in flight between face detection and swap (1 = serial)', dest='live_pipeline_depth', type=int, default=2)
+    program.add_argument('--live-drop-policy', help='what the live pipeline does when the swap falls behind', dest='live_drop_policy', default='oldest', choices=['oldest', 'block'])
     program.add_argument('--max-memory', help='maximum amount of RAM in GB', dest='max_memory', type=int, default=suggest_max_memory())
     program.add_argument('--execution-provider', help='execution provider', dest='execution_provider', default=['cpu'], choices=suggest_execution_providers(), nargs='+')
     program.add_argument('--execution-threads', help='number of execution threads', dest='execution_threads', type=int, default=suggest_execution_threads())
@@ -70,12 +80,22 @@ def parse_args() -> None:
     modules.globals.keep_frames = args.keep_frames
     modules.globals.many_faces = args.many_faces
     modules.globals.mouth_mask = args.mouth_mask
+    modules.globals.adaptive_det_size = args.adaptive_det_size
+    modules.globals.face_tracking = args.face_tracking
+    modules.globals.face_tracking_interval = args.face_tracking_interval
+    modules.globals.analysis_cache = args.analysis_cache
+    modules.globals.analysis_cache_dir = args.analysis_cache_dir
+    modules.globals.analysis_cache_max_gb = args.analysis_cache_max_gb
     modules.globals.nsfw_filter = args.nsfw_filter
     modules.globals.map_faces = args.map_faces
     modules.globals.video_encoder = args.video_encoder
     modules.globals.video_quality = args.video_quality
+    modules.globals.stream_frames = args.stream_frames
+    modules.globals.swap_batch_size = args.swap_batch_size
     modules.globals.live_mirror = args.live_mirror
     modules.globals.live_resizable = args.live_resizable
+    modules.globals.live_pipeline_depth = max(1, args.live_pipeline_depth)
+    modules.globals.live_drop_policy = args.live_drop_policy
     modules.globals.max_memory = args.max_memory
     modules.globals.execution_providers = decode_execution_providers(args.execution_provider)
     modules.globals.execution_threads = args.execution_threads
@@ -249,30 +269,38 @@ def process_single_file(target_path: str, output_path: str) -> bool:
         if modules.globals.nsfw_filter and ui.check_and_ignore_nsfw(target_path, None):
             return False
 
-        # In folder mode, always extract frames (use simple mode)
-        # Otherwise, extract frames only if not using map_faces
-        should_extract = modules.globals.process_folder or not modules.globals.map_faces
-        
-        if should_extract:
+        # map_faces analysis decodes the video in memory and keys its maps by frame
+        # number, so every mode either streams the frames or extracts them here
+        if modules.globals.stream_frames:
+            update_status('Creating temp resources...')
+            create_temp(target_path)
+            fps = detect_fps(target_path) if modules.globals.keep_fps else 30.0
+            update_status(f'Streaming frames with {fps} fps...')
+            if not process_video_stream(modules.globals.source_path, target_path, fps):
+                update_status('Streaming frames failed!')
+                clean_temp(target_path)
+                return False
+            release_resources()
+        else:
             update_status('Creating temp resources...')
             create_temp(target_path)
             update_status('Extracting frames...')
             extract_frames(target_path)
 
-        temp_frame_paths = get_temp_frame_paths(target_path)
-        for frame_processor in get_frame_processors_modules(modules.globals.frame_processors):
-            update_status('Progressing...', frame_processor.NAME)
-            frame_processor.process_video(modules.globals.source_path, temp_frame_paths)
+            temp_frame_paths = get_temp_frame_paths(target_path)
+            # Every frame goes through all processors in one pass, so it's read and written once
+            update_status('Progressing...')
+            process_video_fused(modules.globals.source_path, temp_frame_paths, target_path)
             release_resources()
-        # handles fps
-        if modules.globals.keep_fps:
-            update_status('Detecting fps...')
-            fps = detect_fps(target_path)
-            update_status(f'Creating video with {fps} fps...')
-            create_video(target_path, fps)
-        else:
-            update_status('Creating video with 30.0 fps...')
-            create_video(target_path)
+            # handles fps
+            if modules.globals.keep_fps:
+                update_status('Detecting fps...')
+                fps = detect_fps(target_path)
+                update_status(f'Creating video with {fps} fps...')
+                create_video(target_path, fps)
+            else:
+                update_status('Creating video with 30.0 fps...')
+                create_video(target_path)
         # handle audio
         if modules.globals.keep_audio:
             if modules.globals.keep_fps:
@@ -294,6 +322,35 @@ def process_single_file(target_path: str, output_path: str) -> bool:
         return False
 
 
+def process_queue_remote(output_dir: str) -> Optional[List[bool]]:
+    """
+    Folder mode on the VPS: one connection for the whole queue, with up to vps_max_in_flight
+    files on the server at once so the GPU isn't idle while the next file uploads.
+    Returns None if the session couldn't start, so the caller falls back to the per-file loop.
+    """
+    queue = modules.globals.file_queue
+    total_files = len(queue)
+    jobs = [(target_path, generate_unique_output_path(target_path, output_dir, file_id)) for file_id, target_path in enumerate(queue, 1)]
+
+    def on_result(index: int, ok: bool) -> None:
+        update_status(f"File {index + 1}/{total_files} {'done' if ok else 'failed'}: {os.path.basename(queue[index])}")
+
+    try:
+        from modules.vps.client_ws import process_remote_files
+        update_status(f'Processando {total_files} arquivos remotamente na VPS...')
+        return process_remote_files(
+            modules.globals.source_path,
+            jobs,
+            modules.globals.vps_server_url,
+            modules.globals.vps_max_in_flight,
+            on_result
+        )
+    except Exception as e:
+        update_status(f'Erro no processamento VPS: {str(e)}')
+        update_status('Processando um arquivo por vez...')
+        return None
+
+
 def start() -> None:
     for frame_processor in get_frame_processors_modules(modules.globals.frame_processors):
         if not frame_processor.pre_start():
@@ -325,6 +382,15 @@ def start() -> None:
         successful = 0
         failed = 0
         
+        if getattr(modules.globals, 'vps_enabled', False) and getattr(modules.globals, 'vps_server_url', None):
+            results = process_queue_remote(output_dir)
+            if results is not None:
+                successful = sum(results)
+                failed = len(results) - successful
+                update_status(f'Queue processing complete! Success: {successful}, Failed: {failed}')
+                modules.globals.file_queue = []  # Clear queue after processing
+                return
+        
         for file_id, target_path in enumerate(modules.globals.file_queue, 1):
             update_status(f'Processing file {file_id}/{total_files}: {os.path.basename(target_path)}')
             
@@ -1,43 +1,272 @@
 import os
 import shutil
-from typing import Any
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 import insightface
 
 import cv2
 import numpy as np
 import modules.globals
 from tqdm import tqdm
-from modules.typing import Frame
-from modules.cluster_analysis import find_cluster_centroids, find_closest_centroid
-from modules.utilities import get_temp_directory_path, create_temp, extract_frames, clean_temp, get_temp_frame_paths
+from modules.typing import Face, Frame
+from modules.analysis_cache import load_analysis, save_analysis, load_source_face, save_source_face
+from modules.cluster_analysis import RESERVOIR_SIZE, StreamingClusterer
+from modules.face_store import FaceStoreBuilder, FrameFaceIndex, FrameFaceStore
+from modules.capturer import get_video_frame_total, read_video_frame
+from modules.processors.frame.core import iter_chunks, run_chunked
+from modules.utilities import detect_resolution, get_temp_directory_path, read_frames
 from pathlib import Path
 
 FACE_ANALYSER = None
+FACE_ANALYSER_LOCK = threading.Lock()
+SCENE_CUT_THRESHOLD = 30.0  # mean absolute difference of grayscale thumbnails that counts as a cut
+TRACKING_MAX_SCALE_CHANGE = 1.5  # larger jumps between frames mean the tracked face was lost
+
+# --- START: Adaptive detection size ---
+DET_SIZES = (320, 480, 640)  # detector input sizes to pick from (multiples of 32); the last one is the default
+DET_MIN_FACE_SIZE = 48       # smallest face size (in detector pixels) the cheap pass is trusted with
+DET_MARGINAL_SCORE = 0.6     # detections below this score are refined at the full size
+DEFAULT_FACE_RATIO = 0.15    # expected largest face height relative to the frame long side, before any is seen
+# --- END: Adaptive detection size ---
+
+# --- START: Source face registry ---
+SOURCE_FACE_CACHE_SIZE = 16  # source images whose face is kept in memory
+SOURCE_FACES: 'OrderedDict[Tuple[str, float, int], Optional[Face]]' = OrderedDict()  # (path, mtime, size) -> face, LRU order
+SOURCE_FACES_LOCK = threading.Lock()
+# --- END: Source face registry ---
+
+# --- START: Video analysis (map_faces) ---
+ANALYSIS_SEGMENT_SIZE = 16    # consecutive frames one worker analyses; tracking only spans a segment
+ANALYSIS_DETECT_INTERVAL = 5  # full detection + recognition every Nth frame, scene cuts force one too
+ANALYSIS_MEMORY_BUDGET = 2 * 1024 ** 3  # bytes of decoded frames the analysis may hold at once
+# --- END: Video analysis (map_faces) ---
+
+# buffalo_l heads loaded at all; genderage and landmark_3d_68 are never read by the swap pipeline
+ANALYSER_MODULES = ['detection', 'landmark_2d_106', 'recognition']
+# heads each call site needs on top of detection
+ANALYSER_PROFILES = {
+    'full': ['landmark_2d_106', 'recognition'],  # map_faces targets and live matching need embeddings
+    'source': ['recognition'],                   # source faces only feed their embedding to the swapper
+    'target': ['landmark_2d_106'],               # simple-mode targets need kps and landmarks, no identity
+}
 
 
 def get_face_analyser() -> Any:
     global FACE_ANALYSER
 
-    if FACE_ANALYSER is None:
-        FACE_ANALYSER = insightface.app.FaceAnalysis(name='buffalo_l', providers=modules.globals.execution_providers)
-        FACE_ANALYSER.prepare(ctx_id=0, det_size=(640, 640))
+    with FACE_ANALYSER_LOCK:
+        if FACE_ANALYSER is None:
+            FACE_ANALYSER = insightface.app.FaceAnalysis(name='buffalo_l', allowed_modules=ANALYSER_MODULES, providers=modules.globals.execution_providers)
+            FACE_ANALYSER.prepare(ctx_id=0, det_size=(640, 640))
     return FACE_ANALYSER
 
 
-def get_one_face(frame: Frame) -> Any:
-    face = get_face_analyser().get(frame)
+class FaceSizeHint:
+    """
+    Largest face height (relative to the frame long side) seen in one sequence of frames,
+    which steers the adaptive det size of the next frame. Owned by a FaceTracker, a job
+    context or the live stream, so jobs and worker threads never share one.
+    """
+
+    def __init__(self):
+        self.ratio = DEFAULT_FACE_RATIO
+
+
+LIVE_FACE_SIZE_HINT = FaceSizeHint()  # live/webcam frames without a tracker
+
+
+def choose_det_size(frame: Frame, size_hint: Optional[FaceSizeHint] = None) -> int:
+    """Smallest detector size that still sees the expected face at DET_MIN_FACE_SIZE pixels."""
+    long_side = max(frame.shape[:2])
+    expected_face_size = (size_hint.ratio if size_hint else DEFAULT_FACE_RATIO) * long_side
+    for det_size in DET_SIZES:
+        if det_size >= long_side or expected_face_size * det_size / long_side >= DET_MIN_FACE_SIZE:
+            return det_size
+    return DET_SIZES[-1]
+
+
+def detect_faces(frame: Frame, size_hint: Optional[FaceSizeHint] = None) -> Any:
+    """
+    Runs the detector, at a fixed 640 or, with adaptive_det_size, at a size picked from the frame
+    resolution and the expected face size (from size_hint, which the result updates).
+    A low-res pass that finds nothing or only marginal faces is refined at the full size.
+    SCRFD takes the input size per call, so one session serves all sizes.
+    """
+    det_model = get_face_analyser().det_model
+    if not modules.globals.adaptive_det_size:
+        return det_model.detect(frame, max_num=0, metric='default')
+
+    det_size = choose_det_size(frame, size_hint)
+    bboxes, kpss = det_model.detect(frame, input_size=(det_size, det_size), max_num=0, metric='default')
+    if det_size < DET_SIZES[-1] and (bboxes.shape[0] == 0 or bboxes[:, 4].min() < DET_MARGINAL_SCORE):
+        bboxes, kpss = det_model.detect(frame, input_size=(DET_SIZES[-1], DET_SIZES[-1]), max_num=0, metric='default')
+    if size_hint is not None and bboxes.shape[0] > 0:
+        size_hint.ratio = float((bboxes[:, 3] - bboxes[:, 1]).max()) / max(frame.shape[:2])
+    return bboxes, kpss
+
+
+def analyse_faces(frame: Frame, profile: str = 'full', size_hint: Optional[FaceSizeHint] = None) -> List[Face]:
+    """Same as FaceAnalysis.get, but only runs the heads the given profile needs on each detected face."""
+    face_analyser = get_face_analyser()
+    tasknames = ANALYSER_PROFILES[profile]
+    bboxes, kpss = detect_faces(frame, size_hint)
+    faces = []
+    for i in range(bboxes.shape[0]):
+        face = Face(bbox=bboxes[i, 0:4], kps=kpss[i] if kpss is not None else None, det_score=bboxes[i, 4])
+        for taskname, model in face_analyser.models.items():
+            if taskname in tasknames:
+                model.get(frame, face)
+        faces.append(face)
+    return faces
+
+
+def get_one_face(frame: Frame, profile: str = 'full', size_hint: Optional[FaceSizeHint] = None) -> Any:
+    face = analyse_faces(frame, profile, size_hint)
     try:
         return min(face, key=lambda x: x.bbox[0])
     except ValueError:
         return None
 
 
-def get_many_faces(frame: Frame) -> Any:
+def get_many_faces(frame: Frame, profile: str = 'full', size_hint: Optional[FaceSizeHint] = None) -> Any:
     try:
-        return get_face_analyser().get(frame)
+        return analyse_faces(frame, profile, size_hint)
     except IndexError:
         return None
 
+def get_source_image_face(source_path: Optional[str]) -> Optional[Face]:
+    """
+    Face of a source image, looked up by (path, mtime, size) in the in-memory LRU, then in the
+    on-disk store of the analysis cache; the image is only read and analysed on a miss.
+    """
+    if not source_path or not os.path.isfile(source_path):
+        return None
+    stat = os.stat(source_path)
+    source_key = (os.path.abspath(source_path), stat.st_mtime, stat.st_size)
+    with SOURCE_FACES_LOCK:
+        if source_key in SOURCE_FACES:
+            SOURCE_FACES.move_to_end(source_key)
+            return SOURCE_FACES[source_key]
+
+    config = get_analysis_config('source')
+    face_attributes = load_source_face(source_key, config)
+    if face_attributes is not None:
+        face = Face(face_attributes)
+    else:
+        source_image = cv2.imread(source_path)
+        face = get_one_face(source_image, 'source') if source_image is not None else None
+        if face is not None:
+            save_source_face(source_key, config, dict(face))
+
+    with SOURCE_FACES_LOCK:
+        SOURCE_FACES[source_key] = face
+        SOURCE_FACES.move_to_end(source_key)
+        while len(SOURCE_FACES) > SOURCE_FACE_CACHE_SIZE:
+            SOURCE_FACES.popitem(last=False)
+    return face
+
+
+class FaceTracker:
+    """
+    Runs full face analysis every `detect_interval` frames or on a scene cut and, in between,
+    propagates the last detected faces by re-running only the 106-point landmark model on their ROI.
+    Embeddings and other attributes are carried over from the last full detection.
+    Trackers hold per-sequence state: use one per video chunk or live stream.
+    """
+
+    def __init__(self, detect_interval: Optional[int] = None, scene_cut_threshold: float = SCENE_CUT_THRESHOLD, profile: str = 'full'):
+        self.detect_interval = max(1, detect_interval or modules.globals.face_tracking_interval)
+        self.profile = profile
+        self.scene_cut_threshold = scene_cut_threshold
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        self.faces: Optional[List[Face]] = None
+        self.frames_since_detection = 0
+        self.previous_thumbnail = None
+        self.size_hint = FaceSizeHint()
+
+    def is_scene_cut(self, frame: Frame) -> bool:
+        thumbnail = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), (64, 36), interpolation=cv2.INTER_AREA).astype(np.float32)
+        previous_thumbnail = self.previous_thumbnail
+        self.previous_thumbnail = thumbnail
+        if previous_thumbnail is None:
+            return True
+        return float(np.mean(np.abs(thumbnail - previous_thumbnail))) > self.scene_cut_threshold
+
+    def get_many_faces(self, frame: Frame) -> List[Face]:
+        with self.lock:
+            scene_cut = self.is_scene_cut(frame)
+            tracked_faces = None
+            if not scene_cut and self.faces and self.frames_since_detection < self.detect_interval:
+                tracked_faces = track_faces(frame, self.faces)
+            if tracked_faces is None:
+                tracked_faces = get_many_faces(frame, self.profile, self.size_hint) or []
+                self.frames_since_detection = 0
+            self.faces = tracked_faces
+            self.frames_since_detection += 1
+            return tracked_faces
+
+    def get_one_face(self, frame: Frame) -> Any:
+        try:
+            return min(self.get_many_faces(frame), key=lambda x: x.bbox[0])
+        except ValueError:
+            return None
+
+
+def track_face(frame: Frame, face: Face, landmark_model: Any) -> Optional[Face]:
+    """Moves one face to its position in the new frame using the landmark model only."""
+    if face.landmark_2d_106 is None:
+        return None
+    tracked_face = Face(face)
+    landmark_model.get(frame, tracked_face)
+    # similarity transform between the old and new landmarks moves the bbox and kps along
+    M, _ = cv2.estimateAffinePartial2D(face.landmark_2d_106.astype(np.float32), tracked_face.landmark_2d_106.astype(np.float32))
+    if M is None:
+        return None
+    scale = float(np.sqrt(abs(np.linalg.det(M[:, :2]))))
+    if not 1 / TRACKING_MAX_SCALE_CHANGE < scale < TRACKING_MAX_SCALE_CHANGE:
+        return None
+    corners = cv2.transform(face.bbox.reshape(1, 2, 2).astype(np.float32), M).reshape(2, 2)
+    tracked_face.bbox = np.concatenate([corners.min(axis=0), corners.max(axis=0)])
+    if face.kps is not None:
+        tracked_face.kps = cv2.transform(face.kps.reshape(1, -1, 2).astype(np.float32), M).reshape(-1, 2)
+    frame_h, frame_w = frame.shape[:2]
+    x1, y1, x2, y2 = tracked_face.bbox
+    if x2 <= 0 or y2 <= 0 or x1 >= frame_w or y1 >= frame_h:
+        return None
+    return tracked_face
+
+
+def track_faces(frame: Frame, faces: List[Face]) -> Optional[List[Face]]:
+    """Tracks every face into the new frame; returns None when a full detection is needed instead."""
+    landmark_model = get_face_analyser().models.get('landmark_2d_106')
+    if landmark_model is None:
+        return None
+    tracked_faces = []
+    for face in faces:
+        tracked_face = track_face(frame, face, landmark_model)
+        if tracked_face is None:
+            return None
+        tracked_faces.append(tracked_face)
+    return tracked_faces
+
+
+LIVE_FACE_TRACKERS = {}  # analyser profile -> tracker shared by live/preview frames
+
+
+def get_live_face_tracker(profile: str = 'full') -> Optional[FaceTracker]:
+    """Returns the shared tracker for live/preview frames, or None when face tracking is disabled."""
+    if not modules.globals.face_tracking:
+        return None
+    face_tracker = LIVE_FACE_TRACKERS.get(profile)
+    if face_tracker is None or face_tracker.detect_interval != max(1, modules.globals.face_tracking_interval):
+        face_tracker = LIVE_FACE_TRACKERS[profile] = FaceTracker(profile=profile)
+    return face_tracker
+
+
 def has_valid_map() -> bool:
     for map in modules.globals.source_target_map:
         if "source" in map and "target" in map:
@@ -94,81 +323,142 @@ def get_unique_faces_from_target_image() -> Any:
         return None
     
     
+def get_analysis_config(kind: str) -> Dict[str, Any]:
+    """
+    Everything that changes the faces an analysis finds, part of the analysis cache key.
+    'map' is the map_faces video analysis, 'target' the simple mode detections of a job,
+    'source' a source image face.
+    """
+    config: Dict[str, Any] = {'modules': ANALYSER_MODULES, 'profile': ANALYSER_PROFILES['full' if kind == 'map' else kind], 'det_size': DET_SIZES[-1]}
+    if modules.globals.adaptive_det_size:
+        config.update(det_sizes=list(DET_SIZES), det_min_face_size=DET_MIN_FACE_SIZE, det_marginal_score=DET_MARGINAL_SCORE)
+    if kind == 'map':
+        config.update(segment_size=ANALYSIS_SEGMENT_SIZE, detect_interval=ANALYSIS_DETECT_INTERVAL, reservoir_size=RESERVOIR_SIZE)
+    elif kind == 'target' and modules.globals.face_tracking:
+        config.update(face_tracking_interval=modules.globals.face_tracking_interval)
+    return config
+
+
+def analyse_video_segment(segment: Tuple[int, List[Frame]]) -> List[Dict[str, Any]]:
+    """Analyses a run of consecutive frames: full analysis at the interval and on cuts, tracking in between."""
+    first_frame_number, frames = segment
+    face_tracker = FaceTracker(detect_interval=ANALYSIS_DETECT_INTERVAL, profile='full')
+    return [{'frame': first_frame_number + i, 'faces': face_tracker.get_many_faces(frame)} for i, frame in enumerate(frames)]
+
+
+def get_analysis_parallelism(target_path: str) -> Tuple[int, int]:
+    """
+    (workers, queued segments) that keep the decoded frames within ANALYSIS_MEMORY_BUDGET.
+    Segments are held by the workers, the queue and the reader, so a 4K target gets
+    fewer workers than a 1080p one instead of a few GB of pending frames.
+    """
+    width, height = detect_resolution(target_path)
+    segment_bytes = ANALYSIS_SEGMENT_SIZE * width * height * 3
+    segments = max(2, ANALYSIS_MEMORY_BUDGET // max(1, segment_bytes))
+    workers = max(1, min(modules.globals.execution_threads or 1, segments // 2))
+    return workers, max(1, workers // 2)
+
+
+def analyse_target_video(target_path: str, clusterer: Optional[StreamingClusterer] = None) -> FrameFaceStore:
+    """
+    Decodes the target straight from ffmpeg (no temp frames) and analyses it in
+    segments of consecutive frames spread over the execution threads.
+    Each segment is packed into the columnar face store as soon as it's done and
+    its embeddings are fed to the clusterer, so no Face objects pile up.
+    """
+    builder = FaceStoreBuilder()
+
+    def iter_segments() -> Iterator[Tuple[int, List[Frame]]]:
+        # frame numbers are 1-based like the %04d.png temp frames
+        for index, frames in enumerate(iter_chunks(read_frames(target_path), ANALYSIS_SEGMENT_SIZE)):
+            yield index * ANALYSIS_SEGMENT_SIZE + 1, frames
+
+    with tqdm(total=get_video_frame_total(target_path), desc="Extracting face embeddings from frames") as progress:
+        def handle_segment(segment: Tuple[int, List[Frame]]) -> None:
+            embeddings = builder.add_frames(analyse_video_segment(segment))
+            if clusterer:
+                clusterer.add(embeddings)
+            progress.update(len(segment[1]))
+
+        workers, max_pending = get_analysis_parallelism(target_path)
+        run_chunked(iter_segments(), handle_segment, workers, max_pending)
+
+    return builder.build()
+
+
 def get_unique_faces_from_target_video() -> Any:
     try:
         modules.globals.source_target_map = []
-        frame_face_embeddings = []
-        face_embeddings = []
-    
-        print('Creating temp resources...')
-        clean_temp(modules.globals.target_path)
-        create_temp(modules.globals.target_path)
-        print('Extracting frames...')
-        extract_frames(modules.globals.target_path)
-
-        temp_frame_paths = get_temp_frame_paths(modules.globals.target_path)
-
-        i = 0
-        for temp_frame_path in tqdm(temp_frame_paths, desc="Extracting face embeddings from frames"):
-            temp_frame = cv2.imread(temp_frame_path)
-            many_faces = get_many_faces(temp_frame)
-
-            for face in many_faces:
-                face_embeddings.append(face.normed_embedding)
-            
-            frame_face_embeddings.append({'frame': i, 'faces': many_faces, 'location': temp_frame_path})
-            i += 1
-
-        centroids = find_cluster_centroids(face_embeddings)
-
-        for frame in frame_face_embeddings:
-            for face in frame['faces']:
-                closest_centroid_index, _ = find_closest_centroid(centroids, face.normed_embedding)
-                face['target_centroid'] = closest_centroid_index
+        modules.globals.target_face_store = None
+        analysis_config = get_analysis_config('map')
+        cached_analysis = load_analysis(modules.globals.target_path, 'map', analysis_config)
+        if cached_analysis and cached_analysis[1] is not None:
+            print('Loading face analysis from cache...')
+            face_store, centroids = cached_analysis
+        else:
+            clusterer = StreamingClusterer()
+            face_store = analyse_target_video(modules.globals.target_path, clusterer)
+            centroids = clusterer.fit()
+
+            # every face is labelled with its centroid, a block of rows per matmul
+            face_store.assign_centroids(clusterer.assign)
+            save_analysis(modules.globals.target_path, 'map', analysis_config, face_store, centroids)
+        modules.globals.target_face_store = face_store
 
         for i in range(len(centroids)):
             modules.globals.source_target_map.append({
                 'id' : i
             })
 
-            temp = []
-            for frame in tqdm(frame_face_embeddings, desc=f"Mapping frame embeddings to centroids-{i}"):
-                temp.append({'frame': frame['frame'], 'faces': [face for face in frame['faces'] if face['target_centroid'] == i], 'location': frame['location']})
-
-            modules.globals.source_target_map[i]['target_faces_in_frame'] = temp
-
-        # dump_faces(centroids, frame_face_embeddings)
+        # dump_faces(centroids, face_store)
         default_target_face()
+        build_frame_face_index()
     except ValueError:
         return None
-    
+
+
+def build_frame_face_index() -> FrameFaceIndex:
+    """
+    Resolves the source face each target cluster is swapped with. The resulting index
+    answers frame number -> (source_face, target_face) pairs straight from the face
+    store. Sources are picked after the analysis, so the swapper rebuilds it per job.
+    """
+    cluster_source_faces: Dict[int, Face] = {}
+    many_faces_source = default_source_face() if modules.globals.many_faces else None
+
+    for map in modules.globals.source_target_map:
+        if modules.globals.many_faces:
+            source_face = many_faces_source
+        else:
+            source_face = map['source']['face'] if map.get('source') else None
+        if source_face is not None:
+            cluster_source_faces[map['id']] = source_face
+
+    modules.globals.frame_face_index = FrameFaceIndex(modules.globals.target_face_store, cluster_source_faces)
+    return modules.globals.frame_face_index
+
 
 def default_target_face():
     for map in modules.globals.source_target_map:
-        best_face = None
-        best_frame = None
-        for frame in map['target_faces_in_frame']:
-            if len(frame['faces']) > 0:
-                best_face = frame['faces'][0]
-                best_frame = frame
-                break
-
-        for frame in map['target_faces_in_frame']:
-            for face in frame['faces']:
-                if face['det_score'] > best_face['det_score']:
-                    best_face = face
-                    best_frame = frame
-
-        x_min, y_min, x_max, y_max = best_face['bbox']
-
-        target_frame = cv2.imread(best_frame['location'])
+        best_face = modules.globals.target_face_store.get_best_face(map['id'])
+        if best_face is None:
+            continue
+        face = best_face.to_face()
+        x_min, y_min, x_max, y_max = face['bbox']
+
+        target_frame = get_target_video_frame(best_face.frame_number)
         map['target'] = {
                         'cv2' : target_frame[int(y_min):int(y_max), int(x_min):int(x_max)],
-                        'face' : best_face
+                        'face' : face
                         }
 
 
-def dump_faces(centroids: Any, frame_face_embeddings: list):
+def get_target_video_frame(frame_number: int) -> Frame:
+    # analysed frames aren't kept on disk, so the few frames needed for crops are decoded again
+    return read_video_frame(modules.globals.target_path, frame_number - 1)
+
+
+def dump_faces(centroids: Any, face_store: FrameFaceStore):
     temp_directory_path = get_temp_directory_path(modules.globals.target_path)
 
     for i in range(len(centroids)):
@@ -176,14 +466,17 @@ def dump_faces(centroids: Any, frame_face_embeddings: list):
             shutil.rmtree(temp_directory_path + f"/{i}")
         Path(temp_directory_path + f"/{i}").mkdir(parents=True, exist_ok=True)
 
-        for frame in tqdm(frame_face_embeddings, desc=f"Copying faces to temp/./{i}"):
-            temp_frame = cv2.imread(frame['location'])
-
-            j = 0
-            for face in frame['faces']:
-                if face['target_centroid'] == i:
-                    x_min, y_min, x_max, y_max = face['bbox']
-
-                    if temp_frame[int(y_min):int(y_max), int(x_min):int(x_max)].size > 0:
-                        cv2.imwrite(temp_directory_path + f"/{i}/{frame['frame']}_{j}.png", temp_frame[int(y_min):int(y_max), int(x_min):int(x_max)])
-                j += 1
\ No newline at end of file
+        frame_number = None
+        temp_frame = None
+        j = 0
+        for face in tqdm(face_store.get_centroid_faces(i), desc=f"Copying faces to temp/./{i}"):
+            # rows are sorted by frame, so each frame is decoded once
+            if face.frame_number != frame_number:
+                frame_number = face.frame_number
+                temp_frame = get_target_video_frame(frame_number)
+                j = 0
+            x_min, y_min, x_max, y_max = face.bbox
+
+            if temp_frame is not None and temp_frame[int(y_min):int(y_max), int(x_min):int(x_max)].size > 0:
+                cv2.imwrite(temp_directory_path + f"/{i}/{frame_number}_{j}.png", temp_frame[int(y_min):int(y_max), int(x_min):int(x_max)])
+            j += 1
@@ -0,0 +1,173 @@
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from modules.typing import Face
+
+EMBEDDING_SIZE = 512
+ASSIGN_BLOCK_SIZE = 65536  # rows cast to float32 at a time when the whole store is labelled
+
+
+class FaceRecord:
+    """
+    One face of a FrameFaceStore. Holds only the store and its row; the columns are
+    read on access and to_face() materialises an insightface Face when one is needed.
+    """
+    __slots__ = ('store', 'row')
+
+    def __init__(self, store: 'FrameFaceStore', row: int):
+        self.store = store
+        self.row = row
+
+    @property
+    def frame_number(self) -> int:
+        return int(self.store.frame_numbers[self.row])
+
+    @property
+    def bbox(self) -> np.ndarray:
+        return self.store.bbox[self.row].copy()
+
+    @property
+    def kps(self) -> np.ndarray:
+        return self.store.kps[self.row].astype(np.float32) + self.store.bbox[self.row, :2]
+
+    @property
+    def landmark_2d_106(self) -> Optional[np.ndarray]:
+        if not self.store.has_landmark[self.row]:
+            return None
+        return self.store.landmark_2d_106[self.row].astype(np.float32) + self.store.bbox[self.row, :2]
+
+    @property
+    def det_score(self) -> float:
+        return float(self.store.det_score[self.row])
+
+    @property
+    def normed_embedding(self) -> np.ndarray:
+        return self.store.embedding[self.row].astype(np.float32)
+
+    @property
+    def centroid(self) -> int:
+        return int(self.store.centroid[self.row])
+
+    def to_face(self) -> Face:
+        # faces analysed without the recognition head are stored with a zero embedding
+        embedding = self.normed_embedding
+        return Face(bbox=self.bbox, kps=self.kps, det_score=self.det_score, landmark_2d_106=self.landmark_2d_106, embedding=embedding if embedding.any() else None)
+
+
+class FrameFaceStore:
+    """
+    Columnar per-frame face data of an analysed video, one row per face, rows sorted
+    by frame number. frame_offsets[f]:frame_offsets[f + 1] are the rows of frame f.
+    bbox is float32; kps and landmarks are float16 offsets from the bbox corner, which
+    keeps them sub-pixel on 4K frames; embeddings are float16.
+    """
+
+    def __init__(self, frame_numbers: np.ndarray, bbox: np.ndarray, kps: np.ndarray, landmark_2d_106: np.ndarray,
+                 has_landmark: np.ndarray, det_score: np.ndarray, embedding: np.ndarray, centroid: Optional[np.ndarray] = None):
+        self.frame_numbers = frame_numbers
+        self.bbox = bbox
+        self.kps = kps
+        self.landmark_2d_106 = landmark_2d_106
+        self.has_landmark = has_landmark
+        self.det_score = det_score
+        self.embedding = embedding
+        self.centroid = centroid if centroid is not None else np.full(len(frame_numbers), -1, dtype=np.int16)
+        last_frame_number = int(frame_numbers[-1]) if len(frame_numbers) else -1
+        self.frame_offsets = np.searchsorted(frame_numbers, np.arange(last_frame_number + 2)).astype(np.int64)
+
+    def __len__(self) -> int:
+        return len(self.frame_numbers)
+
+    def get_frame_rows(self, frame_number: int) -> range:
+        if frame_number is None or not 0 <= frame_number < len(self.frame_offsets) - 1:
+            return range(0)
+        return range(int(self.frame_offsets[frame_number]), int(self.frame_offsets[frame_number + 1]))
+
+    def get_frame_faces(self, frame_number: int) -> List[FaceRecord]:
+        return [FaceRecord(self, row) for row in self.get_frame_rows(frame_number)]
+
+    def get_centroid_faces(self, centroid: int) -> List[FaceRecord]:
+        return [FaceRecord(self, int(row)) for row in np.flatnonzero(self.centroid == centroid)]
+
+    def get_best_face(self, centroid: int) -> Optional[FaceRecord]:
+        rows = np.flatnonzero(self.centroid == centroid)
+        if not len(rows):
+            return None
+        return FaceRecord(self, int(rows[np.argmax(self.det_score[rows])]))
+
+    def assign_centroids(self, assign: Any) -> None:
+        """Labels every row with assign(embeddings) -> centroid indices, a block at a time."""
+        for start in range(0, len(self), ASSIGN_BLOCK_SIZE):
+            self.centroid[start:start + ASSIGN_BLOCK_SIZE] = assign(self.embedding[start:start + ASSIGN_BLOCK_SIZE].astype(np.float32))
+
+
+class FaceStoreBuilder:
+    """
+    Packs analysed frames into column chunks as they come in, so the Face objects can
+    be dropped right away. Thread safe; frames may arrive in any order.
+    """
+
+    def __init__(self):
+        self.chunks: List[Tuple[np.ndarray, ...]] = []
+        self.lock = threading.Lock()
+
+    def add_frames(self, frames: List[Dict[str, Any]]) -> np.ndarray:
+        """Adds {'frame': frame number, 'faces': faces} entries; returns their embeddings (float32)."""
+        faces = [(frame['frame'], face) for frame in frames for face in frame['faces']]
+        count = len(faces)
+        frame_numbers = np.empty(count, dtype=np.int32)
+        bbox = np.empty((count, 4), dtype=np.float32)
+        kps = np.zeros((count, 5, 2), dtype=np.float16)
+        landmark_2d_106 = np.zeros((count, 106, 2), dtype=np.float16)
+        has_landmark = np.zeros(count, dtype=bool)
+        det_score = np.empty(count, dtype=np.float16)
+        embedding = np.zeros((count, EMBEDDING_SIZE), dtype=np.float32)
+        for row, (frame_number, face) in enumerate(faces):
+            frame_numbers[row] = frame_number
+            bbox[row] = face.bbox
+            kps[row] = face.kps - face.bbox[:2]
+            if face.landmark_2d_106 is not None:
+                landmark_2d_106[row] = face.landmark_2d_106 - face.bbox[:2]
+                has_landmark[row] = True
+            det_score[row] = face.det_score
+            if face.embedding is not None:
+                embedding[row] = face.normed_embedding
+        with self.lock:
+            self.chunks.append((frame_numbers, bbox, kps, landmark_2d_106, has_landmark, det_score, embedding.astype(np.float16)))
+        return embedding
+
+    def build(self) -> FrameFaceStore:
+        with self.lock:
+            chunks = self.chunks
+            self.chunks = []
+        if not chunks:
+            return FrameFaceStore(np.empty(0, dtype=np.int32), np.empty((0, 4), dtype=np.float32), np.empty((0, 5, 2), dtype=np.float16),
+                                  np.empty((0, 106, 2), dtype=np.float16), np.empty(0, dtype=bool), np.empty(0, dtype=np.float16),
+                                  np.empty((0, EMBEDDING_SIZE), dtype=np.float16))
+        columns = [np.concatenate(column) for column in zip(*chunks)]
+        order = np.argsort(columns[0], kind='stable')
+        return FrameFaceStore(*[column[order] for column in columns])
+
+
+class FrameFaceIndex:
+    """
+    Frame number -> (source_face, target_face) pairs for map_faces videos, read from a
+    FrameFaceStore. Only the faces of the requested frame are materialised.
+    """
+
+    def __init__(self, store: Optional[FrameFaceStore], cluster_source_faces: Dict[int, Face]):
+        self.store = store
+        self.cluster_source_faces = cluster_source_faces
+
+    def get(self, frame_number: Optional[int], default: Any = None) -> List[Tuple[Face, Face]]:
+        pairs = []
+        if self.store is not None and frame_number is not None:
+            for record in self.store.get_frame_faces(frame_number):
+                source_face = self.cluster_source_faces.get(record.centroid)
+                if source_face is not None:
+                    pairs.append((source_face, record.to_face()))
+        if not pairs and default is not None:
+            return default
+        return pairs
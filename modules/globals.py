@@ -14,6 +14,8 @@ file_types = [
 # Face Mapping Data
 source_target_map: List[Dict[str, Any]] = [] # Stores detailed map for image/video processing
 simple_map: Dict[str, Any] = {}             # Stores simplified map (embeddings/faces) for live/simple mode
+target_face_store: Any = None               # Columnar per-frame faces of the analysed map_faces video (FrameFaceStore)
+frame_face_index: Any = {}                  # Frame number -> (source_face, target_face) pairs for map_faces videos (FrameFaceIndex)
 
 # Paths
 source_path: str | None = None
@@ -38,6 +40,7 @@ nsfw_filter: bool = False
 # Video Output Options
 video_encoder: str | None = None
 video_quality: int | None = None # Typically a CRF value or bitrate
+stream_frames: bool = False      # Pipe raw frames through ffmpeg instead of writing temp PNGs
 
 # Live Mode Options
 live_mirror: bool = False
@@ -45,6 +48,20 @@ live_resizable: bool = True
 camera_input_combobox: Any | None = None # Placeholder for UI element if needed
 webcam_preview_running: bool = False
 show_fps: bool = False
+live_pipeline_depth: int = 2       # Frames in flight between detection and swap; 1 runs them serially on one thread
+live_drop_policy: str = "oldest"   # When the swap stage falls behind: "oldest" drops the stalest detected frame, "block" waits
+
+# Face Detection Options
+adaptive_det_size: bool = False    # Pick the detector input size per frame instead of a fixed 640x640
+
+# Face Tracking Options
+face_tracking: bool = False        # Track faces between full detections instead of detecting every frame
+face_tracking_interval: int = 5    # Run full detection every N frames (scene cuts always re-detect)
+
+# Analysis Cache Options
+analysis_cache: bool = True        # Persist per-target face analyses and reuse them on later runs
+analysis_cache_dir: str | None = None  # Defaults to ~/.cache/deep-live-cam/analysis
+analysis_cache_max_gb: float = 5.0     # Disk budget of the analysis cache; least recently used analyses go first
 
 # System Configuration
 max_memory: int | None = None        # Memory limit in GB? (Needs clarification)
@@ -60,6 +77,7 @@ fp_ui: Dict[str, bool] = {"face_enhancer": False}
 face_swapper_enabled: bool = True # General toggle for the swapper processor
 opacity: float = 1.0              # Blend factor for the swapped face (0.0-1.0)
 sharpness: float = 0.0            # Sharpness enhancement for swapped face (0.0-1.0+)
+swap_batch_size: int = 4          # Aligned face crops per inswapper inference call (only with a dynamic-batch model)
 
 # Mouth Mask Options
 mouth_mask: bool = False           # Enable mouth area masking/pasting
@@ -77,6 +95,8 @@ interpolation_weight: float = 0.0   # Blend weight for current frame (0.0-1.0)
 # --- START: VPS Remote Processing ---
 vps_enabled: bool = False  # Habilitar processamento remoto na VPS
 vps_server_url: str | None = None  # URL do servidor VPS (ex: '192.168.1.100:8765')
+vps_streaming: bool = False  # Vídeos: a VPS processa enquanto o upload acontece e devolve a saída em stream
+vps_max_in_flight: int = 2  # Modo pasta: arquivos no servidor ao mesmo tempo (um sobe enquanto outro processa)
 # --- END: VPS Remote Processing ---
 
 # --- END OF FILE globals.py ---
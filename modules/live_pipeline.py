@@ -0,0 +1,188 @@
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from modules.typing import Frame
+from modules.video_capture import VideoCapturer
+
+LATENCY_SMOOTHING = 0.1  # weight of the newest sample in the per-stage moving averages
+DROP_POLICIES = ('oldest', 'block')
+
+
+class StageLatency:
+    """Exponential moving averages (ms) of the live pipeline stages. Thread safe."""
+
+    def __init__(self):
+        self.values: Dict[str, float] = {}
+        self.lock = threading.Lock()
+
+    def add(self, stage: str, milliseconds: float) -> None:
+        with self.lock:
+            previous = self.values.get(stage)
+            self.values[stage] = milliseconds if previous is None else previous + (milliseconds - previous) * LATENCY_SMOOTHING
+
+    def snapshot(self) -> Dict[str, float]:
+        with self.lock:
+            return dict(self.values)
+
+
+class LivePipeline:
+    """
+    Capture -> detection -> swap -> display for the webcam preview, each on its own clock.
+    The camera is read on the VideoCapturer thread into a latest-frame slot. detect(frame)
+    returns the prepared frame and its detections, swap(frame, detections) the processed
+    frame, and the display stage (on the UI thread) polls get_result() for the newest one.
+
+    With depth > 1 detection and swap run on separate threads joined by a queue of
+    depth - 1 frames, so the detection of frame N+1 overlaps the swap of frame N. When the
+    swap falls behind, drop_policy 'oldest' discards the stalest detected frame and 'block'
+    makes detection wait; either way the camera slot only ever holds the newest frame, so
+    a slow stage lowers the frame rate instead of adding latency. depth 1 runs both stages
+    serially on one thread.
+
+    Latencies reported by stats(), in ms:
+      capture   - time cap.read() blocks per frame
+      queue     - age of a frame when detection picks it up
+      detection - detect(frame)
+      handoff   - wait between detection and swap (depth > 1)
+      swap      - swap(frame, detections)
+      display   - conversion and drawing on the UI thread
+      total     - camera read to drawn (glass-to-glass minus the camera's own latency)
+    """
+
+    def __init__(self, capturer: VideoCapturer, detect: Callable[[Frame], Tuple[Frame, Any]], swap: Callable[[Frame, Any], Frame],
+                 depth: int = 1, drop_policy: str = 'oldest'):
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"Unknown drop policy {drop_policy!r}, expected one of {DROP_POLICIES}")
+        self.capturer = capturer
+        self.detect = detect
+        self.swap = swap
+        self.depth = max(1, depth)
+        self.drop_policy = drop_policy
+        self.latency = StageLatency()
+        self.detected: 'queue.Queue[Tuple[int, Frame, Any, float, float]]' = queue.Queue(maxsize=max(1, self.depth - 1))
+        self.dropped = 0  # detected frames discarded by the 'oldest' policy
+        self.result: Optional[Tuple[int, Frame, float]] = None  # (frame id, processed frame, captured at)
+        self.result_lock = threading.Lock()
+        self.error: Optional[Exception] = None
+        self.running = False
+        self.threads = []
+
+    def start(self) -> None:
+        self.running = True
+        self.capturer.start_thread()
+        targets = [('live-inference', self.run_serial)] if self.depth == 1 else [('live-detection', self.run_detection), ('live-swap', self.run_swap)]
+        self.threads = [threading.Thread(target=target, name=name, daemon=True) for name, target in targets]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self) -> None:
+        self.running = False
+        for thread in self.threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout=2.0)
+        self.threads = []
+
+    def is_alive(self) -> bool:
+        return self.running and self.capturer.is_running
+
+    def next_frame(self, frame_id: int) -> Optional[Tuple[int, Frame, float]]:
+        """Waits for a camera frame newer than frame_id; None when the pipeline or camera stopped."""
+        while self.running:
+            ret, frame, new_frame_id, captured_at = self.capturer.read_latest(frame_id, timeout=0.5)
+            if ret:
+                self.latency.add('queue', (time.perf_counter() - captured_at) * 1000)
+                return new_frame_id, frame, captured_at
+            if not self.capturer.is_running:
+                break
+        return None
+
+    def run_detection_stage(self, frame: Frame) -> Optional[Tuple[Frame, Any]]:
+        started = time.perf_counter()
+        try:
+            detection = self.detect(frame)
+        except Exception as e:
+            # surfaced by the display stage; a bad frame shouldn't stop the preview
+            self.error = e
+            return None
+        self.latency.add('detection', (time.perf_counter() - started) * 1000)
+        return detection
+
+    def run_swap_stage(self, frame_id: int, temp_frame: Frame, detections: Any, captured_at: float) -> None:
+        started = time.perf_counter()
+        try:
+            temp_frame = self.swap(temp_frame, detections)
+        except Exception as e:
+            self.error = e
+            return
+        self.latency.add('swap', (time.perf_counter() - started) * 1000)
+        self.set_result(frame_id, temp_frame, captured_at)
+
+    def run_serial(self) -> None:
+        frame_id = 0
+        while self.running:
+            captured = self.next_frame(frame_id)
+            if captured is None:
+                break
+            frame_id, frame, captured_at = captured
+            detection = self.run_detection_stage(frame)
+            if detection is not None:
+                self.run_swap_stage(frame_id, detection[0], detection[1], captured_at)
+        self.running = False
+
+    def run_detection(self) -> None:
+        frame_id = 0
+        while self.running:
+            captured = self.next_frame(frame_id)
+            if captured is None:
+                break
+            frame_id, frame, captured_at = captured
+            detection = self.run_detection_stage(frame)
+            if detection is not None:
+                self.hand_off((frame_id, detection[0], detection[1], captured_at, time.perf_counter()))
+        self.running = False
+
+    def hand_off(self, item: Tuple[int, Frame, Any, float, float]) -> None:
+        while self.running:
+            try:
+                self.detected.put(item, timeout=0.1 if self.drop_policy == 'block' else 0)
+                return
+            except queue.Full:
+                if self.drop_policy == 'oldest':
+                    try:
+                        self.detected.get_nowait()
+                        self.dropped += 1
+                    except queue.Empty:
+                        pass
+
+    def run_swap(self) -> None:
+        while self.running:
+            try:
+                frame_id, temp_frame, detections, captured_at, detected_at = self.detected.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            self.latency.add('handoff', (time.perf_counter() - detected_at) * 1000)
+            self.run_swap_stage(frame_id, temp_frame, detections, captured_at)
+
+    def set_result(self, frame_id: int, temp_frame: Frame, captured_at: float) -> None:
+        with self.result_lock:
+            if self.result is None or frame_id > self.result[0]:
+                self.result = (frame_id, temp_frame, captured_at)
+
+    def get_result(self, last_frame_id: int = 0) -> Optional[Tuple[int, Frame, float]]:
+        """The newest processed (frame id, frame, captured at), or None if nothing newer than last_frame_id."""
+        with self.result_lock:
+            if self.result is None or self.result[0] <= last_frame_id:
+                return None
+            return self.result
+
+    def record_display(self, captured_at: float, started: float) -> None:
+        now = time.perf_counter()
+        self.latency.add('display', (now - started) * 1000)
+        self.latency.add('total', (now - captured_at) * 1000)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self.latency.snapshot()
+        stats['capture'] = self.capturer.capture_ms
+        return stats
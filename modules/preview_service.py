@@ -0,0 +1,87 @@
+import threading
+from typing import Any, Callable, Hashable, List, Optional
+
+
+class PreviewService:
+    """
+    Renders preview requests on a background thread so the UI thread never blocks.
+    Requests coalesce: only the most recent pending one is rendered. A result whose
+    request was superseded (or cancelled) while rendering is dropped instead of
+    delivered. While idle, the requests returned by `prefetch` are rendered too, so
+    render() should fill a cache the next request reads from.
+    `schedule` hands the delivery back to the UI thread (e.g. Tk's after()).
+    """
+
+    def __init__(self, render: Callable[[Hashable], Any], deliver: Callable[[Hashable, Any, Optional[Exception]], None],
+                 schedule: Callable[[Callable[[], None]], None], prefetch: Optional[Callable[[Hashable], List[Hashable]]] = None):
+        self.render = render
+        self.deliver = deliver
+        self.schedule = schedule
+        self.prefetch = prefetch
+        self.condition = threading.Condition()
+        self.pending: Optional[Hashable] = None
+        self.prefetch_requests: List[Hashable] = []
+        self.generation = 0
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='preview-service', daemon=True)
+        self.thread.start()
+
+    def request(self, request: Hashable) -> None:
+        with self.condition:
+            self.pending = request
+            self.generation += 1
+            self.prefetch_requests = []
+            self.condition.notify()
+
+    def cancel(self) -> None:
+        """Drops the pending request and any result still being rendered."""
+        with self.condition:
+            self.pending = None
+            self.generation += 1
+            self.prefetch_requests = []
+
+    def stop(self) -> None:
+        with self.condition:
+            self.running = False
+            self.generation += 1
+            self.condition.notify()
+
+    def is_current(self, generation: int) -> bool:
+        with self.condition:
+            return self.running and generation == self.generation
+
+    def deliver_if_current(self, generation: int, request: Hashable, result: Any, error: Optional[Exception]) -> None:
+        # runs on the UI thread; a newer request may have come in since the result was scheduled
+        if self.is_current(generation):
+            self.deliver(request, result, error)
+
+    def run(self) -> None:
+        while True:
+            with self.condition:
+                while self.running and self.pending is None and not self.prefetch_requests:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                if self.pending is not None:
+                    request, self.pending = self.pending, None
+                    generation = self.generation
+                    is_prefetch = False
+                else:
+                    request = self.prefetch_requests.pop(0)
+                    generation = self.generation
+                    is_prefetch = True
+
+            result, error = None, None
+            try:
+                result = self.render(request)
+            except Exception as e:
+                error = e
+            if is_prefetch:
+                continue
+            if self.is_current(generation):
+                self.schedule(lambda request=request, result=result, error=error, generation=generation: self.deliver_if_current(generation, request, result, error))
+                if self.prefetch and error is None:
+                    prefetch_requests = self.prefetch(request)
+                    with self.condition:
+                        if generation == self.generation:
+                            self.prefetch_requests = list(prefetch_requests)
@@ -1,14 +1,21 @@
 import sys
+import queue
 import importlib
+import threading
+from collections import deque
 from concurrent.futures import ThreadPoolExecutor
 from types import ModuleType
-from typing import Any, List, Callable
+from typing import Any, Dict, List, Callable, Iterable, Iterator, Optional
 from tqdm import tqdm
 
 import modules
-import modules.globals                   
+import modules.globals
+from modules.typing import Frame
 
 FRAME_PROCESSORS_MODULES: List[ModuleType] = []
+MAX_CHUNK_SIZE = 32  # upper bound of contiguous frames handed to one worker at a time
+CHUNKS_PER_WORKER = 4
+STREAM_RUN_FRAMES = 16  # contiguous streamed frames one worker processes with a shared context (tracker, det size hint)
 FRAME_PROCESSORS_INTERFACE = [
     'pre_check',
     'pre_start',
@@ -66,14 +73,70 @@ def set_frame_processors_modules_from_ui(frame_processors: List[str]) -> None:
             except Exception as e:
                  print(f"Warning: Error removing frame processor {frame_processor}: {e}")
 
+def get_chunk_size(total: int, workers: int) -> int:
+    # a few chunks per worker keeps the load balanced while each worker still gets a contiguous run
+    return max(1, min(MAX_CHUNK_SIZE, total // (workers * CHUNKS_PER_WORKER)))
+
+
+def iter_chunks(items: Iterable[Any], chunk_size: int) -> Iterator[List[Any]]:
+    chunk: List[Any] = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def run_chunked(chunks: Iterable[Any], handle_chunk: Callable[[Any], None], workers: int, max_pending: Optional[int] = None) -> None:
+    """
+    Hands chunks to a fixed pool of worker threads through a bounded queue.
+    The producer blocks while the queue is full, so at most workers + max_pending (default
+    workers * 2) chunks are pending, plus the one the producer is building.
+    The first error raised by a worker stops the scheduling and is re-raised here.
+    """
+    workers = max(1, workers)
+    chunk_queue: queue.Queue = queue.Queue(maxsize=max(1, max_pending or workers * 2))  # type: ignore[type-arg]
+    errors: List[BaseException] = []
+
+    def worker() -> None:
+        while True:
+            chunk = chunk_queue.get()
+            if chunk is None:
+                return
+            if errors:
+                continue
+            try:
+                handle_chunk(chunk)
+            except BaseException as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    try:
+        for chunk in chunks:
+            if errors:
+                break
+            chunk_queue.put(chunk)
+    finally:
+        for _ in threads:
+            chunk_queue.put(None)
+        for thread in threads:
+            thread.join()
+    if errors:
+        raise errors[0]
+
+
 def multi_process_frame(source_path: str, temp_frame_paths: List[str], process_frames: Callable[[str, List[str], Any], None], progress: Any = None) -> None:
-    with ThreadPoolExecutor(max_workers=modules.globals.execution_threads) as executor:
-        futures = []
-        for path in temp_frame_paths:
-            future = executor.submit(process_frames, source_path, [path], progress)
-            futures.append(future)
-        for future in futures:
-            future.result()
+    workers = modules.globals.execution_threads or 1
+    chunk_size = get_chunk_size(len(temp_frame_paths), workers)
+    run_chunked(
+        iter_chunks(temp_frame_paths, chunk_size),
+        lambda chunk: process_frames(source_path, chunk, progress),
+        workers
+    )
 
 
 def process_video(source_path: str, frame_paths: list[str], process_frames: Callable[[str, List[str], Any], None]) -> None:
@@ -82,3 +145,191 @@ def process_video(source_path: str, frame_paths: list[str], process_frames: Call
     with tqdm(total=total, desc='Processing', unit='frame', dynamic_ncols=True, bar_format=progress_bar_format) as progress:
         progress.set_postfix({'execution_providers': modules.globals.execution_providers, 'execution_threads': modules.globals.execution_threads, 'max_memory': modules.globals.max_memory})
         multi_process_frame(source_path, frame_paths, process_frames, progress)
+
+
+def process_frame_batch(frame_processors: List[ModuleType], source_face: Any, temp_frames: List[Frame], context: Dict[str, Any]) -> List[Frame]:
+    """
+    Runs a batch of consecutive frames through every processor in one pass.
+    Processors exposing process_frame_batch share the context dict, so later
+    stages reuse what earlier ones found (e.g. the swapper's detected faces).
+    """
+    for frame_processor in frame_processors:
+        if hasattr(frame_processor, 'process_frame_batch'):
+            temp_frames = frame_processor.process_frame_batch(source_face, temp_frames, context)
+        else:
+            temp_frames = [frame_processor.process_frame(source_face, temp_frame) for temp_frame in temp_frames]
+    return temp_frames
+
+
+def get_video_frame_processors(source_path: str, target_path: Optional[str] = None, job_state: Optional[Dict[str, Any]] = None) -> List[ModuleType]:
+    """
+    Loads the enabled processors and prepares their job state before the workers start.
+    job_state is a dict owned by the job pass (also set as context['job_state'] on its
+    batches) where the processors keep what belongs to this job only.
+    """
+    frame_processors = list(get_frame_processors_modules(modules.globals.frame_processors))
+    for frame_processor in list(frame_processors):
+        if hasattr(frame_processor, 'prepare_video') and not frame_processor.prepare_video(source_path, target_path, job_state):
+            print(f'[DLC.CORE] {frame_processor.NAME} is not ready for this job, skipping it.')
+            frame_processors.remove(frame_processor)
+    return frame_processors
+
+
+def finish_video_frame_processors(frame_processors: List[ModuleType], target_path: Optional[str] = None, job_state: Optional[Dict[str, Any]] = None) -> None:
+    """Lets the processors persist what they gathered once every frame of the job went through them."""
+    for frame_processor in frame_processors:
+        if hasattr(frame_processor, 'finish_video'):
+            frame_processor.finish_video(target_path, job_state)
+
+
+def cancel_video_frame_processors(frame_processors: List[ModuleType], job_state: Optional[Dict[str, Any]] = None) -> None:
+    """Lets the processors drop what they gathered when some frames of the job were skipped or left unprocessed."""
+    for frame_processor in frame_processors:
+        if hasattr(frame_processor, 'cancel_video'):
+            frame_processor.cancel_video(job_state)
+
+
+def get_batch_size() -> int:
+    return max(1, getattr(modules.globals, 'swap_batch_size', 1) or 1)
+
+
+def process_video_fused(source_path: str, temp_frame_paths: List[str], target_path: Optional[str] = None) -> None:
+    """
+    Processes the temp frames with every enabled processor in a single pass.
+    Each frame is decoded and encoded once, instead of once per processor.
+    Unreadable frames are skipped and a failing batch keeps its original frames; either
+    way the job is incomplete, so the processors are cancelled instead of finished.
+    """
+    import cv2
+
+    job_state: Dict[str, Any] = {}
+    frame_processors = get_video_frame_processors(source_path, target_path, job_state)
+    batch_size = get_batch_size()
+    incomplete = threading.Event()
+
+    def process_chunk(source_path: str, chunk: List[str], progress: Any) -> None:
+        # A chunk is a contiguous run of frames, so the context can carry trackers across batches
+        context: Dict[str, Any] = {'target_path': target_path, 'job_state': job_state}
+        for batch_start in range(0, len(chunk), batch_size):
+            batch_paths = []
+            batch_frames = []
+            for temp_frame_path in chunk[batch_start:batch_start + batch_size]:
+                temp_frame = cv2.imread(temp_frame_path)
+                if temp_frame is None:
+                    print(f'[DLC.CORE] Could not read frame {temp_frame_path}, skipping.')
+                    incomplete.set()
+                    progress.update(1)
+                    continue
+                batch_paths.append(temp_frame_path)
+                batch_frames.append(temp_frame)
+            if not batch_frames:
+                continue
+            context['frame_paths'] = batch_paths
+            try:
+                result_frames = process_frame_batch(frame_processors, None, batch_frames, context)
+            except Exception as e:
+                print(f'[DLC.CORE] Error processing frames {batch_paths[0]}..{batch_paths[-1]}: {e}')
+                incomplete.set()
+                result_frames = batch_frames
+            for temp_frame_path, temp_frame in zip(batch_paths, result_frames):
+                if not cv2.imwrite(temp_frame_path, temp_frame):
+                    print(f'[DLC.CORE] Failed to write frame {temp_frame_path}.')
+                progress.update(1)
+
+    process_video(source_path, temp_frame_paths, process_chunk)
+    if incomplete.is_set():
+        cancel_video_frame_processors(frame_processors, job_state)
+    else:
+        finish_video_frame_processors(frame_processors, target_path, job_state)
+
+
+def process_frame_stream(frame_processors: List[ModuleType], frames: Iterable[Frame], write_frame: Callable[[Frame], None], target_path: Optional[str] = None,
+                         job_state: Optional[Dict[str, Any]] = None) -> bool:
+    """
+    Runs a stream of frames through the processors on the worker pool and hands them to
+    write_frame in order. Each worker gets a contiguous run of STREAM_RUN_FRAMES frames and
+    processes it batch by batch with one context, so face tracking and the adaptive det size
+    carry over like in process_video_fused. Only a window of runs is held in memory.
+    Like process_video_fused, a failing batch is written unprocessed; returns False if any did.
+    """
+    batch_size = get_batch_size()
+    run_size = batch_size * max(1, -(-STREAM_RUN_FRAMES // batch_size))
+    window_size = max(1, modules.globals.execution_threads or 1) + 1
+    incomplete = threading.Event()
+
+    def process_run(first_frame_number: int, temp_frames: List[Frame]) -> List[Frame]:
+        context: Dict[str, Any] = {'target_path': target_path}
+        if job_state is not None:
+            context['job_state'] = job_state
+        result_frames: List[Frame] = []
+        for batch_start in range(0, len(temp_frames), batch_size):
+            batch_frames = temp_frames[batch_start:batch_start + batch_size]
+            # frame numbers are 1-based like temp frames
+            context['frame_numbers'] = list(range(first_frame_number + batch_start, first_frame_number + batch_start + len(batch_frames)))
+            try:
+                result_frames.extend(process_frame_batch(frame_processors, None, batch_frames, context))
+            except Exception as e:
+                print(f"[DLC.CORE] Error processing frames {context['frame_numbers'][0]}..{context['frame_numbers'][-1]}: {e}")
+                incomplete.set()
+                result_frames.extend(batch_frames)
+        return result_frames
+
+    with ThreadPoolExecutor(max_workers=modules.globals.execution_threads) as executor:
+        futures: deque = deque()  # type: ignore[type-arg]
+        for run_index, temp_frames in enumerate(iter_chunks(frames, run_size)):
+            futures.append(executor.submit(process_run, run_index * run_size + 1, temp_frames))
+            if len(futures) >= window_size:
+                for temp_frame in futures.popleft().result():
+                    write_frame(temp_frame)
+        while futures:
+            for temp_frame in futures.popleft().result():
+                write_frame(temp_frame)
+    return not incomplete.is_set()
+
+
+def process_video_stream(source_path: str, target_path: str, fps: float = 30.0) -> bool:
+    """
+    Streams the target video through every enabled frame processor without temp frames.
+    ffmpeg decodes raw BGR frames to a pipe, the frames are processed in memory in
+    batches and a second ffmpeg process encodes them from stdin. Frame order is preserved.
+    Both ffmpeg processes are closed whatever happens.
+    """
+    import cv2
+    import numpy
+    from modules.capturer import get_video_frame_total
+    from modules.utilities import detect_resolution, read_frames, open_video_writer, close_video_writer
+
+    job_state: Dict[str, Any] = {}
+    frame_processors = get_video_frame_processors(source_path, target_path, job_state)
+
+    width, height = detect_resolution(target_path)
+    writer = open_video_writer(target_path, width, height, fps)
+    frames = read_frames(target_path)
+
+    def write_frame(temp_frame: Frame) -> None:
+        if temp_frame.shape[:2] != (height, width):
+            temp_frame = cv2.resize(temp_frame, (width, height))
+        writer.stdin.write(numpy.ascontiguousarray(temp_frame, dtype=numpy.uint8).tobytes())
+        progress.update(1)
+
+    progress_bar_format = '{l_bar}{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}, {rate_fmt}{postfix}]'
+    streamed = False
+    complete = False
+    try:
+        with tqdm(total=get_video_frame_total(target_path), desc='Streaming', unit='frame', dynamic_ncols=True, bar_format=progress_bar_format) as progress:
+            progress.set_postfix({'execution_providers': modules.globals.execution_providers, 'execution_threads': modules.globals.execution_threads, 'max_memory': modules.globals.max_memory})
+            complete = process_frame_stream(frame_processors, frames, write_frame, target_path, job_state)
+        streamed = True
+    except BrokenPipeError:
+        print('[DLC.CORE] Video encoder closed the frame pipe unexpectedly.')
+    finally:
+        frames.close()
+        encoded = close_video_writer(writer)
+    if not streamed or not encoded:
+        cancel_video_frame_processors(frame_processors, job_state)
+        return False
+    if complete:
+        finish_video_frame_processors(frame_processors, target_path, job_state)
+    else:
+        cancel_video_frame_processors(frame_processors, job_state)
+    return True
@@ -1,12 +1,15 @@
 # --- START OF FILE face_enhancer.py ---
 
-from typing import Any, List
+from typing import Any, Dict, List, Optional
 import cv2
 import threading
 import gfpgan
 import os
 import platform
+import numpy as np
 import torch # Make sure torch is imported
+from basicsr.utils import img2tensor, tensor2img
+from torchvision.transforms.functional import normalize
 
 import modules.globals
 import modules.processors.frame.core
@@ -127,19 +130,53 @@ def get_face_enhancer() -> Any:
     return FACE_ENHANCER
 
 
-def enhance_face(temp_frame: Frame) -> Frame:
-    """Enhances faces in a single frame using the global GFPGANer instance."""
+def restore_aligned_faces(enhancer: Any, temp_frame: Frame, target_faces: List[Face]) -> Frame:
+    """
+    Same steps as GFPGANer.enhance, but aligns the faces from the 5 keypoints the
+    face analyser already found, so GFPGAN's own RetinaFace detection is skipped.
+    """
+    face_helper = enhancer.face_helper
+    face_helper.clean_all()
+    face_helper.read_image(temp_frame)
+    face_helper.all_landmarks_5 = [np.asarray(face.kps, dtype=np.float32) for face in target_faces]
+    face_helper.align_warp_face()
+
+    with torch.no_grad():
+        for cropped_face in face_helper.cropped_faces:
+            cropped_face_t = img2tensor(cropped_face / 255., bgr2rgb=True, float32=True)
+            normalize(cropped_face_t, (0.5, 0.5, 0.5), (0.5, 0.5, 0.5), inplace=True)
+            cropped_face_t = cropped_face_t.unsqueeze(0).to(enhancer.device)
+            output = enhancer.gfpgan(cropped_face_t, return_rgb=False, weight=0.5)[0]
+            restored_face = tensor2img(output.squeeze(0), rgb2bgr=True, min_max=(-1, 1))
+            face_helper.add_restored_face(restored_face.astype('uint8'))
+
+    face_helper.get_inverse_affine(None)
+    return face_helper.paste_faces_to_input_image(upsample_img=None)
+
+
+def enhance_face(temp_frame: Frame, target_faces: Optional[List[Face]] = None) -> Frame:
+    """
+    Enhances faces in a single frame using the global GFPGANer instance.
+    When target_faces is given (faces already found by an earlier processor),
+    only those faces are restored and GFPGAN doesn't detect again.
+    """
     # Ensure enhancer is ready
     enhancer = get_face_enhancer()
     try:
         with THREAD_SEMAPHORE:
-            # The enhance method returns: _, restored_faces, restored_img
-            _, _, restored_img = enhancer.enhance(
-                temp_frame,
-                has_aligned=False, # Assume faces are not pre-aligned
-                only_center_face=False, # Enhance all detected faces
-                paste_back=True # Paste enhanced faces back onto the original image
-            )
+            if target_faces is not None:
+                target_faces = [face for face in target_faces if getattr(face, 'kps', None) is not None]
+                if not target_faces:
+                    return temp_frame
+                restored_img = restore_aligned_faces(enhancer, temp_frame, target_faces)
+            else:
+                # The enhance method returns: _, restored_faces, restored_img
+                _, _, restored_img = enhancer.enhance(
+                    temp_frame,
+                    has_aligned=False, # Assume faces are not pre-aligned
+                    only_center_face=False, # Enhance all detected faces
+                    paste_back=True # Paste enhanced faces back onto the original image
+                )
         # GFPGAN might return None if no face is detected or an error occurs
         if restored_img is None:
             # print(f"{NAME}: Warning: GFPGAN enhancement returned None. Returning original frame.")
@@ -166,6 +203,14 @@ def process_frame(source_face: Face | None, temp_frame: Frame) -> Frame:
     return temp_frame
 
 
+def process_frame_batch(source_face: Face | None, temp_frames: List[Frame], context: Dict[str, Any]) -> List[Frame]:
+    """Fused pipeline hook: reuses the faces an earlier processor put in context['detected_faces']."""
+    detected_faces = context.get('detected_faces')
+    if detected_faces is None or len(detected_faces) != len(temp_frames):
+        return [enhance_face(temp_frame) for temp_frame in temp_frames]
+    return [enhance_face(temp_frame, target_faces) for temp_frame, target_faces in zip(temp_frames, detected_faces)]
+
+
 def process_frames(
     source_path: str | None, temp_frame_paths: List[str], progress: Any = None
 ) -> None:
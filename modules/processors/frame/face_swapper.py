@@ -1,18 +1,22 @@
-from typing import Any, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 import cv2
 import insightface
+from insightface.utils import face_align
 import threading
 import numpy as np
 import platform
 import modules.globals
 import modules.processors.frame.core
 from modules.core import update_status
-from modules.face_analyser import get_one_face, get_many_faces, default_source_face
+from modules.analysis_cache import get_cache_key, is_cache_enabled, load_analysis, save_analysis
+from modules.face_analyser import get_one_face, get_many_faces, get_source_image_face, default_source_face, build_frame_face_index, get_analysis_config, FaceTracker, FaceSizeHint, LIVE_FACE_SIZE_HINT, get_live_face_tracker
+from modules.face_store import FaceStoreBuilder, FrameFaceStore
 from modules.typing import Face, Frame
 from modules.utilities import (
     conditional_download,
     is_image,
     is_video,
+    get_frame_number,
 )
 from modules.cluster_analysis import find_closest_centroid
 import os
@@ -23,6 +27,19 @@ FACE_SWAPPER = None
 THREAD_LOCK = threading.Lock()
 NAME = "DLC.FACE-SWAPPER"
 
+# --- START: Job-scoped source face ---
+SOURCE_FACE = None      # Source face resolved once per job and shared by all workers
+SOURCE_FACE_KEY = None  # (path, mtime) the cached SOURCE_FACE was built from
+SOURCE_FACE_LOCK = threading.Lock()
+SOURCE_LATENT_CACHE = {}  # normed source embedding bytes -> inswapper latent
+SOURCE_LATENT_CACHE_SIZE = 64
+# --- END: Job-scoped source face ---
+
+# --- START: Cached target detections (simple mode) ---
+TARGET_FACE_STORES = {}       # analysis cache key -> FrameFaceStore of the target's detections (None = not cached)
+TARGET_FACE_LOCK = threading.Lock()
+# --- END: Cached target detections (simple mode) ---
+
 # --- START: Added for Interpolation ---
 PREVIOUS_FRAME_RESULT = None # Stores the final processed frame from the previous step
 # --- END: Added for Interpolation ---
@@ -65,10 +82,57 @@ def pre_start() -> bool:
         # Error message already printed within get_face_swapper
         return False
 
+    # Resolve the simple-mode source face up front so every file in the job reuses it
+    if modules.globals.source_path:
+        get_source_face(modules.globals.source_path)
+    prepare_source_latents()
+
     # Add other essential checks if needed, e.g., target/source path validity
     return True
 
 
+def get_source_face(source_path: str) -> Optional[Face]:
+    """
+    Returns the face of the source image, analysing it only when the path or the file changes.
+    The result is shared by every worker thread and every file of a folder queue.
+    """
+    global SOURCE_FACE, SOURCE_FACE_KEY
+
+    if not source_path or not os.path.exists(source_path):
+        update_status(f"Error: Source path invalid or not provided for simple mode: {source_path}", NAME)
+        return None
+
+    key = (os.path.abspath(source_path), os.path.getmtime(source_path))
+    with SOURCE_FACE_LOCK:
+        if SOURCE_FACE_KEY == key:
+            return SOURCE_FACE
+
+        SOURCE_FACE = None
+        SOURCE_LATENT_CACHE.clear()
+        try:
+            # The face analyser's registry skips the analysis for a source it has seen before
+            SOURCE_FACE = get_source_image_face(source_path)
+            if SOURCE_FACE is None:
+                update_status(f"Warning: No face was detected in source image {source_path} (or it could not be read). Swaps will be skipped.", NAME)
+        except Exception as e:
+            import traceback
+            print(f"{NAME}: Caught exception during source image processing for {source_path}:")
+            traceback.print_exc()
+            update_status(f"Error during source image reading or analysis {source_path}: {e}", NAME)
+        SOURCE_FACE_KEY = key
+        return SOURCE_FACE
+
+
+def reset_source_face() -> None:
+    """Drops the cached source face so the next job analyses the source image again."""
+    global SOURCE_FACE, SOURCE_FACE_KEY
+
+    with SOURCE_FACE_LOCK:
+        SOURCE_FACE = None
+        SOURCE_FACE_KEY = None
+        SOURCE_LATENT_CACHE.clear()
+
+
 def get_face_swapper() -> Any:
     global FACE_SWAPPER
 
@@ -135,6 +199,10 @@ def get_face_swapper() -> Any:
                     session_options=sess_options,  # NOVA OPÇÃO CRÍTICA
                 )
                 update_status("Face swapper model loaded successfully.", NAME)
+                batch_dim = get_swap_batch_dim(FACE_SWAPPER)
+                if batch_dim is not None and batch_dim < get_swap_batch_size():
+                    # Logged here, once per loaded model, instead of on every batch
+                    update_status(f"{model_name} has a fixed batch of {batch_dim}; swap_batch_size {get_swap_batch_size()} needs a dynamic-batch model, running {batch_dim} crop(s) per call.", NAME)
             except Exception as e:
                 update_status(f"Error loading face swapper model: {e}", NAME)
                 FACE_SWAPPER = None
@@ -142,104 +210,245 @@ def get_face_swapper() -> Any:
     return FACE_SWAPPER
 
 
-def swap_face(source_face: Face, target_face: Face, temp_frame: Frame) -> Frame:
-    face_swapper = get_face_swapper()
-    if face_swapper is None:
-        update_status("Face swapper model not loaded or failed to load. Skipping swap.", NAME)
-        return temp_frame
+def get_swap_batch_size() -> int:
+    return max(1, int(getattr(modules.globals, "swap_batch_size", 1) or 1))
 
-    # Store a copy of the original frame before swapping for opacity blending
-    original_frame = temp_frame.copy()
 
-    # Pre-swap Input Check with optimization
-    if temp_frame.dtype != np.uint8:
-        temp_frame = np.clip(temp_frame, 0, 255).astype(np.uint8)
+def get_swap_batch_dim(face_swapper: Any) -> Optional[int]:
+    """Returns the fixed batch size the inswapper model was exported with, or None if its batch axis is dynamic."""
+    batch_dim = face_swapper.input_shape[0] if face_swapper.input_shape else None
+    return batch_dim if isinstance(batch_dim, int) and batch_dim > 0 else None
 
-    # Apply the face swap - process EXACTLY like CPU does
-    try:
-        # For Apple Silicon, use optimized inference
-        if IS_APPLE_SILICON:
-            # Ensure contiguous memory layout for better performance
-            temp_frame = np.ascontiguousarray(temp_frame)
-        
-        # Process exactly the same way for both CPU and CUDA
-        # No special handling for CUDA - let it process like CPU
-        swapped_frame_raw = face_swapper.get(
-            temp_frame, target_face, source_face, paste_back=True
-        )
 
-        # --- START: CRITICAL FIX FOR ORT 1.17 ---
-        # Check the output type and range from the model
-        if swapped_frame_raw is None:
-             # print("Warning: face_swapper.get returned None.") # Debug
-             return original_frame # Return original if swap somehow failed internally
-
-        # Ensure the output is a numpy array
-        if not isinstance(swapped_frame_raw, np.ndarray):
-            # print(f"Warning: face_swapper.get returned type {type(swapped_frame_raw)}, expected numpy array.") # Debug
-            return original_frame
-
-        # Ensure the output has the correct shape (like the input frame)
-        if swapped_frame_raw.shape != temp_frame.shape:
-             # print(f"Warning: Swapped frame shape {swapped_frame_raw.shape} differs from input {temp_frame.shape}.") # Debug
-             # Attempt resize (might distort if aspect ratio changed, but better than crashing)
-             try:
-                 swapped_frame_raw = cv2.resize(swapped_frame_raw, (temp_frame.shape[1], temp_frame.shape[0]), interpolation=cv2.INTER_LINEAR)
-             except Exception as resize_e:
-                 # print(f"Error resizing swapped frame: {resize_e}") # Debug
-                 return original_frame
-
-        # Explicitly clip values to 0-255 and convert to uint8
-        # This handles cases where the model might output floats or values outside the valid range
-        # Process EXACTLY like CPU - no special CUDA handling
-        swapped_frame = np.clip(swapped_frame_raw, 0, 255).astype(np.uint8)
-        # --- END: CRITICAL FIX FOR ORT 1.17 ---
+def prepare_swap_input(face_swapper: Any, temp_frame: Frame, target_face: Face) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Aligns the target face to the inswapper input and returns (aligned crop, affine matrix, blob)."""
+    aimg, M = face_align.norm_crop2(temp_frame, target_face.kps, face_swapper.input_size[0])
+    blob = cv2.dnn.blobFromImage(
+        aimg, 1.0 / face_swapper.input_std, face_swapper.input_size,
+        (face_swapper.input_mean, face_swapper.input_mean, face_swapper.input_mean), swapRB=True
+    )
+    return aimg, M, blob
 
-    except Exception as e:
-        print(f"Error during face swap using face_swapper.get: {e}") # More specific error
-        # import traceback
-        # traceback.print_exc() # Print full traceback for debugging
-        return original_frame # Return original if swap fails
 
-    # --- Post-swap Processing (Masking, Opacity, etc.) ---
-    # Now, work with the guaranteed uint8 'swapped_frame'
+def get_source_latent(face_swapper: Any, source_face: Face) -> np.ndarray:
+    """
+    Returns the source embedding projected into the inswapper latent space (same math as INSwapper.get).
+    The latent only depends on the source face, so it is computed once and cached by embedding.
+    """
+    key = source_face.normed_embedding.tobytes()
+    latent = SOURCE_LATENT_CACHE.get(key)
+    if latent is None:
+        latent = source_face.normed_embedding.reshape((1, -1))
+        latent = np.dot(latent, face_swapper.emap)
+        latent /= np.linalg.norm(latent)
+        with SOURCE_FACE_LOCK:
+            if len(SOURCE_LATENT_CACHE) >= SOURCE_LATENT_CACHE_SIZE:
+                SOURCE_LATENT_CACHE.clear()
+            SOURCE_LATENT_CACHE[key] = latent
+    return latent
+
+
+def prepare_source_latents() -> None:
+    """Precomputes the latents of the simple-mode source face and of every mapped source face."""
+    face_swapper = get_face_swapper()
+    if face_swapper is None:
+        return
+    source_faces = [SOURCE_FACE]
+    source_faces.extend(getattr(modules.globals, "simple_map", {}).get("source_faces", []))
+    source_faces.extend(map_data["source"]["face"] for map_data in modules.globals.source_target_map if map_data.get("source"))
+    for source_face in source_faces:
+        if source_face is not None and source_face.normed_embedding is not None:
+            get_source_latent(face_swapper, source_face)
+
+
+def run_swap_batch(face_swapper: Any, blobs: List[np.ndarray], latents: List[np.ndarray]) -> List[np.ndarray]:
+    """
+    Runs the inswapper session over the aligned crops, swap_batch_size crops per call.
+    Only a model exported with a dynamic batch axis takes more than one crop per call; the
+    stock inswapper_128(_fp16).onnx has a fixed batch of 1, so it runs one crop at a time.
+    Returns the swapped 128x128 BGR uint8 faces in input order.
+    """
+    batch_size = get_swap_batch_dim(face_swapper) or get_swap_batch_size()
+
+    swapped_faces = []
+    for start in range(0, len(blobs), batch_size):
+        pred = face_swapper.session.run(face_swapper.output_names, {
+            face_swapper.input_names[0]: np.concatenate(blobs[start:start + batch_size], axis=0),
+            face_swapper.input_names[1]: np.concatenate(latents[start:start + batch_size], axis=0),
+        })[0]
+        img_fake = pred.transpose((0, 2, 3, 1))
+        bgr_fake = np.clip(255 * img_fake, 0, 255).astype(np.uint8)[:, :, :, ::-1]
+        swapped_faces.extend(bgr_fake)
+    return swapped_faces
+
+
+def get_paste_box(M: np.ndarray, crop_size: Tuple[int, int], frame_shape: Tuple[int, ...]) -> Optional[Tuple[int, int, int, int]]:
+    """Returns the frame region (x1, y1, x2, y2) covered by the aligned crop once warped back, or None if it is outside."""
+    IM = cv2.invertAffineTransform(M)
+    crop_w, crop_h = crop_size
+    corners = np.array([[0, 0, 1], [crop_w, 0, 1], [0, crop_h, 1], [crop_w, crop_h, 1]], dtype=np.float64) @ IM.T
+    frame_h, frame_w = frame_shape[:2]
+    x1 = max(0, int(np.floor(corners[:, 0].min())) - 1)
+    y1 = max(0, int(np.floor(corners[:, 1].min())) - 1)
+    x2 = min(frame_w, int(np.ceil(corners[:, 0].max())) + 2)
+    y2 = min(frame_h, int(np.ceil(corners[:, 1].max())) + 2)
+    if x2 <= x1 or y2 <= y1:
+        return None
+    return x1, y1, x2, y2
+
+
+def paste_back(temp_frame: Frame, bgr_fake: np.ndarray, aimg: np.ndarray, M: np.ndarray) -> Optional[Tuple[np.ndarray, Tuple[int, int, int, int]]]:
+    """
+    Warps the swapped crop back with the same soft mask INSwapper.get uses, but only inside the
+    region the crop covers. Returns (swapped region, paste box) or None when nothing is visible.
+    """
+    paste_box = get_paste_box(M, (aimg.shape[1], aimg.shape[0]), temp_frame.shape)
+    if paste_box is None:
+        return None
+    x1, y1, x2, y2 = paste_box
+    roi_size = (x2 - x1, y2 - y1)
+
+    # Same inverse transform as the full-frame warp, shifted into the paste box
+    IM = cv2.invertAffineTransform(M)
+    IM[:, 2] -= (x1, y1)
+    img_white = np.full((aimg.shape[0], aimg.shape[1]), 255, dtype=np.float32)
+    bgr_fake = cv2.warpAffine(bgr_fake, IM, roi_size, borderValue=0.0)
+    img_white = cv2.warpAffine(img_white, IM, roi_size, borderValue=0.0)
+    img_white[img_white > 20] = 255
+    img_mask = img_white
+    mask_h_inds, mask_w_inds = np.where(img_mask == 255)
+    if mask_h_inds.size == 0:
+        return None
+    mask_h = np.max(mask_h_inds) - np.min(mask_h_inds)
+    mask_w = np.max(mask_w_inds) - np.min(mask_w_inds)
+    mask_size = int(np.sqrt(mask_h * mask_w))
+    k = max(mask_size // 10, 10)
+    img_mask = cv2.erode(img_mask, np.ones((k, k), np.uint8), iterations=1)
+    k = max(mask_size // 20, 5)
+    img_mask = cv2.GaussianBlur(img_mask, (2 * k + 1, 2 * k + 1), 0)
+    img_mask /= 255
+    img_mask = np.reshape(img_mask, [img_mask.shape[0], img_mask.shape[1], 1])
+    fake_merged = img_mask * bgr_fake + (1 - img_mask) * temp_frame[y1:y2, x1:x2].astype(np.float32)
+    return fake_merged.astype(np.uint8), paste_box
+
+
+def get_roi_face(face: Face, offset: Tuple[int, int]) -> Face:
+    """Returns a copy of the face geometry shifted into the coordinates of a region starting at offset."""
+    shift = np.array(offset, dtype=np.float32)
+    roi_face = Face(bbox=face.bbox - np.tile(shift, 2) if face.bbox is not None else None)
+    if face.kps is not None:
+        roi_face.kps = face.kps - shift
+    if face.landmark_2d_106 is not None:
+        roi_face.landmark_2d_106 = face.landmark_2d_106 - shift
+    return roi_face
+
+
+def finish_swap(temp_frame: Frame, swapped_roi: np.ndarray, paste_box: Tuple[int, int, int, int], target_face: Face) -> None:
+    """
+    Applies the mouth mask and the opacity blend to one swapped face and writes it into temp_frame.
+    Everything runs inside the paste box; pixels outside it are never touched by the swap.
+    """
+    x1, y1, x2, y2 = paste_box
+    original_roi = temp_frame[y1:y2, x1:x2]
 
     if getattr(modules.globals, "mouth_mask", False): # Check if mouth_mask is enabled
+        roi_face = get_roi_face(target_face, (x1, y1))
+
         # Create a mask for the target face
-        face_mask = create_face_mask(target_face, temp_frame) # Use temp_frame (original shape) for mask creation geometry
+        face_mask = create_face_mask(roi_face, original_roi) # Use the original region for mask creation geometry
 
         # Create the mouth mask using original geometry
         mouth_mask, mouth_cutout, mouth_box, lower_lip_polygon = (
-            create_lower_mouth_mask(target_face, temp_frame) # Use temp_frame (original) for cutout
+            create_lower_mouth_mask(roi_face, original_roi) # Use the original region for cutout
         )
 
         # Apply the mouth area only if mouth_cutout exists
         if mouth_cutout is not None and mouth_box != (0,0,0,0): # Add check for valid box
-             # Apply mouth area (from original) onto the 'swapped_frame'
-            swapped_frame = apply_mouth_area(
-                swapped_frame, mouth_cutout, mouth_box, face_mask, lower_lip_polygon
+             # Apply mouth area (from original) onto the swapped region
+            swapped_roi = apply_mouth_area(
+                swapped_roi, mouth_cutout, mouth_box, face_mask, lower_lip_polygon
             )
 
             if getattr(modules.globals, "show_mouth_mask_box", False):
                 mouth_mask_data = (mouth_mask, mouth_cutout, mouth_box, lower_lip_polygon)
-                # Draw visualization on the swapped_frame *before* opacity blending
-                swapped_frame = draw_mouth_mask_visualization(
-                    swapped_frame, target_face, mouth_mask_data
+                # Draw visualization on the swapped region *before* opacity blending
+                swapped_roi = draw_mouth_mask_visualization(
+                    swapped_roi, roi_face, mouth_mask_data
                 )
 
-    # Apply opacity blend between the original frame and the swapped frame
+    # Apply opacity blend between the original region and the swapped region
     opacity = getattr(modules.globals, "opacity", 1.0)
     # Ensure opacity is within valid range [0.0, 1.0]
     opacity = max(0.0, min(1.0, opacity))
+    if opacity < 1.0:
+        swapped_roi = cv2.addWeighted(original_roi, 1 - opacity, swapped_roi, opacity, 0)
 
-    # Blend the original_frame with the (potentially mouth-masked) swapped_frame
-    # Ensure both frames are uint8 before blending
-    final_swapped_frame = cv2.addWeighted(original_frame.astype(np.uint8), 1 - opacity, swapped_frame.astype(np.uint8), opacity, 0)
+    temp_frame[y1:y2, x1:x2] = swapped_roi
 
-    # Ensure final frame is uint8 after blending (addWeighted should preserve it, but belt-and-suspenders)
-    final_swapped_frame = final_swapped_frame.astype(np.uint8)
 
-    return final_swapped_frame
+def swap_faces_batch(temp_frames: List[Frame], frame_pairs: List[List[Tuple[Face, Face]]]) -> List[Frame]:
+    """
+    Swaps every (source_face, target_face) pair of every frame with batched inswapper inference.
+    The aligned crops of all frames are collected first, the session runs once per batch
+    and the results are pasted back frame by frame. Frames whose swap fails are returned unchanged.
+    """
+    face_swapper = get_face_swapper()
+    if face_swapper is None:
+        update_status("Face swapper model not loaded or failed to load. Skipping swap.", NAME)
+        return temp_frames
+
+    result_frames = []
+    swap_items = [] # (frame index, target face, aligned crop, affine matrix)
+    blobs = []
+    latents = []
+    for frame_index, (temp_frame, pairs) in enumerate(zip(temp_frames, frame_pairs)):
+        # Pre-swap Input Check with optimization
+        if temp_frame.dtype != np.uint8:
+            temp_frame = np.clip(temp_frame, 0, 255).astype(np.uint8)
+        # For Apple Silicon, ensure contiguous memory layout for better performance
+        if IS_APPLE_SILICON:
+            temp_frame = np.ascontiguousarray(temp_frame)
+        result_frames.append(temp_frame)
+
+        for source_face, target_face in pairs:
+            if source_face is None or target_face is None:
+                continue
+            try:
+                aimg, M, blob = prepare_swap_input(face_swapper, temp_frame, target_face)
+                latent = get_source_latent(face_swapper, source_face)
+            except Exception as e:
+                print(f"Error preparing face swap input: {e}")
+                continue
+            swap_items.append((frame_index, target_face, aimg, M))
+            blobs.append(blob)
+            latents.append(latent)
+
+    if not swap_items:
+        return result_frames
+
+    try:
+        swapped_faces = run_swap_batch(face_swapper, blobs, latents)
+    except Exception as e:
+        print(f"Error during batched face swap inference: {e}") # More specific error
+        return result_frames
+
+    copied_frames = set() # Frames are copied once, on their first pasted face, so callers' frames stay untouched
+    for (frame_index, target_face, aimg, M), bgr_fake in zip(swap_items, swapped_faces):
+        try:
+            pasted = paste_back(result_frames[frame_index], bgr_fake, aimg, M)
+            if pasted is None:
+                continue
+            if frame_index not in copied_frames:
+                result_frames[frame_index] = result_frames[frame_index].copy()
+                copied_frames.add(frame_index)
+            finish_swap(result_frames[frame_index], pasted[0], pasted[1], target_face)
+        except Exception as e:
+            print(f"Error pasting back swapped face: {e}")
+    return result_frames
+
+
+def swap_face(source_face: Face, target_face: Face, temp_frame: Frame) -> Frame:
+    return swap_faces_batch([temp_frame], [[(source_face, target_face)]])[0]
 
 
 # --- START: Mac M1-M5 Optimized Face Detection ---
@@ -283,11 +492,12 @@ def apply_post_processing(current_frame: Frame, swapped_face_bboxes: List[np.nda
     """Applies sharpening and interpolation with Apple Silicon optimizations."""
     global PREVIOUS_FRAME_RESULT
 
-    processed_frame = current_frame.copy()
+    processed_frame = current_frame
 
     # 1. Apply Sharpening (if enabled) with optimized kernel for Apple Silicon
     sharpness_value = getattr(modules.globals, "sharpness", 0.0)
     if sharpness_value > 0.0 and swapped_face_bboxes:
+        processed_frame = current_frame.copy() # Only the sharpened face regions change
         height, width = processed_frame.shape[:2]
         for bbox in swapped_face_bboxes:
             # Ensure bbox is iterable and has 4 elements
@@ -358,56 +568,81 @@ def apply_post_processing(current_frame: Frame, swapped_face_bboxes: List[np.nda
             PREVIOUS_FRAME_RESULT = processed_frame.copy()
     else:
          # If interpolation is off or weight is invalid, just use the current frame
-         # Update state with the current (potentially sharpened) frame
-         # Reset previous frame state if interpolation was just turned off or weight is invalid
-         PREVIOUS_FRAME_RESULT = processed_frame.copy()
+         # Reset previous frame state; the next interpolated frame seeds it again
+         PREVIOUS_FRAME_RESULT = None
 
 
     return final_frame
 # --- END: Helper function for interpolation and sharpening ---
 
 
-def process_frame(source_face: Face, temp_frame: Frame) -> Frame:
-    """
-    DEPRECATED / SIMPLER VERSION - Processes a single frame using one source face.
-    Consider using process_frame_v2 for more complex scenarios.
-    """
-    if getattr(modules.globals, "opacity", 1.0) == 0:
-        # If opacity is 0, no swap happens, so no post-processing needed.
-        # Also reset interpolation state if it was active.
-        global PREVIOUS_FRAME_RESULT
-        PREVIOUS_FRAME_RESULT = None
-        return temp_frame
+def get_target_face_store(target_path: Optional[str]) -> Optional[FrameFaceStore]:
+    """Simple mode detections of the target video saved by an earlier job, if any."""
+    if not target_path or not is_video(target_path) or not is_cache_enabled(target_path):
+        return None
+    cache_key = get_cache_key(target_path, 'target', get_analysis_config('target'))
+    with TARGET_FACE_LOCK:
+        if cache_key not in TARGET_FACE_STORES:
+            cached_analysis = load_analysis(target_path, 'target', get_analysis_config('target'))
+            TARGET_FACE_STORES[cache_key] = cached_analysis[0] if cached_analysis else None
+        return TARGET_FACE_STORES[cache_key]
 
-    # Color correction removed from here (better applied before swap if needed)
 
-    processed_frame = temp_frame # Start with the input frame
-    swapped_face_bboxes = [] # Keep track of where swaps happened
+def record_target_faces(context: Dict[str, Any], target_path: Optional[str], frame_numbers: List[Optional[int]], detected_faces: List[List[Face]]) -> None:
+    # only a job pass carries a job_state; previews and other callers never record
+    recorder = context.get('job_state', {}).get('face_recorder')
+    if recorder is None or recorder[0] != target_path or None in frame_numbers or len(frame_numbers) != len(detected_faces):
+        return
+    recorder[1].add_frames([{'frame': frame_number, 'faces': faces} for frame_number, faces in zip(frame_numbers, detected_faces)])
 
+
+def cancel_target_face_recording(job_state: Optional[Dict[str, Any]]) -> None:
+    # a job that skips detection on some frames can't leave a complete cache behind
+    if job_state is not None:
+        job_state.pop('face_recorder', None)
+
+
+def detect_target_faces(temp_frame: Frame, face_tracker: Optional[FaceTracker] = None, size_hint: Optional[FaceSizeHint] = None) -> List[Face]:
+    """Detects (or tracks) every target face in the frame for simple mode."""
+    target_faces = face_tracker.get_many_faces(temp_frame) if face_tracker else get_many_faces(temp_frame, 'target', size_hint)
+    return target_faces or []
+
+
+def pair_simple_faces(source_face: Face, target_faces: List[Face]) -> List[Tuple[Face, Face]]:
+    """Pairs the single source face with all target faces, or the left-most one unless many_faces is set."""
+    if not target_faces:
+        return []
     if modules.globals.many_faces:
-        many_faces = get_many_faces(processed_frame)
-        if many_faces:
-            current_swap_target = processed_frame.copy() # Apply swaps sequentially on a copy
-            for target_face in many_faces:
-                current_swap_target = swap_face(source_face, target_face, current_swap_target)
-                if target_face is not None and hasattr(target_face, "bbox") and target_face.bbox is not None:
-                    swapped_face_bboxes.append(target_face.bbox.astype(int))
-            processed_frame = current_swap_target # Assign the final result after all swaps
-    else:
-        target_face = get_one_face(processed_frame)
-        if target_face:
-            processed_frame = swap_face(source_face, target_face, processed_frame)
-            if target_face is not None and hasattr(target_face, "bbox") and target_face.bbox is not None:
-                    swapped_face_bboxes.append(target_face.bbox.astype(int))
+        return [(source_face, target_face) for target_face in target_faces]
+    return [(source_face, min(target_faces, key=lambda x: x.bbox[0]))]
 
-    # Apply sharpening and interpolation
-    final_frame = apply_post_processing(processed_frame, swapped_face_bboxes)
 
-    return final_frame
+def get_simple_pairs(source_face: Face, temp_frame: Frame, face_tracker: Optional[FaceTracker] = None, size_hint: Optional[FaceSizeHint] = None) -> List[Tuple[Face, Face]]:
+    """Pairs the single source face with the target face(s) detected (or tracked) in the frame (simple mode)."""
+    return pair_simple_faces(source_face, detect_target_faces(temp_frame, face_tracker, size_hint))
 
 
-def process_frame_v2(temp_frame: Frame, temp_frame_path: str = "") -> Frame:
-    """Handles complex mapping scenarios (map_faces=True) and live streams."""
+def get_swapped_bboxes(source_target_pairs: List[Tuple[Face, Face]]) -> List[np.ndarray]:
+    return [
+        target_face.bbox.astype(int) for source_face, target_face in source_target_pairs
+        if source_face and target_face is not None and getattr(target_face, "bbox", None) is not None
+    ]
+
+
+def swap_and_post_process(temp_frames: List[Frame], frame_pairs: List[List[Tuple[Face, Face]]]) -> List[Frame]:
+    """Swaps the collected pairs of every frame in one batch, then sharpens/interpolates each frame in order."""
+    swapped_frames = swap_faces_batch(temp_frames, frame_pairs)
+    return [
+        apply_post_processing(swapped_frame, get_swapped_bboxes(pairs))
+        for swapped_frame, pairs in zip(swapped_frames, frame_pairs)
+    ]
+
+
+def process_frame(source_face: Face, temp_frame: Frame) -> Frame:
+    """
+    DEPRECATED / SIMPLER VERSION - Processes a single frame using one source face.
+    Consider using process_frame_v2 for more complex scenarios.
+    """
     if getattr(modules.globals, "opacity", 1.0) == 0:
         # If opacity is 0, no swap happens, so no post-processing needed.
         # Also reset interpolation state if it was active.
@@ -415,8 +650,13 @@ def process_frame_v2(temp_frame: Frame, temp_frame_path: str = "") -> Frame:
         PREVIOUS_FRAME_RESULT = None
         return temp_frame
 
-    processed_frame = temp_frame # Start with the input frame
-    swapped_face_bboxes = [] # Keep track of where swaps happened
+    # Color correction removed from here (better applied before swap if needed)
+    return swap_and_post_process([temp_frame], [get_simple_pairs(source_face, temp_frame, get_live_face_tracker('target'), LIVE_FACE_SIZE_HINT)])[0]
+
+
+def get_v2_pairs(temp_frame: Frame, temp_frame_path: str = "", face_tracker: Optional[FaceTracker] = None, frame_number: Optional[int] = None) -> List[Tuple[Face, Face]]:
+    """Collects the source/target pairs for mapping scenarios (map_faces=True) and live streams."""
+    processed_frame = temp_frame
 
     # Determine source/target pairs based on mode
     source_target_pairs = []
@@ -430,27 +670,21 @@ def process_frame_v2(temp_frame: Frame, temp_frame_path: str = "") -> Frame:
 
     if is_file_target:
         # Processing specific image or video file with pre-analyzed maps
-        if source_target_map:
+        if is_video(modules.globals.target_path):
+            # Video maps are indexed by frame number (see face_analyser.build_frame_face_index)
+            if frame_number is None:
+                frame_number = get_frame_number(temp_frame_path)
+            source_target_pairs.extend(modules.globals.frame_face_index.get(frame_number, []))
+        elif source_target_map:
             if modules.globals.many_faces:
                 source_face = default_source_face() # Use default source for all targets
                 if source_face:
                     for map_data in source_target_map:
-                        if is_image(modules.globals.target_path):
-                            target_info = map_data.get("target", {})
-                            if target_info: # Check if target info exists
-                                target_face = target_info.get("face")
-                                if target_face:
-                                    source_target_pairs.append((source_face, target_face))
-                        elif is_video(modules.globals.target_path):
-                             # Find faces for the current frame_path in video map
-                             target_frames_data = map_data.get("target_faces_in_frame", [])
-                             if target_frames_data: # Check if frame data exists
-                                 target_frames = [f for f in target_frames_data if f and f.get("location") == temp_frame_path]
-                                 for frame_data in target_frames:
-                                     faces_in_frame = frame_data.get("faces", [])
-                                     if faces_in_frame: # Check if faces exist
-                                         for target_face in faces_in_frame:
-                                             source_target_pairs.append((source_face, target_face))
+                        target_info = map_data.get("target", {})
+                        if target_info: # Check if target info exists
+                            target_face = target_info.get("face")
+                            if target_face:
+                                source_target_pairs.append((source_face, target_face))
             else: # Single face or specific mapping
                  for map_data in source_target_map:
                     source_info = map_data.get("source", {})
@@ -458,25 +692,15 @@ def process_frame_v2(temp_frame: Frame, temp_frame_path: str = "") -> Frame:
                     source_face = source_info.get("face")
                     if not source_face: continue # Skip if no source defined for this map entry
 
-                    if is_image(modules.globals.target_path):
-                        target_info = map_data.get("target", {})
-                        if target_info:
-                           target_face = target_info.get("face")
-                           if target_face:
-                              source_target_pairs.append((source_face, target_face))
-                    elif is_video(modules.globals.target_path):
-                        target_frames_data = map_data.get("target_faces_in_frame", [])
-                        if target_frames_data:
-                           target_frames = [f for f in target_frames_data if f and f.get("location") == temp_frame_path]
-                           for frame_data in target_frames:
-                               faces_in_frame = frame_data.get("faces", [])
-                               if faces_in_frame:
-                                  for target_face in faces_in_frame:
-                                      source_target_pairs.append((source_face, target_face))
+                    target_info = map_data.get("target", {})
+                    if target_info:
+                       target_face = target_info.get("face")
+                       if target_face:
+                          source_target_pairs.append((source_face, target_face))
 
     else:
         # Live stream or webcam processing (analyze faces on the fly)
-        detected_faces = get_many_faces(processed_frame)
+        detected_faces = face_tracker.get_many_faces(processed_frame) if face_tracker else get_many_faces(processed_frame, size_hint=LIVE_FACE_SIZE_HINT)
         if detected_faces:
             if modules.globals.many_faces:
                  source_face = default_source_face() # Use default source for all detected targets
@@ -501,7 +725,7 @@ def process_frame_v2(temp_frame: Frame, temp_frame_path: str = "") -> Frame:
                           # More faces detected than targets defined - match each target embedding to closest detected face
                           detected_embeddings = [f.normed_embedding for f in detected_faces if f.normed_embedding is not None]
                           detected_faces_with_embedding = [f for f in detected_faces if f.normed_embedding is not None]
-                          if not detected_embeddings: return processed_frame # No embeddings to match
+                          if not detected_embeddings: return source_target_pairs # No embeddings to match
 
                           for i, target_embedding in enumerate(target_embeddings):
                               if 0 <= i < len(source_faces): # Ensure source face exists for this embedding
@@ -510,25 +734,106 @@ def process_frame_v2(temp_frame: Frame, temp_frame_path: str = "") -> Frame:
                                      source_target_pairs.append((source_faces[i], detected_faces_with_embedding[closest_idx]))
             else: # Fallback: if no map, use default source for the single detected face (if any)
                 source_face = default_source_face()
-                target_face = get_one_face(processed_frame, detected_faces) # Use faces already detected
+                target_face = min(detected_faces, key=lambda x: x.bbox[0]) # Use faces already detected
                 if source_face and target_face:
                     source_target_pairs.append((source_face, target_face))
 
+    return source_target_pairs
+
+
+def process_frame_v2(temp_frame: Frame, temp_frame_path: str = "") -> Frame:
+    """Handles complex mapping scenarios (map_faces=True) and live streams."""
+    if getattr(modules.globals, "opacity", 1.0) == 0:
+        # If opacity is 0, no swap happens, so no post-processing needed.
+        # Also reset interpolation state if it was active.
+        global PREVIOUS_FRAME_RESULT
+        PREVIOUS_FRAME_RESULT = None
+        return temp_frame
+
+    return swap_and_post_process([temp_frame], [get_v2_pairs(temp_frame, temp_frame_path, get_live_face_tracker())])[0]
 
-    # Perform swaps based on the collected pairs
-    current_swap_target = processed_frame.copy() # Apply swaps sequentially
-    for source_face, target_face in source_target_pairs:
-        if source_face and target_face:
-            current_swap_target = swap_face(source_face, target_face, current_swap_target)
-            if target_face is not None and hasattr(target_face, "bbox") and target_face.bbox is not None:
-                swapped_face_bboxes.append(target_face.bbox.astype(int))
-    processed_frame = current_swap_target # Assign final result
 
+# --- START: Live pipeline stages ---
+def detect_live_pairs(source_face: Optional[Face], temp_frame: Frame) -> List[Tuple[Face, Face]]:
+    """
+    Detection stage of the pipelined live engine: the pairs process_frame / process_frame_v2
+    would swap. Runs on its own thread (and the analyser's own ORT sessions) while the
+    previous frame is in swap_live_frame.
+    """
+    if uses_map_faces():
+        return get_v2_pairs(temp_frame, "", get_live_face_tracker())
+    if source_face is None:
+        return []
+    return get_simple_pairs(source_face, temp_frame, get_live_face_tracker('target'), LIVE_FACE_SIZE_HINT)
 
-    # Apply sharpening and interpolation
-    final_frame = apply_post_processing(processed_frame, swapped_face_bboxes)
 
-    return final_frame
+def swap_live_frame(temp_frame: Frame, source_target_pairs: List[Tuple[Face, Face]]) -> Frame:
+    """Swap stage of the pipelined live engine, with the pairs detect_live_pairs found in this frame."""
+    if getattr(modules.globals, "opacity", 1.0) == 0:
+        global PREVIOUS_FRAME_RESULT
+        PREVIOUS_FRAME_RESULT = None
+        return temp_frame
+    return swap_and_post_process([temp_frame], [source_target_pairs])[0]
+# --- END: Live pipeline stages ---
+
+
+def uses_map_faces() -> bool:
+    # In folder processing mode, always use simple mode (no map_faces)
+    # because we don't have pre-configured maps for each file
+    if getattr(modules.globals, 'process_folder', False) and getattr(modules.globals, 'file_queue', None):
+        return False
+    return getattr(modules.globals, "map_faces", False)
+
+
+def process_frame_batch(source_face: Optional[Face], temp_frames: List[Frame], context: Dict[str, Any]) -> List[Frame]:
+    """
+    Swaps a batch of consecutive frames for the fused pipeline (frame core).
+    The context is shared with the later processors: the faces found here are
+    published as context['detected_faces'] so they don't run detection again.
+    context['frame_paths'] / context['frame_numbers'] locate the frames for the map_faces lookup
+    and, with context['target_path'], in the cached simple mode detections
+    and context['face_tracker'] keeps the tracker of a contiguous chunk (without tracking,
+    context['face_size_hint'] carries the adaptive det size along the chunk).
+    context['job_state'] is only set by a job pass and holds its detection recorder.
+    """
+    if getattr(modules.globals, "opacity", 1.0) == 0:
+        global PREVIOUS_FRAME_RESULT
+        PREVIOUS_FRAME_RESULT = None
+        context.pop('detected_faces', None)
+        cancel_target_face_recording(context.get('job_state'))
+        return temp_frames
+
+    use_v2 = uses_map_faces()
+    frame_paths = context.get('frame_paths') or [""] * len(temp_frames)
+    frame_numbers = context.get('frame_numbers') or [get_frame_number(temp_frame_path) for temp_frame_path in frame_paths]
+    face_tracker = None
+    if getattr(modules.globals, "face_tracking", False):
+        if 'face_tracker' not in context:
+            context['face_tracker'] = FaceTracker(profile='full' if use_v2 else 'target')
+        face_tracker = context['face_tracker']
+
+    if use_v2:
+        # V2 uses global maps and needs the frame number (or path) for lookup in video mode
+        frame_pairs = [get_v2_pairs(temp_frame, temp_frame_path, face_tracker, frame_number) for temp_frame, temp_frame_path, frame_number in zip(temp_frames, frame_paths, frame_numbers)]
+        context['detected_faces'] = [[target_face for _, target_face in pairs] for pairs in frame_pairs]
+    else:
+        source_face = source_face or SOURCE_FACE
+        if source_face is None:
+            context.pop('detected_faces', None)
+            cancel_target_face_recording(context.get('job_state'))
+            return temp_frames
+        target_path = context.get('target_path')
+        face_store = get_target_face_store(target_path) if None not in frame_numbers else None
+        if face_store is not None:
+            # Detections saved by an earlier job on the same target and detector settings
+            detected_faces = [[record.to_face() for record in face_store.get_frame_faces(frame_number)] for frame_number in frame_numbers]
+        else:
+            size_hint = context.setdefault('face_size_hint', FaceSizeHint())
+            detected_faces = [detect_target_faces(temp_frame, face_tracker, size_hint) for temp_frame in temp_frames]
+            record_target_faces(context, target_path, frame_numbers, detected_faces)
+        frame_pairs = [pair_simple_faces(source_face, target_faces) for target_faces in detected_faces]
+        context['detected_faces'] = detected_faces
+    return swap_and_post_process(temp_frames, frame_pairs)
 
 
 def process_frames(
@@ -539,37 +844,12 @@ def process_frames(
     Iterates through frames, applies the appropriate swapping logic based on globals,
     and saves the result back to the frame path. Handles multi-threading via caller.
     """
-    # OTIMIZAÇÃO: Cache verificação de folder mode para evitar verificações repetidas
-    is_folder_mode = getattr(modules.globals, 'process_folder', False) and getattr(modules.globals, 'file_queue', None)
-    
-    # In folder processing mode, always use simple mode (no map_faces)
-    # because we don't have pre-configured maps for each file
-    use_v2 = False if is_folder_mode else getattr(modules.globals, "map_faces", False)
+    use_v2 = uses_map_faces()
     source_face = None # Initialize source_face
 
-    # --- Pre-load source face only if needed (Simple Mode: map_faces=False) ---
+    # --- Source face is resolved once per job (Simple Mode: map_faces=False) ---
     if not use_v2:
-        if not source_path or not os.path.exists(source_path):
-            update_status(f"Error: Source path invalid or not provided for simple mode: {source_path}", NAME)
-            # Log the error but allow proceeding; subsequent check will stop processing.
-        else:
-            try:
-                source_img = cv2.imread(source_path)
-                if source_img is None:
-                    # Specific error for file reading failure
-                    update_status(f"Error reading source image file {source_path}. Please check the path and file integrity.", NAME)
-                else:
-                    source_face = get_one_face(source_img)
-                    if source_face is None:
-                        # Specific message for no face detected after successful read
-                        update_status(f"Warning: Successfully read source image {source_path}, but no face was detected. Swaps will be skipped.", NAME)
-            except Exception as e:
-                # Print the specific exception caught
-                import traceback
-                print(f"{NAME}: Caught exception during source image processing for {source_path}:")
-                traceback.print_exc() # Print the full traceback
-                update_status(f"Error during source image reading or analysis {source_path}: {e}", NAME)
-                # Log general exception during the process
+        source_face = get_source_face(source_path)
 
     total_frames = len(temp_frame_paths)
     # update_status(f"Processing {total_frames} frames. Use V2 (map_faces): {use_v2}", NAME) # Optional Debug
@@ -584,60 +864,52 @@ def process_frames(
                 progress.update(remaining_updates)
         return # Exit the function entirely
 
-    # --- Process each frame path provided in the list ---
-    # Note: In the current core.py multi_process_frame, temp_frame_paths will usually contain only ONE path per call.
-    for i, temp_frame_path in enumerate(temp_frame_paths):
-        # update_status(f"Processing frame {i+1}/{total_frames}: {os.path.basename(temp_frame_path)}", NAME) # Optional Debug
-
-        # Read the target frame
-        try:
-            temp_frame = cv2.imread(temp_frame_path)
-            if temp_frame is None:
-                print(f"{NAME}: Error: Could not read frame: {temp_frame_path}, skipping.")
+    # --- Process the frame paths in batches of swap_batch_size ---
+    # Note: core.multi_process_frame hands each worker a contiguous chunk of frame paths,
+    # so the chunk context can carry its own tracker across batches.
+    batch_size = get_swap_batch_size()
+    context: Dict[str, Any] = {}
+    for batch_start in range(0, total_frames, batch_size):
+        batch_paths = []
+        batch_frames = []
+        for temp_frame_path in temp_frame_paths[batch_start:batch_start + batch_size]:
+            # Read the target frame
+            try:
+                temp_frame = cv2.imread(temp_frame_path)
+                if temp_frame is None:
+                    print(f"{NAME}: Error: Could not read frame: {temp_frame_path}, skipping.")
+                    if progress: progress.update(1)
+                    continue # Skip this frame if read fails
+            except Exception as read_e:
+                print(f"{NAME}: Error reading frame {temp_frame_path}: {read_e}, skipping.")
                 if progress: progress.update(1)
-                continue # Skip this frame if read fails
-        except Exception as read_e:
-            print(f"{NAME}: Error reading frame {temp_frame_path}: {read_e}, skipping.")
-            if progress: progress.update(1)
+                continue
+            batch_paths.append(temp_frame_path)
+            batch_frames.append(temp_frame)
+
+        if not batch_frames:
             continue
 
-        # Select processing function and execute
-        result_frame = None
+        # Collect the source/target pairs of every frame, then swap the whole batch at once
+        context['frame_paths'] = batch_paths
         try:
-            if use_v2:
-                # V2 uses global maps and needs the frame path for lookup in video mode
-                # update_status(f"Using process_frame_v2 for: {os.path.basename(temp_frame_path)}", NAME) # Optional Debug
-                result_frame = process_frame_v2(temp_frame, temp_frame_path)
-            else:
-                # Simple mode uses the pre-loaded source_face (already checked for validity above)
-                # update_status(f"Using process_frame (simple) for: {os.path.basename(temp_frame_path)}", NAME) # Optional Debug
-                result_frame = process_frame(source_face, temp_frame) # source_face is guaranteed to be valid here
-
-            # Check if processing actually returned a frame
-            if result_frame is None:
-                 print(f"{NAME}: Warning: Processing returned None for frame {temp_frame_path}. Using original.")
-                 result_frame = temp_frame
-
+            result_frames = process_frame_batch(source_face, batch_frames, context)
         except Exception as proc_e:
-            print(f"{NAME}: Error processing frame {temp_frame_path}: {proc_e}")
-            # import traceback # Optional for detailed debugging
-            # traceback.print_exc()
-            result_frame = temp_frame # Use original frame on processing error
+            print(f"{NAME}: Error processing frames {batch_paths[0]}..{batch_paths[-1]}: {proc_e}")
+            result_frames = batch_frames # Use original frames on processing error
 
-        # Write the result back to the same frame path
-        try:
-            write_success = cv2.imwrite(temp_frame_path, result_frame)
-            if not write_success:
-                print(f"{NAME}: Error: Failed to write processed frame to {temp_frame_path}")
-        except Exception as write_e:
-            print(f"{NAME}: Error writing frame {temp_frame_path}: {write_e}")
+        # Write the results back to the same frame paths
+        for temp_frame_path, result_frame in zip(batch_paths, result_frames):
+            try:
+                write_success = cv2.imwrite(temp_frame_path, result_frame)
+                if not write_success:
+                    print(f"{NAME}: Error: Failed to write processed frame to {temp_frame_path}")
+            except Exception as write_e:
+                print(f"{NAME}: Error writing frame {temp_frame_path}: {write_e}")
 
-        # Update progress bar
-        if progress:
-            progress.update(1)
-        # else: # Basic console progress (optional)
-        #     if (i + 1) % 10 == 0 or (i + 1) == total_frames: # Update every 10 frames or on last frame
-        #        update_status(f"Processed frame {i+1}/{total_frames}", NAME)
+            # Update progress bar
+            if progress:
+                progress.update(1)
 
 
 def process_image(source_path: str, target_path: str, output_path: str) -> None:
@@ -674,18 +946,10 @@ def process_image(source_path: str, target_path: str, output_path: str) -> None:
             result = process_frame_v2(target_frame, target_path)
 
         else: # Simple mode
-            try:
-                source_img = cv2.imread(source_path)
-                if source_img is None:
-                    update_status(f"Error: Could not read source image: {source_path}", NAME)
-                    return
-                source_face = get_one_face(source_img)
-                if not source_face:
-                    update_status(f"Error: No face found in source image: {source_path}", NAME)
-                    return
-            except Exception as src_e:
-                 update_status(f"Error reading or analyzing source image {source_path}: {src_e}", NAME)
-                 return
+            source_face = get_source_face(source_path)
+            if not source_face:
+                update_status(f"Error: No face found in source image: {source_path}", NAME)
+                return
 
             result = process_frame(source_face, target_frame)
 
@@ -706,23 +970,63 @@ def process_image(source_path: str, target_path: str, output_path: str) -> None:
          # traceback.print_exc()
 
 
-def process_video(source_path: str, temp_frame_paths: List[str]) -> None:
-    """Sets up and calls the frame processing for video."""
+def prepare_video(source_path: str, target_path: Optional[str] = None, job_state: Optional[Dict[str, Any]] = None) -> bool:
+    """
+    Sets up the job state for a video before the workers start (also used by the
+    fused pipeline in frame core). Returns False when simple mode has no source face.
+    job_state is the dict the job pass shares with its batch contexts; the detection
+    recorder lives there, so only that job records into it.
+    """
     # --- Reset interpolation state before starting video processing ---
     global PREVIOUS_FRAME_RESULT
     PREVIOUS_FRAME_RESULT = None
     # ---
 
-    # In folder processing mode, always use simple mode
-    if modules.globals.process_folder and modules.globals.file_queue:
-        use_map_faces = False
-    else:
-        use_map_faces = getattr(modules.globals, "map_faces", False)
-    
+    use_map_faces = uses_map_faces()
+
+    # Resolve the source face and its latent before the workers start so they all share them
+    if not use_map_faces and get_source_face(source_path) is None:
+        update_status("No face detected in source image.", NAME)
+        return False
+    if use_map_faces and is_video(modules.globals.target_path):
+        # Sources may have changed since the analysis, so the frame lookup is rebuilt for each job
+        build_frame_face_index()
+    if not use_map_faces and target_path and is_video(target_path) and is_cache_enabled(target_path):
+        with TARGET_FACE_LOCK:
+            TARGET_FACE_STORES.clear()  # the cache may have been written since the last lookup
+        if get_target_face_store(target_path) is None:
+            if job_state is not None:
+                job_state['face_recorder'] = (target_path, FaceStoreBuilder())
+        else:
+            update_status("Using cached face detections of the target.", NAME)
+    prepare_source_latents()
+
     mode_desc = "'map_faces'" if use_map_faces else "'simple'"
     if use_map_faces and getattr(modules.globals, "many_faces", False):
         mode_desc += " and 'many_faces'. Using pre-analysis map."
     update_status(f"Processing video with {mode_desc} mode.", NAME)
+    return True
+
+
+def finish_video(target_path: Optional[str] = None, job_state: Optional[Dict[str, Any]] = None) -> None:
+    """Saves the detections recorded during a complete simple mode job to the analysis cache."""
+    recorder = job_state.pop('face_recorder', None) if job_state is not None else None
+    if recorder is None or recorder[0] != target_path:
+        return
+    face_store = recorder[1].build()
+    save_analysis(target_path, 'target', get_analysis_config('target'), face_store)
+    with TARGET_FACE_LOCK:
+        TARGET_FACE_STORES[get_cache_key(target_path, 'target', get_analysis_config('target'))] = face_store
+
+
+def cancel_video(job_state: Optional[Dict[str, Any]] = None) -> None:
+    """Drops the detections recorded during a job that skipped or failed some frames."""
+    cancel_target_face_recording(job_state)
+
+
+def process_video(source_path: str, temp_frame_paths: List[str]) -> None:
+    """Sets up and calls the frame processing for video."""
+    prepare_video(source_path)
 
     # Pass the correct source_path (needed for simple mode in process_frames)
     # The core processing logic handles calling the right frame function (process_frames)
@@ -1,7 +1,7 @@
 import os
 import webbrowser
 import customtkinter as ctk
-from typing import Callable, Tuple
+from typing import Any, Callable, List, Optional, Tuple
 import cv2
 from cv2_enumerate_cameras import enumerate_cameras  # Add this import
 from PIL import Image, ImageOps
@@ -11,14 +11,15 @@ import modules.globals
 import modules.metadata
 from modules.face_analyser import (
     get_one_face,
+    get_source_image_face,
     get_unique_faces_from_target_image,
     get_unique_faces_from_target_video,
     add_blank_map,
     has_valid_map,
     simplify_maps,
 )
-from modules.capturer import get_video_frame, get_video_frame_total
-from modules.processors.frame.core import get_frame_processors_modules
+from modules.capturer import FrameCache, get_video_frame, get_video_frame_total, get_video_key, read_video_frame, release_capture
+from modules.processors.frame.core import get_frame_processors_modules, process_frame_batch
 from modules.utilities import (
     is_image,
     is_video,
@@ -26,6 +27,8 @@ from modules.utilities import (
     has_image_extension,
 )
 from modules.video_capture import VideoCapturer
+from modules.live_pipeline import LivePipeline
+from modules.preview_service import PreviewService
 from modules.gettext import LanguageManager
 from modules import globals
 import platform
@@ -44,6 +47,13 @@ PREVIEW_MAX_HEIGHT = 700
 PREVIEW_MAX_WIDTH = 1200
 PREVIEW_DEFAULT_WIDTH = 960
 PREVIEW_DEFAULT_HEIGHT = 540
+PREVIEW_CACHE_BYTES = 128 * 1024 ** 2  # memory budget of processed preview frames
+PREVIEW_CACHE = FrameCache(PREVIEW_CACHE_BYTES)
+PREVIEW_PREFETCH_FRAMES = 2  # neighbouring frames rendered ahead while the preview worker is idle
+PREVIEW_SERVICE = None
+LIVE_DISPLAY_INTERVAL_MS = 16  # display stage polls for processed frames at ~60 Hz, the usual refresh rate
+LIVE_LATENCY_STAGES = ('capture', 'queue', 'detection', 'handoff', 'swap', 'display', 'total')
+LIVE_PIPELINE = None
 
 POPUP_WIDTH = 750
 POPUP_HEIGHT = 810
@@ -74,6 +84,8 @@ preview_next_button = None
 preview_file_label = None
 preview_current_index = 0
 preview_is_closing = False  # Flag to prevent reopening loop
+preview_last_request = None  # (kind, video path, frame number) last sent to the preview worker
+preview_scrub_direction = 1
 source_label = None
 target_label = None
 status_label = None
@@ -115,6 +127,7 @@ def save_switch_states():
         "process_folder": modules.globals.process_folder,
         "vps_enabled": modules.globals.vps_enabled,
         "vps_server_url": modules.globals.vps_server_url,
+        "vps_streaming": modules.globals.vps_streaming,
     }
     with open("switch_states.json", "w") as f:
         json.dump(switch_states, f)
@@ -142,6 +155,7 @@ def load_switch_states():
         modules.globals.process_folder = switch_states.get("process_folder", False)
         modules.globals.vps_enabled = switch_states.get("vps_enabled", False)
         modules.globals.vps_server_url = switch_states.get("vps_server_url", None)
+        modules.globals.vps_streaming = switch_states.get("vps_streaming", False)
     except FileNotFoundError:
         # If the file doesn't exist, use default values
         pass
@@ -488,6 +502,19 @@ def create_root(start: Callable[[], None], destroy: Callable[[], None]) -> ctk.C
     )
     vps_info_label.place(relx=0.1, rely=0.38, relwidth=0.8)
 
+    vps_streaming_value = ctk.BooleanVar(value=modules.globals.vps_streaming)
+    vps_streaming_switch = ctk.CTkSwitch(
+        tab_config,
+        text=_("Processar vídeo durante o upload (streaming)"),
+        variable=vps_streaming_value,
+        cursor="hand2",
+        command=lambda: (
+            setattr(modules.globals, "vps_streaming", vps_streaming_value.get()),
+            save_switch_states(),
+        ),
+    )
+    vps_streaming_switch.place(relx=0.1, rely=0.43)
+
     # --- Camera Selection (na aba de processamento) ---
     camera_label = ctk.CTkLabel(tab_processamento, text=_("Select Camera:"))
     camera_label.place(relx=0.1, rely=0.85, relwidth=0.2, relheight=0.05)
@@ -684,7 +711,7 @@ def update_popup_source(
         return map
     else:
         cv2_img = cv2.imread(source_path)
-        face = get_one_face(cv2_img)
+        face = get_source_image_face(source_path)
 
         if face:
             x_min, y_min, x_max, y_max = face["bbox"]
@@ -729,6 +756,8 @@ def create_preview(parent: ctk.CTkToplevel) -> ctk.CTkToplevel:
         """Handle preview window close event."""
         global preview_is_closing
         preview_is_closing = True
+        if PREVIEW_SERVICE is not None:
+            PREVIEW_SERVICE.cancel()  # a frame still rendering would reopen the window
         preview.withdraw()
         # Reset flag after delay to allow normal reopening
         def reset_flag():
@@ -880,6 +909,7 @@ def select_target_path() -> None:
             target_label.configure(image=None)
     else:
         # Normal file selection
+        previous_target_path = modules.globals.target_path
         target_path = ctk.filedialog.askopenfilename(
             title=_("select an target image or video"),
             initialdir=RECENT_DIRECTORY_TARGET,
@@ -898,6 +928,9 @@ def select_target_path() -> None:
         else:
             modules.globals.target_path = None
             target_label.configure(image=None)
+        # the old target's pooled capture would keep the file open
+        if previous_target_path and previous_target_path != modules.globals.target_path:
+            release_capture(previous_target_path)
 
 
 def select_output_directory() -> str | None:
@@ -986,17 +1019,12 @@ def render_image_preview(image_path: str, size: Tuple[int, int]) -> ctk.CTkImage
 def render_video_preview(
         video_path: str, size: Tuple[int, int], frame_number: int = 0
 ) -> ctk.CTkImage:
-    capture = cv2.VideoCapture(video_path)
-    if frame_number:
-        capture.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
-    has_frame, frame = capture.read()
-    if has_frame:
+    frame = read_video_frame(video_path, frame_number)
+    if frame is not None:
         image = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
         if size:
             image = ImageOps.fit(image, size, Image.LANCZOS)
         return ctk.CTkImage(image, size=image.size)
-    capture.release()
-    cv2.destroyAllWindows()
 
 
 def toggle_preview() -> None:
@@ -1009,6 +1037,8 @@ def toggle_preview() -> None:
     if PREVIEW.state() == "normal":
         # Set flag to prevent reopening
         preview_is_closing = True
+        if PREVIEW_SERVICE is not None:
+            PREVIEW_SERVICE.cancel()
         PREVIEW.withdraw()
         # Reset flag after a short delay to allow normal reopening later
         def reset_flag():
@@ -1126,8 +1156,8 @@ def update_preview_folder(file_index: int = 0) -> None:
                 return
             
             # Process with frame processors
+            source_face = get_source_image_face(modules.globals.source_path)
             for frame_processor in get_frame_processors_modules(modules.globals.frame_processors):
-                source_face = get_one_face(cv2.imread(modules.globals.source_path))
                 temp_frame = frame_processor.process_frame(source_face, temp_frame)
             
             image = Image.fromarray(cv2.cvtColor(temp_frame, cv2.COLOR_BGR2RGB))
@@ -1151,8 +1181,8 @@ def update_preview_folder(file_index: int = 0) -> None:
                 return
             
             # Process with frame processors
+            source_face = get_source_image_face(modules.globals.source_path)
             for frame_processor in get_frame_processors_modules(modules.globals.frame_processors):
-                source_face = get_one_face(cv2.imread(modules.globals.source_path))
                 temp_frame = frame_processor.process_frame(source_face, temp_frame)
             
             image = Image.fromarray(cv2.cvtColor(temp_frame, cv2.COLOR_BGR2RGB))
@@ -1198,54 +1228,109 @@ def update_preview_folder_video(frame_number: int = 0) -> None:
     if not is_video(current_file):
         return
     
-    try:
-        temp_frame = get_video_frame(current_file, int(frame_number))
-        if temp_frame is None:
-            return
-        
-        if modules.globals.nsfw_filter and check_and_ignore_nsfw(temp_frame):
-            return
-        
-        # Process with frame processors
-        for frame_processor in get_frame_processors_modules(modules.globals.frame_processors):
-            source_face = get_one_face(cv2.imread(modules.globals.source_path))
-            temp_frame = frame_processor.process_frame(source_face, temp_frame)
-        
-        image = Image.fromarray(cv2.cvtColor(temp_frame, cv2.COLOR_BGR2RGB))
-        image = ImageOps.contain(
-            image, (PREVIEW_MAX_WIDTH, PREVIEW_MAX_HEIGHT), Image.LANCZOS
-        )
-        image = ctk.CTkImage(image, size=image.size)
-        preview_label.configure(image=image)
-        
-    except Exception as e:
-        update_status(f"Error updating video preview: {str(e)}")
+    # Rendered off the UI thread, see render_preview_request
+    get_preview_service().request(('folder', current_file, int(frame_number)))
+
+
+def get_preview_cache_key(video_path: str, frame_number: int) -> Optional[Tuple[Any, ...]]:
+    """Processed previews are reused while the frame, the source and every scalar setting stay the same."""
+    if modules.globals.map_faces or not modules.globals.source_path or not os.path.isfile(modules.globals.source_path):
+        return None  # face mappings aren't part of the key
+    settings = tuple(sorted(
+        (name, value) for name, value in vars(modules.globals).items()
+        if not name.startswith('_') and isinstance(value, (bool, int, float, str))
+    ))
+    return (
+        get_video_key(video_path), frame_number, get_video_key(modules.globals.source_path),
+        tuple(modules.globals.frame_processors), tuple(sorted(getattr(modules.globals, 'fp_ui', {}).items())), settings
+    )
 
 
-def update_preview(frame_number: int = 0) -> None:
-    if modules.globals.source_path and modules.globals.target_path:
-        update_status("Processing...")
-        temp_frame = get_video_frame(modules.globals.target_path, frame_number)
-        if modules.globals.nsfw_filter and check_and_ignore_nsfw(temp_frame):
-            return
-        for frame_processor in get_frame_processors_modules(
-                modules.globals.frame_processors
-        ):
-            temp_frame = frame_processor.process_frame(
-                get_one_face(cv2.imread(modules.globals.source_path)), temp_frame
-            )
-        image = Image.fromarray(cv2.cvtColor(temp_frame, cv2.COLOR_BGR2RGB))
-        image = ImageOps.contain(
-            image, (PREVIEW_MAX_WIDTH, PREVIEW_MAX_HEIGHT), Image.LANCZOS
+def get_preview_service() -> PreviewService:
+    global PREVIEW_SERVICE
+
+    if PREVIEW_SERVICE is None:
+        PREVIEW_SERVICE = PreviewService(
+            render_preview_request,
+            deliver_preview,
+            lambda callback: ROOT.after(0, callback),
+            get_prefetch_requests,
         )
-        image = ctk.CTkImage(image, size=image.size)
-        preview_label.configure(image=image)
+    return PREVIEW_SERVICE
+
+
+def render_preview_request(request: Tuple[str, str, int]) -> Any:
+    """
+    Runs on the preview worker thread: decodes and processes one frame, without touching Tk.
+    Returns the PIL image to show, or None when the frame is unreadable or NSFW.
+    """
+    _, video_path, frame_number = request
+    cache_key = get_preview_cache_key(video_path, frame_number)
+    temp_frame = PREVIEW_CACHE.get(cache_key) if cache_key else None
+    if temp_frame is None:
+        temp_frame = get_video_frame(video_path, frame_number)
+        if temp_frame is None:
+            return None
+        if modules.globals.nsfw_filter:
+            from modules.predicter import predict_frame
+            if predict_frame(temp_frame):
+                return None
+        # The frame number lets the processors reuse the target's cached face detections.
+        # get_video_frame already reads 1-based frame numbers like the face store; slider 0 shows frame 1
+        temp_frame = process_frame_batch(
+            get_frame_processors_modules(modules.globals.frame_processors),
+            get_source_image_face(modules.globals.source_path),
+            [temp_frame],
+            {'target_path': video_path, 'frame_numbers': [max(1, frame_number)]}
+        )[0]
+        if cache_key:
+            PREVIEW_CACHE.put(cache_key, temp_frame)
+    image = Image.fromarray(cv2.cvtColor(temp_frame, cv2.COLOR_BGR2RGB))
+    return ImageOps.contain(
+        image, (PREVIEW_MAX_WIDTH, PREVIEW_MAX_HEIGHT), Image.LANCZOS
+    )
+
+
+def deliver_preview(request: Tuple[str, str, int], image: Any, error: Optional[Exception]) -> None:
+    """Runs on the Tk thread with the result of the latest preview request."""
+    kind = request[0]
+    if error is not None:
+        update_status(f"Error updating video preview: {str(error)}")
+        return
+    if image is None:
+        update_status("Processing ignored!")
+        return
+    image = ctk.CTkImage(image, size=image.size)
+    preview_label.configure(image=image)
+    if kind == 'target':
         update_status("Processing succeed!")
         # Only show preview if not closing
         if not preview_is_closing:
             PREVIEW.deiconify()
 
 
+def get_prefetch_requests(request: Tuple[str, str, int]) -> List[Tuple[str, str, int]]:
+    """The next frames in the direction the slider last moved, rendered while the worker is idle."""
+    global preview_scrub_direction, preview_last_request
+
+    kind, video_path, frame_number = request
+    if preview_last_request and preview_last_request[:2] == request[:2] and preview_last_request[2] != frame_number:
+        preview_scrub_direction = 1 if frame_number > preview_last_request[2] else -1
+    preview_last_request = request
+    if not is_video(video_path) or get_preview_cache_key(video_path, frame_number) is None:
+        return []  # nothing to keep the prefetched frames in
+    frame_total = get_video_frame_total(video_path)
+    frame_numbers = [frame_number + preview_scrub_direction * step for step in range(1, PREVIEW_PREFETCH_FRAMES + 1)]
+    return [(kind, video_path, prefetch_number) for prefetch_number in frame_numbers if 0 <= prefetch_number <= frame_total]
+
+
+def update_preview(frame_number: int = 0) -> None:
+    if modules.globals.source_path and modules.globals.target_path:
+        update_status("Processing...")
+        # Rendered off the UI thread; slider moves coalesce into the latest frame
+        get_preview_service().request(('target', modules.globals.target_path, int(frame_number)))
+
+
 def webcam_preview(root: ctk.CTk, camera_index: int):
     global POPUP_LIVE
 
@@ -1337,8 +1422,49 @@ def get_available_cameras():
         return camera_indices, camera_names
 
 
+def detect_live_frame(frame_processors: List[Any], source_image: Any, frame: Any, output_size: Tuple[int, int]) -> Tuple[Any, Any]:
+    """
+    Detection stage of the live pipeline: mirrors and resizes the camera frame and finds the faces to swap.
+    output_size is the preview size read on the UI thread. Returns (frame, source/target pairs or None).
+    """
+    temp_frame = frame.copy()
+
+    if modules.globals.live_mirror:
+        temp_frame = cv2.flip(temp_frame, 1)
+
+    temp_frame = fit_image_to_size(temp_frame, *output_size)
+
+    source_target_pairs = None
+    for frame_processor in frame_processors:
+        if hasattr(frame_processor, "detect_live_pairs"):
+            source_target_pairs = frame_processor.detect_live_pairs(source_image, temp_frame)
+    return temp_frame, source_target_pairs
+
+
+def swap_live_frame(frame_processors: List[Any], source_image: Any, temp_frame: Any, source_target_pairs: Any) -> Any:
+    """Swap stage of the live pipeline, with the pairs detect_live_frame found in this frame."""
+    for frame_processor in frame_processors:
+        if frame_processor.NAME == "DLC.FACE-ENHANCER":
+            if modules.globals.fp_ui["face_enhancer"]:
+                if source_target_pairs is not None:
+                    # The swapped faces sit where they were detected, so GFPGAN can skip its own detection
+                    temp_frame = frame_processor.enhance_face(temp_frame, [target_face for _, target_face in source_target_pairs])
+                else:
+                    temp_frame = frame_processor.process_frame(None, temp_frame)
+        elif hasattr(frame_processor, "swap_live_frame") and source_target_pairs is not None:
+            temp_frame = frame_processor.swap_live_frame(temp_frame, source_target_pairs)
+        elif not modules.globals.map_faces:
+            temp_frame = frame_processor.process_frame(source_image, temp_frame)
+        else:
+            temp_frame = frame_processor.process_frame_v2(temp_frame)
+    return temp_frame
+
+
 def create_webcam_preview(camera_index: int):
-    global preview_label, PREVIEW
+    global preview_label, PREVIEW, LIVE_PIPELINE
+
+    if LIVE_PIPELINE is not None:
+        stop_webcam_preview()
 
     cap = VideoCapturer(camera_index)
     if not cap.start(PREVIEW_DEFAULT_WIDTH, PREVIEW_DEFAULT_HEIGHT, 60):
@@ -1352,82 +1478,97 @@ def create_webcam_preview(camera_index: int):
 
     frame_processors = get_frame_processors_modules(modules.globals.frame_processors)
     source_image = None
-    prev_time = time.time()
-    fps_update_interval = 0.5
-    frame_count = 0
-    fps = 0
-
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-
-        temp_frame = frame.copy()
-
-        if modules.globals.live_mirror:
-            temp_frame = cv2.flip(temp_frame, 1)
+    if modules.globals.map_faces:
+        modules.globals.target_path = None
+    elif modules.globals.source_path:
+        source_image = get_source_image_face(modules.globals.source_path)
+
+    # Tk may only be touched from this thread, so the display stage hands the size to inference
+    output_size = [PREVIEW.winfo_width(), PREVIEW.winfo_height()]
+    pipeline = LIVE_PIPELINE = LivePipeline(
+        cap,
+        lambda frame: detect_live_frame(frame_processors, source_image, frame, tuple(output_size)),
+        lambda temp_frame, source_target_pairs: swap_live_frame(frame_processors, source_image, temp_frame, source_target_pairs),
+        modules.globals.live_pipeline_depth,
+        modules.globals.live_drop_policy,
+    )
+    pipeline.start()
 
-        if modules.globals.live_resizable:
-            temp_frame = fit_image_to_size(
-                temp_frame, PREVIEW.winfo_width(), PREVIEW.winfo_height()
-            )
+    display = {'frame_id': 0, 'frame_count': 0, 'prev_time': time.time(), 'fps': 0.0}
+    fps_update_interval = 0.5
 
-        else:
-            temp_frame = fit_image_to_size(
-                temp_frame, PREVIEW.winfo_width(), PREVIEW.winfo_height()
+    def display_frame() -> None:
+        if pipeline is not LIVE_PIPELINE:
+            return
+        if not pipeline.is_alive() or PREVIEW.state() == "withdrawn":
+            stop_webcam_preview()
+            return
+        output_size[:] = [PREVIEW.winfo_width(), PREVIEW.winfo_height()]
+
+        if pipeline.error is not None:
+            update_status(f"Live processing error: {pipeline.error}")
+            pipeline.error = None
+
+        result = pipeline.get_result(display['frame_id'])
+        if result is not None:
+            started = time.perf_counter()
+            display['frame_id'], temp_frame, captured_at = result
+
+            # Calculate and display FPS
+            current_time = time.time()
+            display['frame_count'] += 1
+            if current_time - display['prev_time'] >= fps_update_interval:
+                display['fps'] = display['frame_count'] / (current_time - display['prev_time'])
+                display['frame_count'] = 0
+                display['prev_time'] = current_time
+
+            if modules.globals.show_fps:
+                temp_frame = temp_frame.copy()
+                cv2.putText(
+                    temp_frame,
+                    f"FPS: {display['fps']:.1f}",
+                    (10, 30),
+                    cv2.FONT_HERSHEY_SIMPLEX,
+                    1,
+                    (0, 255, 0),
+                    2,
+                )
+                stats = pipeline.stats()
+                cv2.putText(
+                    temp_frame,
+                    " ".join(f"{stage} {stats[stage]:.0f}ms" for stage in LIVE_LATENCY_STAGES if stage in stats),
+                    (10, 60),
+                    cv2.FONT_HERSHEY_SIMPLEX,
+                    0.5,
+                    (0, 255, 0),
+                    1,
+                )
+
+            image = cv2.cvtColor(temp_frame, cv2.COLOR_BGR2RGB)
+            image = Image.fromarray(image)
+            image = ImageOps.contain(
+                image, (temp_frame.shape[1], temp_frame.shape[0]), Image.LANCZOS
             )
+            image = ctk.CTkImage(image, size=image.size)
+            preview_label.configure(image=image)
+            pipeline.record_display(captured_at, started)
 
-        if not modules.globals.map_faces:
-            if source_image is None and modules.globals.source_path:
-                source_image = get_one_face(cv2.imread(modules.globals.source_path))
+        PREVIEW.after(LIVE_DISPLAY_INTERVAL_MS, display_frame)
 
-            for frame_processor in frame_processors:
-                if frame_processor.NAME == "DLC.FACE-ENHANCER":
-                    if modules.globals.fp_ui["face_enhancer"]:
-                        temp_frame = frame_processor.process_frame(None, temp_frame)
-                else:
-                    temp_frame = frame_processor.process_frame(source_image, temp_frame)
-        else:
-            modules.globals.target_path = None
-            for frame_processor in frame_processors:
-                if frame_processor.NAME == "DLC.FACE-ENHANCER":
-                    if modules.globals.fp_ui["face_enhancer"]:
-                        temp_frame = frame_processor.process_frame_v2(temp_frame)
-                else:
-                    temp_frame = frame_processor.process_frame_v2(temp_frame)
-
-        # Calculate and display FPS
-        current_time = time.time()
-        frame_count += 1
-        if current_time - prev_time >= fps_update_interval:
-            fps = frame_count / (current_time - prev_time)
-            frame_count = 0
-            prev_time = current_time
-
-        if modules.globals.show_fps:
-            cv2.putText(
-                temp_frame,
-                f"FPS: {fps:.1f}",
-                (10, 30),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                1,
-                (0, 255, 0),
-                2,
-            )
+    display_frame()
 
-        image = cv2.cvtColor(temp_frame, cv2.COLOR_BGR2RGB)
-        image = Image.fromarray(image)
-        image = ImageOps.contain(
-            image, (temp_frame.shape[1], temp_frame.shape[0]), Image.LANCZOS
-        )
-        image = ctk.CTkImage(image, size=image.size)
-        preview_label.configure(image=image)
-        ROOT.update()
 
-        if PREVIEW.state() == "withdrawn":
-            break
+def stop_webcam_preview() -> None:
+    global LIVE_PIPELINE
 
-    cap.release()
+    pipeline, LIVE_PIPELINE = LIVE_PIPELINE, None
+    if pipeline is None:
+        return
+    pipeline.stop()
+    pipeline.capturer.release()
+    stats = pipeline.stats()
+    if stats:
+        print("[DLC.LIVE] Stage latency: " + ", ".join(f"{stage} {stats[stage]:.1f}ms" for stage in LIVE_LATENCY_STAGES if stage in stats))
     PREVIEW.withdraw()
 
 
@@ -1593,7 +1734,7 @@ def update_webcam_source(
         return map
     else:
         cv2_img = cv2.imread(source_path)
-        face = get_one_face(cv2_img)
+        face = get_source_image_face(source_path)
 
         if face:
             x_min, y_min, x_max, y_max = face["bbox"]
@@ -1,4 +1,5 @@
 import glob
+import json
 import mimetypes
 import os
 import platform
@@ -7,8 +8,9 @@ import ssl
 import subprocess
 import urllib
 from pathlib import Path
-from typing import List, Any
+from typing import List, Any, Iterator, Optional, Tuple
 from tqdm import tqdm
+import numpy
 
 import modules.globals
 
@@ -60,6 +62,159 @@ def detect_fps(target_path: str) -> float:
     return 30.0
 
 
+def detect_rotation(target_path: str) -> int:
+    """Display rotation of the first video stream in degrees (0, 90, 180 or 270)."""
+    command = [
+        "ffprobe",
+        "-v",
+        "error",
+        "-select_streams",
+        "v:0",
+        "-show_entries",
+        "stream_tags=rotate:stream_side_data=rotation",
+        "-of",
+        "json",
+        target_path,
+    ]
+    try:
+        streams = json.loads(subprocess.check_output(command)).get("streams") or [{}]
+    except Exception:
+        return 0
+    stream = streams[0]
+    rotation = stream.get("tags", {}).get("rotate")
+    for side_data in stream.get("side_data_list", []):
+        if rotation is None and "rotation" in side_data:
+            rotation = side_data["rotation"]
+    return int(float(rotation or 0)) % 360
+
+
+def detect_resolution(target_path: str) -> Tuple[int, int]:
+    """
+    Size of the frames ffmpeg decodes. ffmpeg autorotates, so a 90/270° phone video
+    comes out of the pipe (and out of extract_frames) transposed from its stream tags.
+    """
+    command = [
+        "ffprobe",
+        "-v",
+        "error",
+        "-select_streams",
+        "v:0",
+        "-show_entries",
+        "stream=width,height",
+        "-of",
+        "csv=s=x:p=0",
+        target_path,
+    ]
+    output = subprocess.check_output(command).decode().strip().split("x")
+    width, height = map(int, output[:2])
+    if detect_rotation(target_path) in (90, 270):
+        width, height = height, width
+    return width, height
+
+
+def read_frames(target_path: str) -> Iterator[Any]:
+    """Decode the target video through an ffmpeg pipe, yielding raw BGR frames."""
+    width, height = detect_resolution(target_path)
+    commands = [
+        "ffmpeg",
+        "-hide_banner",
+        "-hwaccel",
+        "auto",
+        "-loglevel",
+        modules.globals.log_level,
+        "-i",
+        target_path,
+        "-f",
+        "rawvideo",
+        "-pix_fmt",
+        "bgr24",
+        "pipe:1",
+    ]
+    process = subprocess.Popen(commands, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, bufsize=width * height * 3)
+    try:
+        yield from iter_raw_frames(process.stdout, width, height)
+    finally:
+        process.stdout.close()
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+
+
+def iter_raw_frames(stream: Any, width: int, height: int) -> Iterator[Any]:
+    """Yield BGR frames of the given size from a raw bgr24 byte stream until it ends."""
+    frame_size = width * height * 3
+    while True:
+        frame = numpy.empty((height, width, 3), dtype=numpy.uint8)
+        if stream.readinto(memoryview(frame).cast("B")) < frame_size:
+            break
+        yield frame
+
+
+def open_stream_decoder(input_format: str = "mpegts") -> subprocess.Popen:  # type: ignore[type-arg]
+    """Start an ffmpeg decoder turning an encoded stream written to stdin into raw BGR frames on stdout."""
+    commands = [
+        "ffmpeg",
+        "-hide_banner",
+        "-loglevel",
+        modules.globals.log_level,
+        "-f",
+        input_format,
+        "-i",
+        "pipe:0",
+        "-f",
+        "rawvideo",
+        "-pix_fmt",
+        "bgr24",
+        "pipe:1",
+    ]
+    return subprocess.Popen(commands, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+
+def open_video_writer(target_path: str, width: int, height: int, fps: float = 30.0, output_path: Optional[str] = None, output_format: Optional[str] = None) -> subprocess.Popen:  # type: ignore[type-arg]
+    """
+    Start an ffmpeg encoder reading raw BGR frames from stdin into the temp output file,
+    or into output_path in output_format (e.g. "mpegts", which can be read while it's written).
+    """
+    temp_output_path = output_path or get_temp_output_path(target_path)
+    container = ["-f", output_format] if output_format else []
+    commands = [
+        "ffmpeg",
+        "-hide_banner",
+        "-loglevel",
+        modules.globals.log_level,
+        "-f",
+        "rawvideo",
+        "-pix_fmt",
+        "bgr24",
+        "-s",
+        f"{width}x{height}",
+        "-r",
+        str(fps),
+        "-i",
+        "pipe:0",
+        "-c:v",
+        modules.globals.video_encoder,
+        "-crf",
+        str(modules.globals.video_quality),
+        "-pix_fmt",
+        "yuv420p",
+        "-vf",
+        "colorspace=bt709:iall=bt601-6-625:fast=1",
+        *container,
+        "-y",
+        temp_output_path,
+    ]
+    return subprocess.Popen(commands, stdin=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+
+def close_video_writer(writer: subprocess.Popen) -> bool:  # type: ignore[type-arg]
+    try:
+        writer.stdin.close()
+    except Exception:
+        pass
+    return writer.wait() == 0
+
+
 def extract_frames(target_path: str) -> None:
     temp_directory_path = get_temp_directory_path(target_path)
     run_ffmpeg(
@@ -120,7 +275,23 @@ def restore_audio(target_path: str, output_path: str) -> None:
 
 def get_temp_frame_paths(target_path: str) -> List[str]:
     temp_directory_path = get_temp_directory_path(target_path)
-    return glob.glob((os.path.join(glob.escape(temp_directory_path), "*.png")))
+    return sorted(glob.glob((os.path.join(glob.escape(temp_directory_path), "*.png"))), key=get_frame_sort_key)
+
+
+def get_frame_sort_key(temp_frame_path: str) -> Tuple[int, Any]:
+    # numeric order keeps 10000.png after 9999.png once a video outgrows %04d
+    frame_number = get_frame_number(temp_frame_path)
+    if frame_number is not None:
+        return 0, frame_number
+    return 1, os.path.splitext(os.path.basename(temp_frame_path))[0]
+
+
+def get_frame_number(temp_frame_path: str) -> Optional[int]:
+    # temp frames are named after their 1-based frame number (%04d.png)
+    frame_name, _ = os.path.splitext(os.path.basename(temp_frame_path or ''))
+    if frame_name.isdigit():
+        return int(frame_name)
+    return None
 
 
 def get_temp_directory_path(target_path: str) -> str:
@@ -3,6 +3,7 @@ import numpy as np
 from typing import Optional, Tuple, Callable
 import platform
 import threading
+import time
 
 # Only import Windows-specific library if on Windows
 if platform.system() == "Windows":
@@ -15,6 +16,11 @@ class VideoCapturer:
         self.frame_callback = None
         self._current_frame = None
         self._frame_ready = threading.Event()
+        self._frame_lock = threading.Lock()
+        self._frame_id = 0           # increases with every captured frame
+        self._frame_time = 0.0       # perf_counter() when the latest frame was read
+        self._capture_thread = None
+        self.capture_ms = 0.0        # smoothed time cap.read() blocks per frame
         self.is_running = False
         self.cap = None
 
@@ -82,11 +88,60 @@ class VideoCapturer:
             return True, frame
         return False, None
 
+    def start_thread(self) -> None:
+        """
+        Reads the camera on a background thread into a single latest-frame slot.
+        A frame nobody took before the next one arrived is overwritten, so consumers
+        always get the freshest frame instead of a backlog. Use read_latest() afterwards.
+        """
+        if self._capture_thread is not None or not self.is_running:
+            return
+        self._capture_thread = threading.Thread(target=self._capture_loop, name="camera-capture", daemon=True)
+        self._capture_thread.start()
+
+    def _capture_loop(self) -> None:
+        while self.is_running:
+            started = time.perf_counter()
+            ret, frame = self.cap.read() if self.cap is not None else (False, None)
+            if not ret:
+                self.is_running = False
+                break
+            now = time.perf_counter()
+            self.capture_ms = self.capture_ms * 0.9 + (now - started) * 1000 * 0.1
+            with self._frame_lock:
+                self._current_frame = frame
+                self._frame_id += 1
+                self._frame_time = now
+            self._frame_ready.set()
+            if self.frame_callback:
+                self.frame_callback(frame)
+        self._frame_ready.set()  # wakes up a read_latest() waiting for a frame that won't come
+
+    def read_latest(self, last_frame_id: int = 0, timeout: float = 1.0) -> Tuple[bool, Optional[np.ndarray], int, float]:
+        """
+        Waits for a frame newer than last_frame_id; returns (ret, frame, frame_id, captured_at).
+        captured_at is the perf_counter() time the frame was read, for latency accounting.
+        """
+        deadline = time.perf_counter() + timeout
+        while True:
+            with self._frame_lock:
+                if self._frame_id > last_frame_id:
+                    return True, self._current_frame, self._frame_id, self._frame_time
+                self._frame_ready.clear()
+            remaining = deadline - time.perf_counter()
+            if not self.is_running or remaining <= 0:
+                return False, None, last_frame_id, 0.0
+            self._frame_ready.wait(remaining)
+
     def release(self) -> None:
         """Stop capture and release resources"""
-        if self.is_running and self.cap is not None:
-            self.cap.release()
+        # the capture thread stops itself when the camera fails, so only the cap is checked
+        if self.cap is not None:
             self.is_running = False
+            if self._capture_thread is not None:
+                self._capture_thread.join(timeout=1.0)
+                self._capture_thread = None
+            self.cap.release()
             self.cap = None
 
     def set_frame_callback(self, callback: Callable[[np.ndarray], None]) -> None:
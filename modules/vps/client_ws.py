@@ -7,9 +7,16 @@ import json
 import base64
 import asyncio
 import websockets
-from typing import Optional, Dict, Any, Tuple
+from typing import Optional, Dict, Any, AsyncIterator, Callable, Iterable, List, Set, Tuple
 import modules.globals
 from modules.core import update_status
+from modules.analysis_cache import get_file_hash
+from modules.utilities import detect_fps, detect_resolution, detect_rotation, is_video
+from modules.vps.protocol import (
+    CAS_PROTOCOL_VERSION, CHUNKED_PROTOCOL_VERSION, SESSION_PROTOCOL_VERSION, STREAMING_PROTOCOL_VERSION,
+    FileReceiver, ProtocolError, chunk_transfer_id, file_info, new_job_id, new_transfer_id, send_file, unpack_chunk
+)
+from modules.vps.streaming import mux_stream_output, send_remuxed_target
 
 
 class VPSClient:
@@ -38,6 +45,34 @@ class VPSClient:
         with open(output_path, 'wb') as f:
             f.write(file_bytes)
     
+    def build_config(self) -> Dict[str, Any]:
+        """Configuração local que o servidor aplica ao job."""
+        config = {
+            'frame_processors': modules.globals.frame_processors,
+            'keep_fps': modules.globals.keep_fps,
+            'keep_audio': modules.globals.keep_audio,
+            'keep_frames': modules.globals.keep_frames,
+            'many_faces': modules.globals.many_faces,
+            'map_faces': modules.globals.map_faces,
+            'color_correction': modules.globals.color_correction,
+            'nsfw_filter': modules.globals.nsfw_filter,
+            'mouth_mask': modules.globals.mouth_mask,
+            'adaptive_det_size': modules.globals.adaptive_det_size,
+            'face_tracking': modules.globals.face_tracking,
+            'face_tracking_interval': modules.globals.face_tracking_interval,
+            'analysis_cache': modules.globals.analysis_cache,
+            'video_encoder': modules.globals.video_encoder,
+            'video_quality': modules.globals.video_quality,
+            'stream_frames': modules.globals.stream_frames,
+            'execution_providers': modules.globals.execution_providers,
+            'execution_threads': modules.globals.execution_threads,
+            'max_memory': modules.globals.max_memory,
+            'opacity': modules.globals.opacity,
+            'sharpness': modules.globals.sharpness,
+            'swap_batch_size': modules.globals.swap_batch_size,
+        }
+        return config
+    
     async def test_connection(self) -> Tuple[bool, str]:
         """
         Testa conexão com o servidor.
@@ -112,69 +147,70 @@ class VPSClient:
             async with websockets.connect(self.server_url, ping_interval=30, ping_timeout=10) as websocket:
                 update_status("Conectado! Enviando arquivos...")
                 
-                # Codificar arquivos
-                source_b64 = self.encode_file(source_path)
-                target_b64 = self.encode_file(target_path)
-                
-                # Preparar configuração
-                config = {
-                    'frame_processors': modules.globals.frame_processors,
-                    'keep_fps': modules.globals.keep_fps,
-                    'keep_audio': modules.globals.keep_audio,
-                    'keep_frames': modules.globals.keep_frames,
-                    'many_faces': modules.globals.many_faces,
-                    'map_faces': modules.globals.map_faces,
-                    'color_correction': modules.globals.color_correction,
-                    'nsfw_filter': modules.globals.nsfw_filter,
-                    'mouth_mask': modules.globals.mouth_mask,
-                    'video_encoder': modules.globals.video_encoder,
-                    'video_quality': modules.globals.video_quality,
-                    'execution_providers': modules.globals.execution_providers,
-                    'execution_threads': modules.globals.execution_threads,
-                    'max_memory': modules.globals.max_memory,
-                    'opacity': modules.globals.opacity,
-                    'sharpness': modules.globals.sharpness,
-                }
-                
-                # Enviar comando de processamento
-                comando = {
-                    'comando': 'PROCESS',
-                    'source_file': source_b64,
-                    'target_file': target_b64,
-                    'config': config
-                }
-                
-                await websocket.send(json.dumps(comando))
-                
-                # Aguardar resposta
-                while True:
-                    resposta = await websocket.recv()
-                    data = json.loads(resposta)
-                    
-                    comando_resp = data.get('comando')
-                    
-                    if comando_resp == 'PROCESSANDO':
-                        progresso = data.get('progresso', 0)
-                        mensagem = data.get('mensagem', 'Processando...')
-                        update_status(f"{mensagem} ({progresso}%)")
-                    
-                    elif comando_resp == 'COMPLETO':
-                        # Receber arquivo processado
-                        arquivo_b64 = data.get('arquivo')
-                        if arquivo_b64:
-                            update_status("Salvando resultado...")
-                            self.decode_file(arquivo_b64, output_path)
-                            update_status("Processamento concluído!")
-                            return True
-                        else:
-                            update_status("Erro: arquivo não recebido")
-                            return False
-                    
-                    elif comando_resp == 'ERRO':
-                        erro = data.get('mensagem', 'Erro desconhecido')
-                        update_status(f"Erro no servidor: {erro}")
+                protocolo = await self.get_protocol_version(websocket)
+                return await self.process_on_connection(websocket, protocolo, source_path, target_path, output_path)
+                
+        except Exception as e:
+            update_status(f"Erro ao processar remotamente: {str(e)}")
+            return False
+    
+    async def process_on_connection(self, websocket, protocolo: int, source_path: str, target_path: str,
+                                    output_path: str, job_id: Optional[str] = None) -> bool:
+        """
+        Um job numa conexão já aberta, no melhor modo que o servidor suporta.
+        websocket pode ser um JobChannel de uma VPSSession; job_id só vai no PROCESS nesse caso.
+        """
+        try:
+            # MPEG-TS não guarda a rotação: vídeos girados (celular) vão pelo modo em chunks
+            if (protocolo >= STREAMING_PROTOCOL_VERSION and modules.globals.vps_streaming and is_video(target_path)
+                    and not detect_rotation(target_path)):
+                return await self.process_remote_streaming(websocket, source_path, target_path, output_path, job_id)
+            if protocolo >= CHUNKED_PROTOCOL_VERSION:
+                return await self.process_remote_chunked(websocket, source_path, target_path, output_path, protocolo, job_id)
+            
+            # Servidor antigo: arquivos inteiros em base64 no JSON
+            source_b64 = self.encode_file(source_path)
+            target_b64 = self.encode_file(target_path)
+            
+            # Enviar comando de processamento
+            comando = {
+                'comando': 'PROCESS',
+                'source_file': source_b64,
+                'target_file': target_b64,
+                'config': self.build_config()
+            }
+            
+            await websocket.send(json.dumps(comando))
+            
+            # Aguardar resposta
+            while True:
+                resposta = await websocket.recv()
+                data = json.loads(resposta)
+                
+                comando_resp = data.get('comando')
+                
+                if comando_resp == 'PROCESSANDO':
+                    progresso = data.get('progresso', 0)
+                    mensagem = data.get('mensagem', 'Processando...')
+                    update_status(f"{mensagem} ({progresso}%)")
+                
+                elif comando_resp == 'COMPLETO':
+                    # Receber arquivo processado
+                    arquivo_b64 = data.get('arquivo')
+                    if arquivo_b64:
+                        update_status("Salvando resultado...")
+                        self.decode_file(arquivo_b64, output_path)
+                        update_status("Processamento concluído!")
+                        return True
+                    else:
+                        update_status("Erro: arquivo não recebido")
                         return False
                 
+                elif comando_resp == 'ERRO':
+                    erro = data.get('mensagem', 'Erro desconhecido')
+                    update_status(f"Erro no servidor: {erro}")
+                    return False
+                
         except websockets.exceptions.ConnectionClosed:
             update_status("Conexão com servidor fechada")
             return False
@@ -182,6 +218,328 @@ class VPSClient:
             update_status(f"Erro ao processar remotamente: {str(e)}")
             return False
 
+    
+    async def get_protocol_version(self, websocket) -> int:
+        """Versão do protocolo de transferência do servidor (1 = base64 no JSON, servidores antigos)."""
+        await websocket.send(json.dumps({'comando': 'INFO'}))
+        data = json.loads(await asyncio.wait_for(websocket.recv(), timeout=10.0))
+        return data.get('protocolo', 1) if data.get('comando') == 'INFO' else 1
+    
+    async def get_missing_hashes(self, websocket, hashes: List[str], ref: Optional[str] = None) -> Set[str]:
+        """Protocolo 4: quais destes sha256 o servidor ainda não tem (ref volta no MISSING, protocolo 5)."""
+        await websocket.send(json.dumps({'comando': 'HAVE', 'hashes': hashes, 'ref': ref}))
+        data = json.loads(await asyncio.wait_for(websocket.recv(), timeout=10.0))
+        if data.get('comando') != 'MISSING':
+            raise ProtocolError(f"Resposta inesperada ao HAVE: {data.get('comando')}")
+        return set(data.get('hashes', []))
+    
+    async def process_remote_chunked(self, websocket, source_path: str, target_path: str,
+                                     output_path: str, protocolo: int = CHUNKED_PROTOCOL_VERSION,
+                                     job_id: Optional[str] = None) -> bool:
+        """
+        Protocolo 2: uploads e download em chunks binários, lidos/gravados direto do/no disco.
+        Protocolo 4: só sobe o que o servidor ainda não tem; se ele descartar um arquivo entre
+        o HAVE e o PROCESS, o job é mandado de novo com os dois arquivos.
+        """
+        usar_store = protocolo >= CAS_PROTOCOL_VERSION
+        while True:
+            resultado = await self.run_chunked_job(websocket, source_path, target_path, output_path, usar_store, job_id)
+            if resultado is None and usar_store:
+                update_status("Servidor não tem mais os arquivos, enviando de novo...")
+                usar_store = False
+                continue
+            return bool(resultado)
+    
+    async def run_chunked_job(self, websocket, source_path: str, target_path: str,
+                              output_path: str, usar_store: bool, job_id: Optional[str] = None) -> Optional[bool]:
+        """Um PROCESS do protocolo 2+; None quando o servidor pede ('faltando') arquivos que já tinha."""
+        caminhos = {'source': source_path, 'target': target_path}
+        entradas = {file_type: file_info(caminho) for file_type, caminho in caminhos.items()}
+        if usar_store:
+            for file_type, caminho in caminhos.items():
+                entradas[file_type]['sha256'] = await asyncio.to_thread(get_file_hash, caminho)
+            faltando = await self.get_missing_hashes(websocket, [info['sha256'] for info in entradas.values()], job_id)
+            # O que o servidor já tem vai só pelo sha256, sem transferência
+            entradas = {
+                file_type: info if info['sha256'] in faltando else {'sha256': info['sha256']}
+                for file_type, info in entradas.items()
+            }
+        comando = {
+            'comando': 'PROCESS',
+            'protocolo': CAS_PROTOCOL_VERSION if usar_store else CHUNKED_PROTOCOL_VERSION,
+            'source': entradas['source'],
+            'target': entradas['target'],
+            'config': self.build_config()
+        }
+        if job_id:
+            comando['job_id'] = job_id
+        await websocket.send(json.dumps(comando))
+        for file_type, info in entradas.items():
+            if 'transfer_id' in info:
+                await send_file(websocket, caminhos[file_type], info['transfer_id'])
+        
+        receiver = None
+        try:
+            while True:
+                resposta = await websocket.recv()
+                
+                if isinstance(resposta, bytes):
+                    # Chunk do resultado
+                    transfer_id, index, payload = unpack_chunk(resposta)
+                    if receiver is None or transfer_id != receiver.transfer_id:
+                        raise ProtocolError(f"Chunk de transferência inesperada: {transfer_id}")
+                    if receiver.write(index, payload):
+                        update_status("Processamento concluído!")
+                        return True
+                    continue
+                
+                data = json.loads(resposta)
+                comando_resp = data.get('comando')
+                
+                if comando_resp == 'PROCESSANDO':
+                    progresso = data.get('progresso', 0)
+                    mensagem = data.get('mensagem', 'Processando...')
+                    update_status(f"{mensagem} ({progresso}%)")
+                
+                elif comando_resp == 'COMPLETO':
+                    update_status("Recebendo resultado...")
+                    receiver = FileReceiver(output_path, data['resultado'])
+                    if receiver.done:
+                        update_status("Processamento concluído!")
+                        return True
+                
+                elif comando_resp == 'ERRO':
+                    if data.get('faltando') and usar_store:
+                        return None
+                    erro = data.get('mensagem', 'Erro desconhecido')
+                    update_status(f"Erro no servidor: {erro}")
+                    return False
+        except ProtocolError as e:
+            update_status(f"Erro na transferência: {str(e)}")
+            return False
+        finally:
+            if receiver is not None and not receiver.done:
+                receiver.abort()
+
+    
+    async def send_stream_uploads(self, websocket, source_path: str, source_info: Dict[str, Any],
+                                  target_path: str, target_id: str) -> None:
+        await send_file(websocket, source_path, source_info['transfer_id'])
+        await send_remuxed_target(websocket, target_path, target_id)
+    
+    async def process_remote_streaming(self, websocket, source_path: str, target_path: str,
+                                       output_path: str, job_id: Optional[str] = None) -> bool:
+        """
+        Modo streaming (ver streaming.py): o target sobe remuxado em MPEG-TS enquanto o servidor
+        já processa, e o vídeo de saída volta em chunks enquanto é codificado.
+        """
+        width, height = detect_resolution(target_path)
+        source_info = file_info(source_path)
+        target_id = new_transfer_id()
+        comando = {
+            'comando': 'PROCESS',
+            'protocolo': STREAMING_PROTOCOL_VERSION,
+            'stream': True,
+            'source': source_info,
+            'target': {
+                'transfer_id': target_id,
+                'tamanho': None,
+                'extensao': '.ts',
+                'largura': width,
+                'altura': height,
+                'fps': detect_fps(target_path) if modules.globals.keep_fps else 30.0,
+            },
+            'config': self.build_config()
+        }
+        if job_id:
+            comando['job_id'] = job_id
+        await websocket.send(json.dumps(comando))
+        # Upload em paralelo com a leitura das respostas: a saída começa a voltar antes do upload acabar
+        envio = asyncio.create_task(self.send_stream_uploads(websocket, source_path, source_info, target_path, target_id))
+        
+        stream_path = os.path.splitext(output_path)[0] + '.stream.ts'
+        receiver = None
+        try:
+            while True:
+                resposta = await websocket.recv()
+                
+                if isinstance(resposta, bytes):
+                    transfer_id, index, payload = unpack_chunk(resposta)
+                    if receiver is None or transfer_id != receiver.transfer_id:
+                        raise ProtocolError(f"Chunk de transferência inesperada: {transfer_id}")
+                    receiver.write(index, payload)
+                    continue
+                
+                data = json.loads(resposta)
+                comando_resp = data.get('comando')
+                
+                if comando_resp in ('PROCESSANDO', 'STREAM_INICIO'):
+                    progresso = data.get('progresso', 0)
+                    mensagem = data.get('mensagem', 'Processando...')
+                    update_status(f"{mensagem} ({progresso}%)")
+                    if comando_resp == 'STREAM_INICIO':
+                        receiver = FileReceiver(stream_path, {'transfer_id': data['transfer_id'], 'tamanho': None})
+                
+                elif comando_resp == 'COMPLETO':
+                    if receiver is None:
+                        raise ProtocolError("Resultado sem STREAM_INICIO")
+                    receiver.size = data['resultado']['tamanho']
+                    receiver.finish()
+                    await envio
+                    update_status("Juntando vídeo e áudio...")
+                    if not mux_stream_output(stream_path, target_path, output_path):
+                        update_status("Erro ao montar o vídeo de saída")
+                        return False
+                    update_status("Processamento concluído!")
+                    return True
+                
+                elif comando_resp == 'ERRO':
+                    erro = data.get('mensagem', 'Erro desconhecido')
+                    update_status(f"Erro no servidor: {erro}")
+                    return False
+        except ProtocolError as e:
+            update_status(f"Erro na transferência: {str(e)}")
+            return False
+        finally:
+            if not envio.done():
+                envio.cancel()
+            if receiver is not None and not receiver.done:
+                receiver.abort()
+            if os.path.exists(stream_path):
+                os.remove(stream_path)
+
+
+class JobChannel:
+    """
+    Um job dentro de uma VPSSession: send() vai direto para a conexão compartilhada e
+    recv() só devolve as mensagens deste job, que a sessão separa por job_id/transfer_id.
+    """
+    
+    def __init__(self, websocket, job_id: str):
+        self.websocket = websocket
+        self.job_id = job_id
+        self.mensagens: asyncio.Queue = asyncio.Queue()
+    
+    async def send(self, mensagem) -> None:
+        await self.websocket.send(mensagem)
+    
+    async def recv(self):
+        mensagem = await self.mensagens.get()
+        if isinstance(mensagem, Exception):
+            raise mensagem
+        return mensagem
+
+
+class VPSSession:
+    """
+    Uma conexão com o servidor para uma fila de arquivos.
+    Com protocolo 5 até max_in_flight jobs ficam no servidor ao mesmo tempo, então o upload
+    do próximo arquivo acontece enquanto a GPU processa o atual, e cada resultado volta
+    assim que fica pronto. Servidores antigos recebem um job por vez, na mesma conexão.
+    
+        async with VPSSession(VPSClient(url), max_in_flight=2) as session:
+            async for index, ok in session.process_many(jobs):
+                ...
+    """
+    
+    def __init__(self, client: VPSClient, max_in_flight: int = 2):
+        self.client = client
+        self.max_in_flight = max(1, max_in_flight)
+        self.websocket = None
+        self.protocolo = 1
+        self.canais: Dict[str, JobChannel] = {}          # job_id -> canal do job
+        self.transferencias: Dict[str, JobChannel] = {}  # transfer_id de um resultado -> canal do job
+        self.fechada: Optional[Exception] = None
+        self.leitor: Optional[asyncio.Task] = None
+        self.lock = asyncio.Lock()  # servidor antigo: a conexão é de um job por vez
+    
+    async def __aenter__(self) -> 'VPSSession':
+        update_status("Conectando ao servidor VPS...")
+        self.websocket = await websockets.connect(self.client.server_url, ping_interval=30, ping_timeout=10)
+        try:
+            self.protocolo = await self.client.get_protocol_version(self.websocket)
+        except Exception:
+            await self.websocket.close()
+            raise
+        if self.protocolo >= SESSION_PROTOCOL_VERSION:
+            self.leitor = asyncio.create_task(self.ler_mensagens())
+        else:
+            self.max_in_flight = 1
+        update_status(f"Conectado! Até {self.max_in_flight} arquivo(s) por vez no servidor")
+        return self
+    
+    async def __aexit__(self, *_) -> None:
+        if self.leitor is not None:
+            self.leitor.cancel()
+            try:
+                await self.leitor
+            except asyncio.CancelledError:
+                pass
+        await self.websocket.close()
+    
+    async def ler_mensagens(self) -> None:
+        """Único leitor da conexão: entrega cada mensagem ao canal do job dela."""
+        try:
+            async for mensagem in self.websocket:
+                if isinstance(mensagem, bytes):
+                    canal = self.transferencias.get(chunk_transfer_id(mensagem))
+                else:
+                    data = json.loads(mensagem)
+                    canal = self.canais.get(data.get('job_id') or data.get('ref'))
+                    # Os chunks do resultado chegam depois do anúncio (COMPLETO/STREAM_INICIO)
+                    transfer_id = data.get('transfer_id') or (data.get('resultado') or {}).get('transfer_id')
+                    if canal is not None and transfer_id:
+                        self.transferencias[transfer_id] = canal
+                    if canal is None and data.get('comando') == 'ERRO':
+                        update_status(f"Erro no servidor: {data.get('mensagem', 'Erro desconhecido')}")
+                if canal is not None:
+                    canal.mensagens.put_nowait(mensagem)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            self.fechada = ConnectionError("Conexão com servidor fechada")
+            for canal in self.canais.values():
+                canal.mensagens.put_nowait(self.fechada)
+    
+    async def process(self, source_path: str, target_path: str, output_path: str) -> bool:
+        if self.leitor is None:
+            async with self.lock:
+                return await self.client.process_on_connection(self.websocket, self.protocolo, source_path, target_path, output_path)
+        
+        canal = JobChannel(self.websocket, new_job_id())
+        if self.fechada is not None:
+            canal.mensagens.put_nowait(self.fechada)
+        self.canais[canal.job_id] = canal
+        try:
+            return await self.client.process_on_connection(canal, self.protocolo, source_path, target_path, output_path, canal.job_id)
+        finally:
+            del self.canais[canal.job_id]
+            for transfer_id in [transfer_id for transfer_id, dono in self.transferencias.items() if dono is canal]:
+                del self.transferencias[transfer_id]
+    
+    async def process_many(self, jobs: Iterable[Tuple[str, str, str]]) -> AsyncIterator[Tuple[int, bool]]:
+        """(índice, sucesso) de cada (source, target, output), na ordem em que terminam."""
+        async def run(index: int, job: Tuple[str, str, str]) -> Tuple[int, bool]:
+            return index, await self.process(*job)
+        
+        fila = enumerate(jobs)
+        pendentes = set()
+        try:
+            while True:
+                while len(pendentes) < self.max_in_flight:
+                    proximo = next(fila, None)
+                    if proximo is None:
+                        break
+                    pendentes.add(asyncio.ensure_future(run(*proximo)))
+                if not pendentes:
+                    return
+                prontos, pendentes = await asyncio.wait(pendentes, return_when=asyncio.FIRST_COMPLETED)
+                for tarefa in prontos:
+                    yield tarefa.result()
+        finally:
+            for tarefa in pendentes:
+                tarefa.cancel()
+
 
 def process_remote_file(source_path: str, target_path: str, output_path: str, 
                        server_url: str) -> bool:
@@ -200,3 +558,28 @@ def process_remote_file(source_path: str, target_path: str, output_path: str,
     client = VPSClient(server_url)
     return asyncio.run(client.process_remote(source_path, target_path, output_path))
 
+
+def process_remote_files(source_path: str, jobs: List[Tuple[str, str]], server_url: str, max_in_flight: int = 2,
+                         on_result: Optional[Callable[[int, bool], None]] = None) -> List[bool]:
+    """
+    Função helper síncrona para processar vários arquivos numa conexão só (ver VPSSession).
+    
+    Args:
+        source_path: Caminho do arquivo source, o mesmo para todos
+        jobs: Lista de (target, output)
+        server_url: URL do servidor VPS
+        max_in_flight: Arquivos no servidor ao mesmo tempo
+        on_result: Chamado com (índice, sucesso) conforme cada arquivo termina
+    
+    Returns:
+        Sucesso de cada job, na ordem de jobs
+    """
+    async def run() -> List[bool]:
+        resultados = [False] * len(jobs)
+        async with VPSSession(VPSClient(server_url), max_in_flight) as session:
+            async for index, ok in session.process_many((source_path, target, output) for target, output in jobs):
+                resultados[index] = ok
+                if on_result:
+                    on_result(index, ok)
+        return resultados
+    return asyncio.run(run())
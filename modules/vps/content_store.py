@@ -0,0 +1,180 @@
+"""
+Armazenamento endereçado por conteúdo do servidor VPS.
+
+Arquivos recebidos ficam em <raiz>/objetos/<sha256><ext> e resultados em
+<raiz>/resultados/<chave><ext>, com chave = sha256 de (source, target, config efetiva).
+Assim o cliente só sobe o que o servidor ainda não tem (HAVE/MISSING) e um job
+repetido devolve o resultado na hora. Tudo divide um orçamento de disco e sai por
+LRU (o mtime guarda o último uso, então a ordem sobrevive a um restart).
+"""
+import os
+import json
+import shutil
+import hashlib
+import threading
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+HASH_BLOCK_SIZE = 1024 * 1024
+OBJECTS_DIR = 'objetos'
+RESULTS_DIR = 'resultados'
+# Opções que mudam onde/como o job roda, mas não o arquivo de saída
+RESULT_NEUTRAL_OPTIONS = ('execution_providers', 'execution_threads', 'max_memory', 'stream_frames', 'analysis_cache', 'keep_frames')
+
+
+def hash_file(file_path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def get_result_key(source_sha: str, target_sha: str, job_config: Dict[str, Any]) -> str:
+    config = {key: value for key, value in job_config.items() if key not in RESULT_NEUTRAL_OPTIONS}
+    payload = json.dumps({'source': source_sha, 'target': target_sha, 'config': config}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ContentMismatch(Exception):
+    """O arquivo recebido não tem o sha256 anunciado."""
+
+
+class MissingContent(Exception):
+    """O job referencia objetos (sha256) que o servidor não tem (ou já descartou)."""
+
+    def __init__(self, hashes):
+        super().__init__(f"Arquivos não encontrados no servidor: {', '.join(hashes)}")
+        self.hashes = list(hashes)
+
+
+class ContentStore:
+    """Objetos e resultados em disco, num LRU com orçamento de max_bytes. Thread safe."""
+
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries: 'OrderedDict[Tuple[str, str], Tuple[str, int]]' = OrderedDict()  # (tipo, chave) -> (caminho, tamanho), LRU
+        self.size = 0
+        self.pins: Counter = Counter()  # caminhos em uso (sendo enviados), fora da evicção
+        for kind in (OBJECTS_DIR, RESULTS_DIR):
+            (self.root / kind).mkdir(parents=True, exist_ok=True)
+        self.load()
+
+    def load(self) -> None:
+        """Reconstrói o índice a partir do disco, do uso mais antigo para o mais recente."""
+        found = []
+        for kind in (OBJECTS_DIR, RESULTS_DIR):
+            for path in (self.root / kind).iterdir():
+                if path.is_file() and not path.name.endswith('.tmp'):
+                    stat = path.stat()
+                    found.append((stat.st_mtime, (kind, path.stem), str(path), stat.st_size))
+        for _, key, path, size in sorted(found):
+            self.entries[key] = (path, size)
+            self.size += size
+
+    def get(self, kind: str, key: str) -> Optional[str]:
+        with self.lock:
+            entry = self.entries.get((kind, key))
+            if entry is None:
+                return None
+            if not os.path.isfile(entry[0]):
+                self.forget((kind, key))
+                return None
+            self.entries.move_to_end((kind, key))
+        try:
+            os.utime(entry[0])
+        except OSError:
+            pass
+        return entry[0]
+
+    def has(self, sha: str) -> bool:
+        return self.get(OBJECTS_DIR, sha) is not None
+
+    def get_object(self, sha: str) -> Optional[str]:
+        return self.get(OBJECTS_DIR, sha)
+
+    def get_result(self, result_key: str) -> Optional[str]:
+        return self.get(RESULTS_DIR, result_key)
+
+    def put(self, kind: str, key: str, file_path: str) -> str:
+        """Move o arquivo para o store (se já existir igual, descarta o novo)."""
+        destination = str(self.root / kind / f"{key}{os.path.splitext(file_path)[1].lower()}")
+        with self.lock:
+            if (kind, key) in self.entries and os.path.isfile(self.entries[(kind, key)][0]):
+                os.remove(file_path)
+                self.entries.move_to_end((kind, key))
+                return self.entries[(kind, key)][0]
+            os.replace(file_path, destination)
+            size = os.path.getsize(destination)
+            self.entries[(kind, key)] = (destination, size)
+            self.size += size
+            self.evict()
+        return destination
+
+    def add_file(self, file_path: str, expected_sha: Optional[str] = None) -> str:
+        """Move um upload completo para objetos/ e retorna o sha256 dele."""
+        sha = hash_file(file_path)
+        if expected_sha and sha != expected_sha:
+            os.remove(file_path)
+            raise ContentMismatch(f"sha256 do arquivo recebido não confere ({sha} != {expected_sha})")
+        self.put(OBJECTS_DIR, sha, file_path)
+        return sha
+
+    def put_result(self, result_key: str, output_path: str) -> str:
+        return self.put(RESULTS_DIR, result_key, output_path)
+
+    def checkout(self, sha: str, directory: Path, name: str) -> str:
+        """
+        Cópia do objeto para um job: hard link (sem custo) ou cópia em outro filesystem.
+        Cada job tem o seu caminho, então o temp do job não colide com outro job do mesmo
+        arquivo e a evicção do objeto não afeta um job em andamento.
+        """
+        source_path = self.get_object(sha)
+        if source_path is None:
+            raise MissingContent([sha])
+        destination = str(Path(directory) / f"{name}{os.path.splitext(source_path)[1]}")
+        try:
+            os.link(source_path, destination)
+        except OSError:
+            shutil.copy2(source_path, destination)
+        return destination
+
+    @contextmanager
+    def using(self, file_path: str) -> Iterator[str]:
+        """Protege um arquivo do store da evicção enquanto ele é lido."""
+        with self.lock:
+            self.pins[file_path] += 1
+        try:
+            yield file_path
+        finally:
+            with self.lock:
+                self.pins[file_path] -= 1
+                if self.pins[file_path] <= 0:
+                    del self.pins[file_path]
+
+    def forget(self, key: Tuple[str, str]) -> None:
+        _, size = self.entries.pop(key)
+        self.size -= size
+
+    def evict(self) -> None:
+        """Remove os menos usados até caber no orçamento; o mais recente e os em uso ficam."""
+        for key in list(self.entries.keys())[:-1]:
+            if self.size <= self.max_bytes:
+                break
+            path, _ = self.entries[key]
+            if self.pins.get(path):
+                continue
+            self.forget(key)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def create_store_from_env(temp_dir: Path) -> ContentStore:
+    """VPS_CACHE_GB (padrão 20): orçamento de disco de uploads e resultados guardados."""
+    return ContentStore(Path(temp_dir) / 'cas', int(float(os.environ.get('VPS_CACHE_GB', 20)) * 1024 ** 3))
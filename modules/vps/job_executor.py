@@ -0,0 +1,219 @@
+"""
+Executor de jobs do servidor VPS.
+Os jobs rodam fora do event loop, num pool de processos que carregam os modelos uma vez
+e os mantêm quentes entre jobs. Cada processo roda um job por vez e aplica a config do
+job só dentro dele, então jobs simultâneos não compartilham modules.globals.
+"""
+import os
+import shutil
+import asyncio
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+import modules.globals
+
+# Config efetiva de um job: tudo que o cliente pode mandar, com os valores padrão do servidor
+JOB_CONFIG_DEFAULTS: Dict[str, Any] = {
+    'frame_processors': ['face_swapper'],
+    'keep_fps': True,
+    'keep_audio': True,
+    'keep_frames': False,
+    'many_faces': False,
+    'map_faces': False,
+    'color_correction': False,
+    'nsfw_filter': False,
+    'mouth_mask': False,
+    'adaptive_det_size': False,
+    'face_tracking': False,
+    'face_tracking_interval': 5,
+    'analysis_cache': True,
+    'video_encoder': 'libx264',
+    'video_quality': 18,
+    'stream_frames': False,
+    'execution_threads': 8,
+    'max_memory': 16,
+    'opacity': 1.0,
+    'sharpness': 0.0,
+    'swap_batch_size': 4,
+    'execution_providers': None,  # None = providers do servidor
+}
+EXECUTOR_MODES = ('process', 'thread')
+
+
+class JobQueueFull(Exception):
+    """Fila de jobs cheia; o cliente deve tentar de novo mais tarde."""
+
+
+def build_job_config(config: Dict[str, Any]) -> Dict[str, Any]:
+    """Config efetiva do job: padrões do servidor + o que o cliente mandou (chaves desconhecidas são ignoradas)."""
+    job_config = dict(JOB_CONFIG_DEFAULTS)
+    job_config.update({key: value for key, value in config.items() if key in JOB_CONFIG_DEFAULTS})
+    if not job_config['execution_providers']:
+        job_config['execution_providers'] = None
+    return job_config
+
+
+def apply_job_config(job_config: Dict[str, Any]) -> None:
+    """Aplica a config do job nos globals do processo que vai rodá-lo."""
+    for key, value in job_config.items():
+        if key == 'execution_providers':
+            if value:
+                modules.globals.execution_providers = value
+        else:
+            setattr(modules.globals, key, value)
+
+
+def init_worker(execution_providers: list) -> None:
+    """Roda uma vez por processo do pool: configura e carrega os modelos, que ficam quentes entre jobs."""
+    import modules.core
+    from modules.face_analyser import get_face_analyser
+    from modules.processors.frame.core import get_frame_processors_modules
+
+    modules.globals.headless = True
+    modules.globals.execution_providers = execution_providers
+    modules.core.limit_resources()
+    get_face_analyser()
+    for frame_processor in get_frame_processors_modules(JOB_CONFIG_DEFAULTS['frame_processors']):
+        frame_processor.pre_start()
+        if hasattr(frame_processor, 'get_face_swapper'):
+            frame_processor.get_face_swapper()
+
+
+def run_job(source_path: str, target_path: str, job_config: Dict[str, Any], output_path: str) -> str:
+    """Processa um arquivo completo (imagem ou vídeo) num processo do pool."""
+    from modules.capturer import release_captures
+
+    apply_job_config(job_config)
+    try:
+        return process_job(source_path, target_path, output_path)
+    finally:
+        # Os arquivos do job são apagados depois: nenhuma captura pode segurá-los abertos
+        release_captures()
+
+
+def process_job(source_path: str, target_path: str, output_path: str) -> str:
+    import modules.core
+    from modules.utilities import (
+        is_image, create_temp, extract_frames, get_temp_frame_paths,
+        detect_fps, create_video, restore_audio, move_temp, clean_temp
+    )
+    from modules.face_analyser import get_source_image_face
+    from modules.processors.frame.core import get_frame_processors_modules, process_video_fused, process_video_stream
+
+    if is_image(target_path):
+        # Processar imagem
+        shutil.copy2(target_path, output_path)
+
+        source_face = get_source_image_face(source_path)
+        if not source_face:
+            raise Exception("Nenhum rosto encontrado na imagem source")
+
+        for frame_processor in get_frame_processors_modules(modules.globals.frame_processors):
+            frame_processor.process_image(source_path, output_path, output_path)
+            modules.core.release_resources()
+        return output_path
+
+    # Processar vídeo
+    if modules.globals.stream_frames:
+        # Frames passam pelo pipe do ffmpeg, sem PNGs temporários
+        create_temp(target_path)
+        fps = detect_fps(target_path) if modules.globals.keep_fps else 30.0
+        if not process_video_stream(source_path, target_path, fps):
+            raise Exception("Falha no processamento em streaming")
+        modules.core.release_resources()
+    else:
+        create_temp(target_path)
+        extract_frames(target_path)
+
+        temp_frame_paths = get_temp_frame_paths(target_path)
+
+        # Todos os processadores em uma única passada por frame
+        process_video_fused(source_path, temp_frame_paths, target_path)
+        modules.core.release_resources()
+
+        # Criar vídeo
+        if modules.globals.keep_fps:
+            fps = detect_fps(target_path)
+            create_video(target_path, fps)
+        else:
+            create_video(target_path)
+
+    # Áudio
+    if modules.globals.keep_audio:
+        restore_audio(target_path, output_path)
+    else:
+        move_temp(target_path, output_path)
+
+    clean_temp(target_path)
+    return output_path
+
+
+class JobExecutor:
+    """
+    Fila limitada de jobs na frente de um pool de workers.
+    mode 'process': cada worker é um processo com seus modelos e seus globals (isolamento por job).
+    mode 'thread': uma única thread, já que threads dividiriam modules.globals; só tira o
+    trabalho do event loop.
+    run()/submit() recusam com JobQueueFull quando já há workers + max_queue jobs aceitos.
+    """
+
+    def __init__(self, workers: int = 1, max_queue: int = 8, mode: str = 'process'):
+        if mode not in EXECUTOR_MODES:
+            raise ValueError(f"Modo de executor inválido: {mode} (use {', '.join(EXECUTOR_MODES)})")
+        self.mode = mode
+        self.workers = max(1, workers) if mode == 'process' else 1
+        self.max_queue = max(0, max_queue)
+        self.pending = 0  # jobs aceitos (rodando + na fila); só mexido no event loop
+        self.executor: Optional[Executor] = None
+
+    def start(self) -> None:
+        initargs = (list(modules.globals.execution_providers),)
+        if self.mode == 'process':
+            # spawn: fork depois do CUDA inicializado quebra o contexto no processo filho
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=init_worker,
+                initargs=initargs
+            )
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=1, initializer=init_worker, initargs=initargs)
+
+    def shutdown(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    @property
+    def capacity(self) -> int:
+        return self.workers + self.max_queue
+
+    def queued_ahead(self) -> int:
+        """Jobs que um job aceito agora esperaria antes de começar."""
+        return max(0, self.pending - self.workers)
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """Roda fn(*args) num worker (fn precisa ser uma função de módulo, para ir ao processo)."""
+        if self.pending >= self.capacity:
+            raise JobQueueFull(f"Servidor ocupado: {self.pending} jobs em andamento/na fila")
+        if self.executor is None:
+            self.start()
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, fn, *args)
+        finally:
+            self.pending -= 1
+
+    async def submit(self, source_path: str, target_path: str, job_config: Dict[str, Any], output_path: str) -> str:
+        return await self.run(run_job, source_path, target_path, job_config, output_path)
+
+
+def create_executor_from_env() -> JobExecutor:
+    """VPS_JOB_WORKERS (padrão 1), VPS_JOB_QUEUE (padrão 8) e VPS_JOB_EXECUTOR ('process' ou 'thread')."""
+    return JobExecutor(
+        workers=int(os.environ.get('VPS_JOB_WORKERS', 1)),
+        max_queue=int(os.environ.get('VPS_JOB_QUEUE', 8)),
+        mode=os.environ.get('VPS_JOB_EXECUTOR', 'process')
+    )
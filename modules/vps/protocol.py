@@ -0,0 +1,150 @@
+"""
+Protocolo binário de transferência de arquivos entre cliente e servidor VPS.
+
+Comandos continuam como mensagens JSON (texto); o conteúdo dos arquivos vai em
+mensagens binárias de até CHUNK_SIZE bytes, cada uma com cabeçalho:
+
+    transfer_id (16 bytes) | índice do chunk (uint32) | crc32 do payload (uint32) | payload
+
+Quem envia anuncia a transferência antes num JSON ({'transfer_id', 'tamanho',
+'extensao', 'chunks'}, ver file_info) e o receptor grava os chunks direto no disco,
+em ordem, então arquivos de vários GB passam com memória constante.
+Streams de tamanho desconhecido (ver streaming.py) anunciam 'tamanho': None e
+terminam com um JSON {'comando': 'UPLOAD_FIM', 'transfer_id'}.
+
+Versões: 2 = arquivos em chunks; 3 = + processamento em streaming (PROCESS com 'stream');
+4 = + arquivos por sha256: o cliente pergunta (HAVE) e só sobe o que vier em MISSING;
+5 = + vários jobs na mesma conexão: o cliente escolhe o job_id do PROCESS (e o 'ref' do
+HAVE, devolvido no MISSING) e separa as respostas por ele.
+"""
+import os
+import re
+import uuid
+import zlib
+import struct
+from typing import Any, Dict, Optional, Tuple
+
+PROTOCOL_VERSION = 5
+CHUNKED_PROTOCOL_VERSION = 2
+STREAMING_PROTOCOL_VERSION = 3
+CAS_PROTOCOL_VERSION = 4
+SESSION_PROTOCOL_VERSION = 5
+CHUNK_SIZE = 512 * 1024  # cabe com folga no max_size padrão (1 MiB) do websockets
+CHUNK_HEADER = struct.Struct('!16sII')
+EXTENSION_PATTERN = re.compile(r'^\.[A-Za-z0-9]{1,8}$')
+JOB_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+
+class ProtocolError(Exception):
+    """Chunk corrompido, fora de ordem ou de uma transferência desconhecida."""
+
+
+def new_transfer_id() -> str:
+    return uuid.uuid4().hex
+
+
+def new_job_id() -> str:
+    return uuid.uuid4().hex
+
+
+def valid_job_id(job_id: Any) -> bool:
+    """job_id escolhido pelo cliente: vira nome de arquivo no servidor, então só hex."""
+    return isinstance(job_id, str) and bool(JOB_ID_PATTERN.match(job_id))
+
+
+def file_info(file_path: str, transfer_id: Optional[str] = None) -> Dict[str, Any]:
+    """Anúncio de uma transferência: vai no JSON antes dos chunks."""
+    size = os.path.getsize(file_path)
+    return {
+        'transfer_id': transfer_id or new_transfer_id(),
+        'tamanho': size,
+        'extensao': os.path.splitext(file_path)[1].lower(),
+        'chunks': (size + CHUNK_SIZE - 1) // CHUNK_SIZE,
+    }
+
+
+def safe_extension(extension: Any, default: str) -> str:
+    """Extensão anunciada pelo outro lado, se for só uma extensão (nada de caminhos)."""
+    if isinstance(extension, str) and EXTENSION_PATTERN.match(extension):
+        return extension.lower()
+    return default
+
+
+def pack_chunk(transfer_id: str, index: int, payload: bytes) -> bytes:
+    return CHUNK_HEADER.pack(bytes.fromhex(transfer_id), index, zlib.crc32(payload)) + payload
+
+
+def chunk_transfer_id(message: bytes) -> str:
+    """transfer_id de um chunk, sem conferir o payload (para saber de quem é antes do unpack_chunk)."""
+    return bytes(message[:16]).hex()
+
+
+def unpack_chunk(message: bytes) -> Tuple[str, int, bytes]:
+    """Retorna (transfer_id, índice, payload); ProtocolError se o crc32 não bater."""
+    if len(message) < CHUNK_HEADER.size:
+        raise ProtocolError("Chunk menor que o cabeçalho")
+    raw_id, index, checksum = CHUNK_HEADER.unpack_from(message)
+    payload = memoryview(message)[CHUNK_HEADER.size:]
+    if zlib.crc32(payload) != checksum:
+        raise ProtocolError(f"Checksum inválido no chunk {index}")
+    return raw_id.hex(), index, payload
+
+
+async def send_file(websocket: Any, file_path: str, transfer_id: str) -> None:
+    """Envia o arquivo em chunks; cada send espera o buffer esvaziar, então só um chunk fica em memória."""
+    with open(file_path, 'rb') as file:
+        index = 0
+        while True:
+            payload = file.read(CHUNK_SIZE)
+            if not payload:
+                break
+            await websocket.send(pack_chunk(transfer_id, index, payload))
+            index += 1
+
+
+class FileReceiver:
+    """Grava os chunks de uma transferência anunciada direto no arquivo de destino."""
+
+    def __init__(self, file_path: str, info: Dict[str, Any]):
+        self.file_path = file_path
+        self.transfer_id = info['transfer_id']
+        self.size = int(info['tamanho']) if info.get('tamanho') is not None else None  # None = stream, termina em finish()
+        self.finished = False
+        self.received = 0
+        self.next_index = 0
+        os.makedirs(os.path.dirname(file_path) or '.', exist_ok=True)
+        self.file = open(file_path, 'wb')
+        if self.done:
+            self.file.close()  # arquivo vazio: não vem nenhum chunk
+
+    @property
+    def done(self) -> bool:
+        return self.finished if self.size is None else self.received >= self.size
+
+    def write(self, index: int, payload: bytes) -> bool:
+        """Grava um chunk; retorna True quando o arquivo está completo (e fechado)."""
+        if index != self.next_index:
+            raise ProtocolError(f"Chunk {index} fora de ordem (esperado {self.next_index})")
+        if self.size is not None and self.received + len(payload) > self.size:
+            raise ProtocolError("Transferência maior que o tamanho anunciado")
+        self.file.write(payload)
+        self.received += len(payload)
+        self.next_index += 1
+        if self.done:
+            self.file.close()
+        return self.done
+
+    def finish(self) -> None:
+        """Fim de um stream de tamanho desconhecido."""
+        if self.size is not None and self.received != self.size:
+            raise ProtocolError(f"Transferência incompleta: {self.received} de {self.size} bytes")
+        self.finished = True
+        self.file.close()
+
+    def abort(self) -> None:
+        """Fecha e apaga o arquivo parcial."""
+        self.file.close()
+        try:
+            os.remove(self.file_path)
+        except OSError:
+            pass
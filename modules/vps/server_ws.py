@@ -6,14 +6,13 @@ Inspirado no Deep-Live-Cam-Server, mas adaptado para processar arquivos completo
 import os
 import sys
 import json
-import shutil
 import asyncio
 import websockets
 import base64
 import tempfile
-import cv2
+from contextlib import suppress
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple
 
 # Adicionar path dos módulos
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -21,13 +20,15 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import modules
 import modules.globals
 import modules.core
-from modules.utilities import is_image, is_video, has_image_extension
-from modules.face_analyser import get_one_face
+from modules.utilities import is_image
 from modules.processors.frame.core import get_frame_processors_modules
-from modules.utilities import (
-    create_temp, extract_frames, get_temp_frame_paths,
-    detect_fps, create_video, restore_audio, move_temp, clean_temp
+from modules.vps.content_store import MissingContent, create_store_from_env, get_result_key
+from modules.vps.job_executor import JobExecutor, JobQueueFull, build_job_config, create_executor_from_env
+from modules.vps.protocol import (
+    PROTOCOL_VERSION, FileReceiver, ProtocolError, file_info, new_job_id, new_transfer_id, safe_extension,
+    send_file, unpack_chunk, valid_job_id
 )
+from modules.vps.streaming import get_done_path, mark_upload_done, run_stream_job, tail_file
 import onnxruntime
 
 
@@ -58,9 +59,12 @@ TEMP_DIR.mkdir(exist_ok=True)
 class FileProcessingServer:
     """Servidor WebSocket para processar arquivos completos."""
     
-    def __init__(self):
+    def __init__(self, executor: JobExecutor):
         self.clientes_ativos = set()
-        self.jobs_ativos = {}  # job_id -> info do job
+        self.jobs_ativos = {}  # job_id -> task do job (de todos os clientes)
+        self.executor = executor
+        # Uploads e resultados por sha256, divididos entre todos os clientes
+        self.store = create_store_from_env(TEMP_DIR)
         
     def decode_file(self, file_b64: str, file_type: str) -> str:
         """Decodifica arquivo base64 e salva temporariamente."""
@@ -77,102 +81,211 @@ class FileProcessingServer:
         file_bytes = Path(file_path).read_bytes()
         return base64.b64encode(file_bytes).decode('utf-8')
     
+    def start_upload(self, info: Dict[str, Any], file_type: str, uploads: Dict[str, Any]) -> Tuple[FileReceiver, asyncio.Future]:
+        """
+        Registra uma transferência anunciada pelo cliente (protocolo 2); os chunks são gravados
+        em TEMP_DIR conforme chegam. O future resolve com o caminho quando o arquivo está completo
+        (para streams, 'tamanho': None, quando chega o UPLOAD_FIM).
+        """
+        import uuid
+        ext = safe_extension(info.get('extensao'), '.jpg' if file_type == 'source' else '.mp4')
+        temp_path = TEMP_DIR / f"{file_type}_{uuid.uuid4().hex[:8]}{ext}"
+        receiver = FileReceiver(str(temp_path), info)
+        future = asyncio.get_running_loop().create_future()
+        if receiver.done:
+            future.set_result(receiver.file_path)
+        else:
+            uploads[receiver.transfer_id] = (receiver, future)
+        return receiver, future
+    
+    def finish_upload(self, transfer_id: str, uploads: Dict[str, Any], ok: bool = True) -> None:
+        """Fim (UPLOAD_FIM) ou desistência (UPLOAD_ERRO) de um upload em stream."""
+        if transfer_id not in uploads:
+            raise ProtocolError(f"Transferência desconhecida: {transfer_id}")
+        receiver, future = uploads.pop(transfer_id)
+        try:
+            if not ok:
+                raise ProtocolError("O cliente interrompeu o upload")
+            receiver.finish()
+            future.set_result(receiver.file_path)
+        except ProtocolError as e:
+            receiver.abort()
+            future.set_exception(e)
+    
+    def receive_chunk(self, mensagem: bytes, uploads: Dict[str, Any]) -> None:
+        """Grava um chunk binário na transferência dele."""
+        transfer_id, index, payload = unpack_chunk(mensagem)
+        if transfer_id not in uploads:
+            raise ProtocolError(f"Transferência desconhecida: {transfer_id}")
+        receiver, future = uploads[transfer_id]
+        try:
+            if receiver.write(index, payload):
+                del uploads[transfer_id]
+                future.set_result(receiver.file_path)
+        except ProtocolError as e:
+            del uploads[transfer_id]
+            receiver.abort()
+            future.set_exception(e)
+    
+    def start_input(self, info: Dict[str, Any], file_type: str, uploads: Dict[str, Any]) -> asyncio.Future:
+        """
+        Entrada de um job do protocolo 2+; o future resolve com o sha256 do arquivo no store.
+        Sem 'transfer_id' o cliente só referencia, pelo 'sha256', um arquivo que o servidor já
+        tem (protocolo 4, ver HAVE); com, o upload é gravado e depois movido para o store.
+        """
+        if info.get('transfer_id'):
+            _, upload = self.start_upload(info, file_type, uploads)
+            return asyncio.ensure_future(self.store_upload(upload, info.get('sha256')))
+        future = asyncio.get_running_loop().create_future()
+        sha = info.get('sha256')
+        if sha and self.store.has(sha):
+            future.set_result(sha)
+        else:
+            future.set_exception(MissingContent([sha or file_type]))
+        return future
+    
+    async def store_upload(self, upload: asyncio.Future, expected_sha: Optional[str] = None) -> str:
+        """Espera o upload terminar e o move para o store (o hash roda fora do event loop)."""
+        file_path = await upload
+        return await asyncio.to_thread(self.store.add_file, file_path, expected_sha)
+    
+    async def wait_inputs(self, arquivos: Dict[str, asyncio.Future]) -> List[str]:
+        """sha256 de cada entrada; se faltar alguma no store, MissingContent lista todas as que faltam."""
+        resultados = await asyncio.gather(*arquivos.values(), return_exceptions=True)
+        faltando = [sha for resultado in resultados if isinstance(resultado, MissingContent) for sha in resultado.hashes]
+        if faltando:
+            raise MissingContent(faltando)
+        for resultado in resultados:
+            if isinstance(resultado, BaseException):
+                raise resultado
+        return resultados
+    
+    def abort_uploads(self, uploads: Dict[str, Any]) -> None:
+        for receiver, future in uploads.values():
+            receiver.abort()
+            if not future.done():
+                future.set_exception(ProtocolError("Conexão fechada durante o upload"))
+        uploads.clear()
+    
     async def processar_arquivo(self, source_path: str, target_path: str, 
                                 config: Dict[str, Any], job_id: str) -> str:
-        """Processa um arquivo completo (imagem ou vídeo)."""
+        """Processa um arquivo completo (imagem ou vídeo) no executor, sem travar o event loop."""
+        # Gerar output path
+        output_path = TEMP_DIR / f"output_{job_id}"
+        if is_image(target_path):
+            output_path = output_path.with_suffix('.png')
+        else:
+            output_path = output_path.with_suffix('.mp4')
+        
         try:
-            # Aplicar configurações
-            self.apply_config(config)
-            
-            # Determinar tipo
-            is_target_image = is_image(target_path)
-            
-            # Gerar output path
-            output_path = TEMP_DIR / f"output_{job_id}"
-            if is_target_image:
-                output_path = output_path.with_suffix('.png')
-            else:
-                output_path = output_path.with_suffix('.mp4')
-            
-            # Processar
-            if is_target_image:
-                # Processar imagem
-                shutil.copy2(target_path, str(output_path))
-                
-                source_face = get_one_face(cv2.imread(source_path))
-                if not source_face:
-                    raise Exception("Nenhum rosto encontrado na imagem source")
-                
-                for frame_processor in get_frame_processors_modules(modules.globals.frame_processors):
-                    frame_processor.process_image(source_path, str(output_path), str(output_path))
-                    modules.core.release_resources()
-            else:
-                # Processar vídeo
-                if not modules.globals.map_faces:
-                    create_temp(target_path)
-                    extract_frames(target_path)
-                
-                temp_frame_paths = get_temp_frame_paths(target_path)
-                
-                for frame_processor in get_frame_processors_modules(modules.globals.frame_processors):
-                    frame_processor.process_video(source_path, temp_frame_paths)
-                    modules.core.release_resources()
-                
-                # Criar vídeo
-                if modules.globals.keep_fps:
-                    fps = detect_fps(target_path)
-                    create_video(target_path, fps)
-                else:
-                    create_video(target_path)
-                
-                # Áudio
-                if modules.globals.keep_audio:
-                    restore_audio(target_path, str(output_path))
-                else:
-                    move_temp(target_path, str(output_path))
-                
-                clean_temp(target_path)
-            
-            return str(output_path)
-            
+            # Config isolada do job: aplicada só no worker que vai rodá-lo
+            return await self.executor.submit(source_path, target_path, build_job_config(config), str(output_path))
+        except JobQueueFull:
+            raise
         except Exception as e:
             raise Exception(f"Erro ao processar: {str(e)}")
     
-    def apply_config(self, config: Dict[str, Any]):
-        """Aplica configurações recebidas do cliente."""
-        modules.globals.frame_processors = config.get('frame_processors', ['face_swapper'])
-        modules.globals.keep_fps = config.get('keep_fps', True)
-        modules.globals.keep_audio = config.get('keep_audio', True)
-        modules.globals.keep_frames = config.get('keep_frames', False)
-        modules.globals.many_faces = config.get('many_faces', False)
-        modules.globals.map_faces = config.get('map_faces', False)
-        modules.globals.color_correction = config.get('color_correction', False)
-        modules.globals.nsfw_filter = config.get('nsfw_filter', False)
-        modules.globals.mouth_mask = config.get('mouth_mask', False)
-        modules.globals.video_encoder = config.get('video_encoder', 'libx264')
-        modules.globals.video_quality = config.get('video_quality', 18)
-        modules.globals.execution_threads = config.get('execution_threads', 8)
-        modules.globals.max_memory = config.get('max_memory', 16)
-        modules.globals.opacity = config.get('opacity', 1.0)
-        modules.globals.sharpness = config.get('sharpness', 0.0)
+    async def processar_com_cache(self, websocket, job_id: str, source_sha: str, target_sha: str,
+                                  config: Dict[str, Any]) -> str:
+        """
+        Caminho do resultado no store: o de um job igual já processado (mesmos arquivos e
+        mesma config efetiva) ou o de um job novo, rodado sobre hard links dos objetos.
+        """
+        result_key = get_result_key(source_sha, target_sha, build_job_config(config))
+        output_path = self.store.get_result(result_key)
+        if output_path:
+            await websocket.send(json.dumps({
+                'comando': 'PROCESSANDO',
+                'job_id': job_id,
+                'progresso': 90,
+                'mensagem': 'Resultado já processado antes, enviando...'
+            }))
+            return output_path
         
-        if config.get('execution_providers'):
-            modules.globals.execution_providers = config['execution_providers']
+        na_frente = self.executor.queued_ahead()
+        await websocket.send(json.dumps({
+            'comando': 'PROCESSANDO',
+            'job_id': job_id,
+            'progresso': 30,
+            'mensagem': f'Na fila ({na_frente} jobs à frente)...' if na_frente else 'Processando arquivo...'
+        }))
+        caminhos = []
+        try:
+            caminhos.append(self.store.checkout(source_sha, TEMP_DIR, f"source_{job_id}"))
+            caminhos.append(self.store.checkout(target_sha, TEMP_DIR, f"target_{job_id}"))
+            output_path = await self.processar_arquivo(caminhos[0], caminhos[1], config, job_id)
+            return self.store.put_result(result_key, output_path)
+        finally:
+            for caminho in caminhos:
+                try:
+                    os.remove(caminho)
+                except OSError:
+                    pass
+    
+    async def send_job_error(self, websocket, job_id: str, error: Exception) -> None:
+        """ERRO de um job; 'faltando' lista os sha256 que o cliente precisa mandar de novo."""
+        resposta = {
+            'comando': 'ERRO',
+            'job_id': job_id,
+            'mensagem': str(error)
+        }
+        if isinstance(error, MissingContent):
+            resposta['faltando'] = error.hashes
+        try:
+            await websocket.send(json.dumps(resposta))
+        except websockets.exceptions.ConnectionClosed:
+            pass
     
     async def processar_cliente(self, websocket, path):
         """Processa conexão de cliente."""
         self.clientes_ativos.add(websocket)
         print(f"Cliente conectado. Total: {len(self.clientes_ativos)}")
+        tarefas = set()  # jobs deste cliente; rodam em paralelo com a leitura de mensagens
+        uploads = {}     # transfer_id -> (FileReceiver, future) dos uploads em andamento
         
         try:
             async for mensagem in websocket:
                 try:
+                    if isinstance(mensagem, bytes):
+                        # Chunk de arquivo (protocolo 2)
+                        self.receive_chunk(mensagem, uploads)
+                        continue
+                    
                     data = json.loads(mensagem)
                     comando = data.get('comando')
                     
                     if comando == 'PROCESS':
-                        # Processar arquivo completo
-                        await self.handle_process(websocket, data)
+                        # Processar arquivo completo (em segundo plano, PINGs continuam sendo respondidos)
+                        # Protocolo 5: o job_id vem do cliente, que separa as respostas de vários jobs por ele
+                        job_id = data.get('job_id') or new_job_id()
+                        if not valid_job_id(job_id) or job_id in self.jobs_ativos:
+                            await self.send_job_error(websocket, str(job_id), ProtocolError(f"job_id inválido ou já em uso: {job_id}"))
+                            continue
+                        if data.get('protocolo', 1) >= 2:
+                            # Registrar os uploads já, antes do primeiro chunk chegar
+                            arquivos = {'source': self.start_input(data.get('source') or {}, 'source', uploads)}
+                            if data.get('stream'):
+                                # O target em stream nunca passa pelo store: o worker lê o arquivo enquanto ele cresce
+                                arquivos['target'] = self.start_upload(data.get('target') or {}, 'target', uploads)
+                                tarefa = asyncio.create_task(self.handle_process_streaming(websocket, job_id, data, arquivos))
+                            else:
+                                arquivos['target'] = self.start_input(data.get('target') or {}, 'target', uploads)
+                                tarefa = asyncio.create_task(self.handle_process_chunked(websocket, job_id, data, arquivos))
+                        else:
+                            tarefa = asyncio.create_task(self.handle_process(websocket, job_id, data))
+                        tarefas.add(tarefa)
+                        tarefa.add_done_callback(tarefas.discard)
+                        self.jobs_ativos[job_id] = tarefa
+                        tarefa.add_done_callback(lambda _, job_id=job_id: self.jobs_ativos.pop(job_id, None))
+                    elif comando == 'HAVE':
+                        # Quais destes sha256 o cliente ainda precisa subir
+                        await websocket.send(json.dumps({
+                            'comando': 'MISSING',
+                            'ref': data.get('ref'),
+                            'hashes': [sha for sha in data.get('hashes', []) if not self.store.has(sha)]
+                        }))
+                    elif comando in ('UPLOAD_FIM', 'UPLOAD_ERRO'):
+                        self.finish_upload(data.get('transfer_id'), uploads, ok=comando == 'UPLOAD_FIM')
                     elif comando == 'PING':
                         # Heartbeat
                         await websocket.send(json.dumps({'comando': 'PONG'}))
@@ -181,7 +294,10 @@ class FileProcessingServer:
                         await websocket.send(json.dumps({
                             'comando': 'INFO',
                             'providers': modules.globals.execution_providers,
-                            'status': 'online'
+                            'status': 'online',
+                            'protocolo': PROTOCOL_VERSION,
+                            'workers': self.executor.workers,
+                            'jobs_pendentes': self.executor.pending
                         }))
                     else:
                         await websocket.send(json.dumps({
@@ -201,13 +317,12 @@ class FileProcessingServer:
         except websockets.exceptions.ConnectionClosed:
             pass
         finally:
+            self.abort_uploads(uploads)
             self.clientes_ativos.discard(websocket)
             print(f"Cliente desconectado. Restantes: {len(self.clientes_ativos)}")
     
-    async def handle_process(self, websocket, data: Dict[str, Any]):
+    async def handle_process(self, websocket, job_id: str, data: Dict[str, Any]):
         """Processa um job completo."""
-        import uuid
-        job_id = str(uuid.uuid4())
         
         try:
             # Decodificar arquivos
@@ -230,19 +345,12 @@ class FileProcessingServer:
                 'mensagem': 'Decodificando arquivos...'
             }))
             
-            # Decodificar e salvar arquivos
-            source_path = self.decode_file(source_b64, 'source')
-            target_path = self.decode_file(target_b64, 'target')
-            
-            await websocket.send(json.dumps({
-                'comando': 'PROCESSANDO',
-                'job_id': job_id,
-                'progresso': 30,
-                'mensagem': 'Processando arquivo...'
-            }))
+            # Decodificar e guardar os arquivos no store
+            source_sha = await asyncio.to_thread(self.store.add_file, self.decode_file(source_b64, 'source'))
+            target_sha = await asyncio.to_thread(self.store.add_file, self.decode_file(target_b64, 'target'))
             
-            # Processar
-            output_path = await self.processar_arquivo(source_path, target_path, config, job_id)
+            # Processar (ou reaproveitar o resultado de um job igual)
+            output_path = await self.processar_com_cache(websocket, job_id, source_sha, target_sha, config)
             
             await websocket.send(json.dumps({
                 'comando': 'PROCESSANDO',
@@ -252,7 +360,8 @@ class FileProcessingServer:
             }))
             
             # Codificar resultado
-            output_b64 = self.encode_file(output_path)
+            with self.store.using(output_path):
+                output_b64 = self.encode_file(output_path)
             
             # Enviar resultado
             await websocket.send(json.dumps({
@@ -262,26 +371,130 @@ class FileProcessingServer:
                 'arquivo': output_b64,
                 'mensagem': 'Processamento concluído!'
             }))
-            
-            # Limpar arquivos temporários
-            try:
-                os.remove(source_path)
-                os.remove(target_path)
-                os.remove(output_path)
-            except:
-                pass
                 
+        except websockets.exceptions.ConnectionClosed:
+            pass
         except Exception as e:
+            await self.send_job_error(websocket, job_id, e)
+
+    
+    async def handle_process_chunked(self, websocket, job_id: str, data: Dict[str, Any], arquivos: Dict[str, asyncio.Future]):
+        """
+        Processa um job do protocolo 2+: as entradas chegam em chunks (ou já estão no store,
+        protocolo 4) e o resultado volta em chunks, direto do/para o disco.
+        """
+        
+        try:
             await websocket.send(json.dumps({
-                'comando': 'ERRO',
+                'comando': 'PROCESSANDO',
                 'job_id': job_id,
-                'mensagem': str(e)
+                'progresso': 10,
+                'mensagem': 'Recebendo arquivos...'
             }))
+            
+            source_sha, target_sha = await self.wait_inputs(arquivos)
+            output_path = await self.processar_com_cache(websocket, job_id, source_sha, target_sha, data.get('config', {}))
+            
+            # Anunciar o resultado e mandar os chunks logo em seguida
+            with self.store.using(output_path):
+                resultado = file_info(output_path)
+                await websocket.send(json.dumps({
+                    'comando': 'COMPLETO',
+                    'job_id': job_id,
+                    'progresso': 100,
+                    'resultado': resultado,
+                    'mensagem': 'Processamento concluído!'
+                }))
+                await send_file(websocket, output_path, resultado['transfer_id'])
+        
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        except Exception as e:
+            await self.send_job_error(websocket, job_id, e)
+
+    
+    async def handle_process_streaming(self, websocket, job_id: str, data: Dict[str, Any], arquivos: Dict[str, Tuple[FileReceiver, asyncio.Future]]):
+        """
+        Processa um job em streaming (ver streaming.py): o worker decodifica e processa o target
+        enquanto o upload ainda chega, e a saída volta em chunks enquanto é codificada.
+        """
+        source_future = arquivos['source']
+        source_path = None
+        job = None
+        target_receiver, target_future = arquivos['target']
+        input_path = target_receiver.file_path
+        output_path = str(TEMP_DIR / f"output_{job_id}.ts")
+        target_info = data.get('target') or {}
+        
+        async def watch_upload():
+            try:
+                await target_future
+                mark_upload_done(input_path, True)
+            except Exception:
+                mark_upload_done(input_path, False)
+        watcher = asyncio.create_task(watch_upload())
+        
+        try:
+            await websocket.send(json.dumps({
+                'comando': 'PROCESSANDO',
+                'job_id': job_id,
+                'progresso': 10,
+                'mensagem': 'Recebendo source...'
+            }))
+            source_sha, = await self.wait_inputs({'source': source_future})
+            source_path = self.store.checkout(source_sha, TEMP_DIR, f"source_{job_id}")
+            
+            # Anunciar o stream de saída; os chunks vão saindo enquanto o worker codifica
+            transfer_id = new_transfer_id()
+            await websocket.send(json.dumps({
+                'comando': 'STREAM_INICIO',
+                'job_id': job_id,
+                'transfer_id': transfer_id,
+                'progresso': 30,
+                'mensagem': 'Processando enquanto o upload continua...'
+            }))
+            job = asyncio.ensure_future(self.executor.run(
+                run_stream_job, source_path, input_path, build_job_config(data.get('config', {})), output_path,
+                int(target_info['largura']), int(target_info['altura']), float(target_info.get('fps') or 30.0)
+            ))
+            tamanho = await tail_file(websocket, output_path, transfer_id, job.done)
+            await job
+            
+            await websocket.send(json.dumps({
+                'comando': 'COMPLETO',
+                'job_id': job_id,
+                'progresso': 100,
+                'resultado': {'transfer_id': transfer_id, 'tamanho': tamanho},
+                'mensagem': 'Processamento concluído!'
+            }))
+        
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        except Exception as e:
+            await self.send_job_error(websocket, job_id, e)
+        finally:
+            if not target_future.done():
+                # Worker ainda lendo o upload: o marcador 'abort' o faz parar
+                mark_upload_done(input_path, False)
+            watcher.cancel()
+            if job is not None:
+                # O worker ainda pode estar lendo a entrada e escrevendo a saída: só apagar depois que ele sair
+                with suppress(Exception):
+                    await job
+            caminhos = [input_path, get_done_path(input_path), output_path]
+            if source_path:
+                caminhos.append(source_path)
+            for caminho in caminhos:
+                try:
+                    os.remove(caminho)
+                except OSError:
+                    pass
 
 
 async def main():
     """Inicia o servidor WebSocket."""
-    server = FileProcessingServer()
+    executor = create_executor_from_env()
+    server = FileProcessingServer(executor)
     
     print("=" * 60)
     print("Servidor VPS - Processamento Remoto com GPU")
@@ -289,6 +502,8 @@ async def main():
     print(f"Providers: {modules.globals.execution_providers}")
     print(f"Porta: 8765")
     print(f"Temp dir: {TEMP_DIR}")
+    print(f"Jobs: {executor.workers} worker(s) ({executor.mode}), fila de {executor.max_queue}")
+    print(f"Cache: {server.store.size / 1024 ** 3:.1f} de {server.store.max_bytes / 1024 ** 3:.0f} GB")
     print("=" * 60)
     
     # Pre-check
@@ -296,13 +511,17 @@ async def main():
         print("Pre-check falhou!")
         sys.exit(1)
     
-    # Inicializar frame processors
+    # Inicializar frame processors. No modo 'process' o pai só garante que os modelos estão
+    # baixados: quem carrega são os workers (init_worker), e uma cópia aqui só gastaria memória da GPU
     for frame_processor in get_frame_processors_modules(modules.globals.frame_processors):
-        if not frame_processor.pre_start():
+        pronto = frame_processor.pre_check() if executor.mode == 'process' else frame_processor.pre_start()
+        if not pronto:
             print(f"Falha ao inicializar {frame_processor.NAME}")
             sys.exit(1)
     
     modules.core.limit_resources()
+    # Os workers carregam os modelos agora, não no primeiro job
+    executor.start()
     
     # Iniciar servidor
     async with websockets.serve(
@@ -313,7 +532,10 @@ async def main():
         ping_timeout=10
     ):
         print("Servidor rodando. Aguardando conexões...")
-        await asyncio.Future()  # Manter rodando
+        try:
+            await asyncio.Future()  # Manter rodando
+        finally:
+            executor.shutdown()
 
 
 if __name__ == "__main__":
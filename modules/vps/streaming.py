@@ -0,0 +1,190 @@
+"""
+Processamento remoto em streaming: o servidor processa os frames enquanto o upload
+do target ainda está chegando e devolve o vídeo de saída conforme é codificado.
+
+    cliente: ffmpeg remuxa o target para MPEG-TS (-c copy) -> chunks binários
+    servidor: chunks -> arquivo de entrada .ts -> (worker) ffmpeg decodifica -> frame
+              processors -> ffmpeg codifica MPEG-TS -> arquivo de saída .ts -> chunks
+    cliente: chunks -> .ts local -> ffmpeg junta o vídeo com o áudio do target original
+
+Entre o event loop e o worker (outro processo) os dados passam por arquivos que
+crescem: o worker lê a entrada até o marcador de fim (.fim, 'ok' ou 'abort') e o
+event loop lê a saída enquanto o job não termina. MPEG-TS pode ser lido e escrito
+pela metade, ao contrário de MP4, que só é válido depois do moov atom.
+map_faces não funciona aqui, porque precisa analisar o vídeo inteiro antes.
+"""
+import os
+import json
+import time
+import asyncio
+import threading
+from typing import Any, Callable, Dict, List
+
+import modules.globals
+from modules.vps.protocol import CHUNK_SIZE, pack_chunk
+
+STREAM_POLL_INTERVAL = 0.05  # segundos entre leituras de um arquivo que ainda está crescendo
+STREAM_FORMAT = 'mpegts'
+STREAM_STALL_TIMEOUT = 300.0  # segundos sem dados nem marcador de fim até o worker desistir da entrada
+
+
+def get_done_path(input_path: str) -> str:
+    return input_path + '.fim'
+
+
+def mark_upload_done(input_path: str, ok: bool) -> None:
+    """Escrito pelo event loop quando o upload do target termina (ou é interrompido)."""
+    with open(get_done_path(input_path), 'w') as marker:
+        marker.write('ok' if ok else 'abort')
+
+
+def feed_growing_file(input_path: str, destination: Any, errors: List[Exception]) -> None:
+    """
+    Copia o arquivo de entrada para o decoder conforme ele cresce, até o marcador de fim.
+    Sem marcador, desiste se o arquivo foi apagado (o servidor limpou o job) ou se nada
+    chega por STREAM_STALL_TIMEOUT segundos, para o worker nunca ficar preso.
+    """
+    done_path = get_done_path(input_path)
+    try:
+        with open(input_path, 'rb') as file:
+            last_data = time.monotonic()
+            while True:
+                data = file.read(CHUNK_SIZE)
+                if data:
+                    destination.write(data)
+                    last_data = time.monotonic()
+                    continue
+                if not os.path.exists(done_path):
+                    if not os.path.exists(input_path):
+                        raise Exception("Arquivo de entrada removido antes do fim do upload")
+                    if time.monotonic() - last_data > STREAM_STALL_TIMEOUT:
+                        raise Exception(f"Upload do target parado há mais de {STREAM_STALL_TIMEOUT:.0f}s")
+                    time.sleep(STREAM_POLL_INTERVAL)
+                    continue
+                with open(done_path) as marker:
+                    if marker.read().strip() != 'ok':
+                        raise Exception("Upload do target interrompido")
+                # o marcador só é escrito depois do último chunk, então o que falta já está no arquivo
+                data = file.read()
+                if not data:
+                    break
+                destination.write(data)
+    except Exception as e:
+        errors.append(e)
+    finally:
+        try:
+            destination.close()
+        except Exception:
+            pass
+
+
+def run_stream_job(source_path: str, input_path: str, job_config: Dict[str, Any], output_path: str,
+                   width: int, height: int, fps: float) -> str:
+    """Roda num processo do pool (ver job_executor): decodifica, processa e codifica enquanto a entrada cresce."""
+    import cv2
+    import numpy
+    from modules.utilities import open_stream_decoder, iter_raw_frames, open_video_writer, close_video_writer
+    from modules.processors.frame.core import (
+        get_video_frame_processors, process_frame_stream, finish_video_frame_processors, cancel_video_frame_processors
+    )
+    from modules.vps.job_executor import apply_job_config
+
+    apply_job_config(job_config)
+    if modules.globals.map_faces:
+        raise Exception("map_faces precisa do vídeo inteiro e não funciona em streaming")
+
+    frame_processors = get_video_frame_processors(source_path)
+    decoder = open_stream_decoder(STREAM_FORMAT)
+    feeder_errors: List[Exception] = []
+    feeder = threading.Thread(target=feed_growing_file, args=(input_path, decoder.stdin, feeder_errors), daemon=True)
+    feeder.start()
+    writer = open_video_writer(output_path, width, height, fps, output_path=output_path, output_format=STREAM_FORMAT)
+
+    def write_frame(temp_frame: Any) -> None:
+        if temp_frame.shape[:2] != (height, width):
+            temp_frame = cv2.resize(temp_frame, (width, height))
+        writer.stdin.write(numpy.ascontiguousarray(temp_frame, dtype=numpy.uint8).tobytes())
+
+    complete = False
+    try:
+        complete = process_frame_stream(frame_processors, iter_raw_frames(decoder.stdout, width, height), write_frame)
+    except BrokenPipeError:
+        raise Exception("O encoder fechou o pipe de frames")
+    finally:
+        decoder.stdout.close()
+        if decoder.poll() is None:
+            decoder.kill()
+        decoder.wait()
+        feeder.join(timeout=1.0)
+        encoded = close_video_writer(writer)
+        if not complete:
+            cancel_video_frame_processors(frame_processors)
+    if feeder_errors or not encoded:
+        cancel_video_frame_processors(frame_processors)
+        raise feeder_errors[0] if feeder_errors else Exception("Falha ao codificar o vídeo de saída")
+    finish_video_frame_processors(frame_processors)
+    return output_path
+
+
+async def tail_file(websocket: Any, file_path: str, transfer_id: str, finished: Callable[[], bool]) -> int:
+    """
+    Manda o arquivo em chunks enquanto outro processo ainda o escreve, até finished() e
+    não sobrar nada para ler. Retorna quantos bytes foram enviados.
+    """
+    index = 0
+    sent = 0
+    file = None
+    try:
+        while True:
+            if file is None and os.path.exists(file_path):
+                file = open(file_path, 'rb')
+            # checado antes de ler: tudo que foi escrito até aqui ainda é lido nesta volta
+            done = finished()
+            payload = file.read(CHUNK_SIZE) if file is not None else b''
+            if payload:
+                await websocket.send(pack_chunk(transfer_id, index, payload))
+                index += 1
+                sent += len(payload)
+                continue
+            if done:
+                return sent
+            await asyncio.sleep(STREAM_POLL_INTERVAL)
+    finally:
+        if file is not None:
+            file.close()
+
+
+async def send_remuxed_target(websocket: Any, target_path: str, transfer_id: str) -> None:
+    """
+    Lado do cliente: remuxa o vídeo do target para MPEG-TS (sem recodificar) e manda a
+    saída do ffmpeg em chunks assim que ela sai. Termina com UPLOAD_FIM, ou UPLOAD_ERRO
+    se o ffmpeg falhar, para o servidor não ficar esperando.
+    """
+    process = await asyncio.create_subprocess_exec(
+        'ffmpeg', '-hide_banner', '-loglevel', modules.globals.log_level,
+        '-i', target_path, '-map', '0:v:0', '-c:v', 'copy', '-f', STREAM_FORMAT, 'pipe:1',
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL
+    )
+    ok = False
+    try:
+        index = 0
+        while True:
+            payload = await process.stdout.read(CHUNK_SIZE)
+            if not payload:
+                break
+            await websocket.send(pack_chunk(transfer_id, index, payload))
+            index += 1
+        ok = await process.wait() == 0
+    finally:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        await websocket.send(json.dumps({'comando': 'UPLOAD_FIM' if ok else 'UPLOAD_ERRO', 'transfer_id': transfer_id}))
+
+
+def mux_stream_output(video_path: str, target_path: str, output_path: str) -> bool:
+    """Lado do cliente: junta o vídeo processado (.ts) com o áudio do target original."""
+    from modules.utilities import run_ffmpeg
+
+    audio = ['-map', '1:a:0?'] if modules.globals.keep_audio else []
+    return run_ffmpeg(['-i', video_path, '-i', target_path, '-map', '0:v:0', *audio, '-c:v', 'copy', '-y', output_path])